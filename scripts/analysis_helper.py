@@ -1,176 +1,179 @@
+import importlib
+from collections import namedtuple
+
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
-from scipy import stats
-from collections import namedtuple
-from statsmodels.graphics.gofplots import qqplot
+
+# plots (matplotlib, statsmodels) and tests (scipy) live in analysis_plots and analysis_stats, so
+# importing Data, the counts and the odds ratio math stays cheap for batch jobs. they are loaded on
+# first use through __getattr__, so analysis_helper.plot_hist(...) and friends keep working
+LAZY_MODULES = ('analysis_stats', 'analysis_plots')
+
+OPIATE_COL = 'opiates'
+OPIATE_GROUP_NAMES = {0: 'non_opiate', 1: 'opiate'}
+
+Group = namedtuple('Group', ['name', 'data', 'axis'])
+Summary = namedtuple('Summary', ['n', 'mean', 'median', 'std_dev', 'var', 'sorted_values', 'hist_counts', 'hist_edges'])
 
 
 class Data:
-	def __init__(self, pth):
-		self.__raw_df = self.__load_data(pth)
-		self.opiate, self.non_opiates = self.split_and_adjust_data()
+	"""
+	outcome frame split into groups by one groupby over `by`: a column name, a list of column names and/or
+	Series (e.g. ['opiates', 'admission_type'] or ['opiates', pd.cut(df.age, [18, 45, 65, 90])]).
+	every stat/plot compares each exposed group against the reference group, which is the first group in
+	sorted key order unless `reference` (a group key) is given. the default split on opiates keeps the
+	original names: data.non_opiates is the reference and data.opiate the exposed group.
+	a Series in `by` is stored as a column of raw_df (named after the Series, or <name>_group when raw_df
+	already has a different column of that name) and `by` holds the column name, so trimmed, matched and
+	resampled copies of raw_df keep their keys
+	"""
+	def __init__(self, pth=None, df=None, by='opiates', reference=None):
+		self.__summaries = {}
+		df = self.__load_data(pth) if df is None else df
+		self.by, df = self.__resolve_by(by, df)
+		self.reference_key = reference
+		self.raw_df = df
+
+	@staticmethod
+	def __resolve_by(by, df):
+		keys = by if isinstance(by, list) else [by]
+		series = [(i, key) for i, key in enumerate(keys) if isinstance(key, pd.Series)]
+		if not series:
+			return by, df
+		keys, columns = list(keys), {}
+		for i, key in series:
+			name = 'by_%d' % i if key.name is None else str(key.name)
+			if name in df and not df[name].equals(key):
+				name = '%s_group' % name
+			columns[name] = key
+			keys[i] = name
+		# assign aligns every Series on the frame's index, and copies rather than edit the caller's frame
+		return (keys if isinstance(by, list) else keys[0]), df.assign(**columns)
 
 	def __load_data(self, pth):
 		default_idx = 'Unnamed: 0'
 		df = pd.read_csv(pth, index_col=default_idx)
 		return df
 
-	def split_and_adjust_data(self):
-		print("splitting into opiate/non-opiate samples...")
-		opiate_col = 'opiates'
+	@property
+	def raw_df(self):
+		return self.__raw_df
 
-		df = self.__raw_df
-		is_opiate = df[opiate_col] == 1
-		is_not_opiate = df[opiate_col] == 0
-		df_opiate = df[is_opiate]
-		df_non_opiate = df[is_not_opiate]
+	@raw_df.setter
+	def raw_df(self, df):
+		"""replacing the frame re-splits the groups and drops every memoized summary"""
+		self.__raw_df = df
+		self.groups = self.split_and_adjust_data()
+		self.invalidate()
 
-		Group = namedtuple('group', ['name', 'data', 'axis'])
-		group_non_opiate = Group(name='non_opiate', data=df_non_opiate, axis=0)
-		group_opiate = Group(name='opiate', data=df_opiate, axis=1)
-		return group_opiate, group_non_opiate
+	@property
+	def reference(self):
+		return self.groups[self.__reference_axis]
 
+	@property
+	def exposed(self):
+		return [group for group in self.groups if group.axis != self.__reference_axis]
 
-def descript(series, verbose=True):
-	samples = len(series)
-	mean = np.mean(series)
-	median = np.median(series)
-	std_dev = np.std(series)
-	var = np.var(series)
+	def __key_names(self):
+		by = self.by if isinstance(self.by, list) else [self.by]
+		return [key if isinstance(key, str) else key.name for key in by]
+
+	def __group_name(self, key):
+		names = self.__key_names()
+		if names == [OPIATE_COL] and key[0] in OPIATE_GROUP_NAMES:
+			return OPIATE_GROUP_NAMES[key[0]]
+		return '|'.join('%s=%s' % (name, value) for name, value in zip(names, key))
 
+	def split_and_adjust_data(self):
+		print("splitting into groups by %s..." % ', '.join(str(name) for name in self.__key_names()))
+		grouped = self.__raw_df.groupby(self.by, sort=True)
+		# group axis of every row (-1 for rows with a missing key), for grouped reductions over the whole frame
+		self.group_codes = grouped.ngroup().fillna(-1).astype(int).values
+		groups = []
+		keys = []
+		for axis, (key, df_group) in enumerate(grouped):
+			key = key if isinstance(key, tuple) else (key,)
+			keys.append(key)
+			groups.append(Group(name=self.__group_name(key), data=df_group, axis=axis))
+
+		reference = self.reference_key
+		if reference is None:
+			self.__reference_axis = 0
+		else:
+			self.__reference_axis = keys.index(reference if isinstance(reference, tuple) else (reference,))
+
+		# keep the original binary attributes for the default opiate split
+		names = dict((group.name, group) for group in groups)
+		self.opiate = names.get(OPIATE_GROUP_NAMES[1])
+		self.non_opiates = names.get(OPIATE_GROUP_NAMES[0])
+		return groups
+
+	def stratify(self, by, reference=None):
+		"""regroup the same frame (no csv re-read), e.g. data.stratify(['opiates', 'admission_type'])"""
+		return Data(df=self.__raw_df, by=by, reference=reference)
+
+	def summary(self, group, col):
+		"""memoized summarize() of col within group. call invalidate() after editing group frames in place"""
+		key = (group.name, col)
+		if key not in self.__summaries:
+			self.__summaries[key] = summarize(group.data[col])
+		return self.__summaries[key]
+
+	def invalidate(self, col=None):
+		"""drop memoized summaries, for every column or only col"""
+		if col is None:
+			self.__summaries.clear()
+		else:
+			for key in [key for key in self.__summaries if key[1] == col]:
+				del self.__summaries[key]
+
+
+def summarize(series, bins=10):
+	"""moments, sorted values (for percentiles and ranks) and histogram of a series, NaNs dropped"""
+	sorted_values = np.sort(series.dropna().values.astype(float))
+	samples = len(sorted_values)
+	hist_counts, hist_edges = np.histogram(sorted_values, bins=bins)
+	if not samples:
+		# an empty group (or all NaN) has no moments, rather than an IndexError from the median
+		return Summary(n=0, mean=np.nan, median=np.nan, std_dev=np.nan, var=np.nan,
+					   sorted_values=sorted_values, hist_counts=hist_counts, hist_edges=hist_edges)
+	mean = sorted_values.mean()
+	var = sorted_values.var()
+	return Summary(n=samples, mean=mean, median=sorted_percentile(sorted_values, 50), std_dev=np.sqrt(var), var=var,
+				   sorted_values=sorted_values, hist_counts=hist_counts, hist_edges=hist_edges)
+
+
+def sorted_percentile(sorted_values, q):
+	"""np.percentile (linear interpolation) of an already sorted array, without re-partitioning it"""
+	position = np.asarray(q, dtype=float) / 100.0 * (len(sorted_values) - 1)
+	lower = np.floor(position).astype(int)
+	upper = np.minimum(lower + 1, len(sorted_values) - 1)
+	fraction = position - lower
+	return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * fraction
+
+
+def print_descript(summary):
 	descript = "\t\t\t--- Descriptive Stats --- \n N={samples} MEAN={mean} MEDIAN={median} " \
 			   "STD.DEV={std_dev} VARIANCE={var}\n"""
-	fmt_str = descript.format(samples=samples, mean=mean, median=median, std_dev=std_dev, var=var)
+	print(descript.format(samples=summary.n, mean=summary.mean, median=summary.median,
+						  std_dev=summary.std_dev, var=summary.var))
+
+
+def descript(series, verbose=True):
+	summary = summarize(series)
 	if verbose:
-		print(fmt_str)
-
-	return mean, median, std_dev, var
-
-
-def pie_chart(data, col):
-	def do_plot(df, ax, group):
-		yes = df[df[col] == 1]
-		no = df[df[col] == 0]
-
-		total_num = len(df)
-		yes_float = float(len(yes)) / float(total_num)
-		no_float = float(len(no)) / float(total_num)
-		yes_num = round(yes_float, 2) * 100
-		no_num = round(no_float, 2) * 100
-
-		sizes = [yes_num, no_num]
-		explode = (0, 0.1)  # only "explode" the 1st slice (i.e. 'yes')
-
-		labels = ['yes_%s' % col, 'no_%s' % col]
-		ax.pie(sizes, explode=explode, labels=labels, autopct='%1.1f%%', shadow=True, startangle=90)
-		ax.axis('equal')  # Equal aspect ratio ensures that pie is drawn as a circle.
-		ax.set_title('%s_%s' % (group, col))
-
-	fig, axes = plt.subplots(nrows=1, ncols=2)
-	fig.set_size_inches(13, 5)
-	do_plot(df=data.non_opiates.data, ax=axes[data.non_opiates.axis], group=data.non_opiates.name)
-	do_plot(df=data.opiate.data, ax=axes[data.opiate.axis], group=data.opiate.name)
-
-
-def plot_hist(data, col):
-	def do_plot(df, ax, group):
-		df_outcome = df[col]
-		mean, median, _, _ = descript(df_outcome)
-		df_outcome.hist(ax=ax, bins=10)
-		ax.set_xlabel(col)
-		ax.set_ylabel('count')
-		ax.set_title('%s_%s' % (group, col))
-		ax.axvline(mean, color='g')
-		ax.axvline(median, color='y')
-
-	fig, axes = plt.subplots(nrows=1, ncols=2)
-	fig.set_size_inches(13, 5)
-
-	print("\t\t\t*** Info for: %s group ***" % data.non_opiates.name)
-	do_plot(df=data.non_opiates.data, ax=axes[data.non_opiates.axis], group=data.non_opiates.name)
-	print("\t\t\t***Info for: %s group ***" % data.opiate.name)
-	do_plot(df=data.opiate.data, ax=axes[data.opiate.axis], group=data.opiate.name)
-	print("\t\t\t\t\t{HISTOGRAMS}")
-	plt.show()
-
-
-def plot_percents(data, col):
-	p_centiles = [10, 20, 30, 40, 50, 60, 70, 80, 90, 99]
-	non_data_centiles = np.percentile(data.non_opiates.data[col], p_centiles)
-	op_data_centiles = np.percentile(data.opiate.data[col], p_centiles)
-
-	df = pd.DataFrame({'percentiles': p_centiles, 'opiates': op_data_centiles, 'non_opiates': non_data_centiles})
-	fig, axes = plt.subplots(nrows=1, ncols=1)
-	fig.set_size_inches(6, 6)
-
-	plt.plot('percentiles', 'opiates', data=df, axes=axes)
-	plt.plot('percentiles', 'non_opiates', data=df, axes=axes)
-	axes.set_xlabel("Percentiles")
-	axes.set_ylabel("Length of Stay (LOS) in Days for %s" % col)
-	axes.set_title("Percentiles of %s Relative to Opiates on Admission" % col)
-	plt.legend()
-
-
-def plot_qq(data, col):
-	def do_plot(df, ax, group):
-		df_outcome = df[col]
-		qqplot(df_outcome, line='s', ax=ax)
-		ax.set_title('%s_%s' % (group, col))
-
-	fig, axes = plt.subplots(nrows=1, ncols=2)
-	fig.set_size_inches(13, 5)
-	do_plot(df=data.opiate.data, ax=axes[data.opiate.axis], group=data.opiate.name)
-	do_plot(df=data.non_opiates.data, ax=axes[data.non_opiates.axis], group=data.non_opiates.name)
-	print("\t\t\t\t\t{Q-Q PLOTS}")
-	plt.show()
-
-
-def check_p_val(pval, alpha):
-	if pval > alpha:
-		print('Pval=%s greater than alpha=%.3f. Same distribution (fail to reject H0)' % (pval, alpha))
-	else:
-		print('Pval=%s less than alpha=%.3f. Different distribution (reject H0)' % (pval, alpha))
-
-
-def do_normality(data, col, alpha=0.05):
-	def do_kstest(series):
-		data_mean, _, data_std, _ = descript(series, verbose=False)
-		test_stat = stats.kstest(series, 'norm', args=(data_mean, data_std))
-		return test_stat
-
-	print("\n\t\t\t{Kolmogorov-Smirnov Test for Normality}")
-	print("Non opiate samples")
-	stat_non_opiate, p_non_opiate = do_kstest(data.non_opiates.data[col])
-	check_p_val(p_non_opiate, alpha)
-	print("Opiate samples")
-	stat_opiate, p_opiate = do_kstest(data.opiate.data[col])
-	check_p_val(p_opiate, alpha)
-
-
-def do_mannwhitney(data, col, test='greater', alpha=0.05):
-	print("\n\t\t\t{Mann Whitney U-test Comparing %s between opiate/non-opiate use on admission}" % col)
-	stat, p = stats.mannwhitneyu(data.opiate.data[col], data.non_opiates.data[col], alternative=test)
-	print('Statistics=%s, p=%.3f' % (stat, p))
-	check_p_val(p, alpha)
-
-
-def do_chisquare(table, alpha=0.05):
-	stat, p, dof, expected = stats.chi2_contingency(table)
-	print("observed data=%s" % table)
-	print("expected data=%s" % expected)
-	print('Statistics=%s, p=%.3f' % (stat, p))
-	check_p_val(p, alpha)
-
-
-def create_table(df, col):
-	non = df.non_opiates
-	control_true = len(non.data[non.data[col] == 1])
-	control_false = len(non.data[non.data[col] == 0])
-
-	op = df.opiate
-	exposed_true = len(op.data[op.data[col] == 1])
-	exposed_false = len(op.data[op.data[col] == 0])
+		print_descript(summary)
+
+	return summary.mean, summary.median, summary.std_dev, summary.var
+
+
+def create_table(df, col, group=None):
+	"""2x2 table of col for group (default: the only exposed group, i.e. opiate) against the reference group"""
+	counts = count_outcomes(df, [col])
+	group = group or df.exposed[0]
+	counts = counts[counts.group == group.name].iloc[0]
+	exposed_true, exposed_false = int(counts.exposed_true), int(counts.exposed_false)
+	control_true, control_false = int(counts.control_true), int(counts.control_false)
 
 	Group = namedtuple('table', ['exposed_true', 'exposed_false', 'control_true', 'control_false'])
 	table = Group(exposed_true=exposed_true, exposed_false=exposed_false, control_true=control_true, control_false=control_false)
@@ -178,31 +181,55 @@ def create_table(df, col):
 	return table, arr
 
 
-def do_odds_ratio(group, name, z=1.96):
-	def get_odds_ratio():
-		top = float(group.exposed_true) / float(group.control_true)
-		bottom = float(group.exposed_false) / float(group.control_false)
-		odds_ratio = top / bottom
-		return odds_ratio
-
-	def get_odds_std_err():
-		frac_exposed_true = 1.0 / float(group.exposed_true)
-		frac_control_true = 1.0 / float(group.control_true)
-		frac_exposed_false = 1.0 / float(group.exposed_false)
-		frac_control_false = 1.0 / float(group.control_false)
-
-		std_err = np.sqrt(frac_exposed_true + frac_control_true + frac_exposed_false + frac_control_false)
-		return std_err
-
-	odds_ratio = get_odds_ratio()
+def count_outcomes(data, cols):
+	"""
+	2x2 counts of every binary outcome col for every exposed group against the reference group, from one
+	grouped sum over the whole frame instead of four filters per col and group
+	"""
+	outcomes = data.raw_df[cols]
+	trues = outcomes.eq(1).groupby(data.group_codes).sum()
+	falses = outcomes.eq(0).groupby(data.group_codes).sum()
+
+	control = data.reference.axis
+	counts = []
+	for group in data.exposed:
+		counts.append(pd.DataFrame({
+			'group': group.name,
+			'exposed_true': trues.loc[group.axis],
+			'exposed_false': falses.loc[group.axis],
+			'control_true': trues.loc[control],
+			'control_false': falses.loc[control]}))
+	return pd.concat(counts)
+
+
+def odds_ratio_ci(exposed_true, exposed_false, control_true, control_false, z=1.96):
+	"""vectorized odds ratio and wald CI. tables with an empty cell get the haldane +0.5 correction"""
+	cells = np.array([exposed_true, exposed_false, control_true, control_false], dtype=float)
+	has_zero = (cells == 0).any(axis=0)
+	cells = cells + np.where(has_zero, 0.5, 0.0)
+	et, ef, ct, cf = cells
+
+	odds_ratio = (et / ct) / (ef / cf)
+	std_err = np.sqrt(1.0 / et + 1.0 / ct + 1.0 / ef + 1.0 / cf)
 	ln_odds_ratio = np.log(odds_ratio)
-	std_err = get_odds_std_err()
-	ln_upper = ln_odds_ratio + (z * std_err)
-	ln_lower = ln_odds_ratio - (z * std_err)
+	lower = np.exp(ln_odds_ratio - (z * std_err))
+	upper = np.exp(ln_odds_ratio + (z * std_err))
+	return odds_ratio, lower, upper
+
 
-	upper = np.exp(ln_upper)
-	lower = np.exp(ln_lower)
+def do_odds_ratio(group, name, z=1.96):
+	odds_ratio, lower, upper = odds_ratio_ci(group.exposed_true, group.exposed_false,
+											 group.control_true, group.control_false, z=z)
 
 	print("Odds Ratio: %.3f" % odds_ratio)
 	print("Subjects with opiates on admission have %.3f times the odds of %s compared to those without opiates on admission" % (odds_ratio, name))
-	print("95%% CI for Odds Ratio: [%.3f, %.3f]" % (lower, upper))
\ No newline at end of file
+	print("95%% CI for Odds Ratio: [%.3f, %.3f]" % (lower, upper))
+
+
+def __getattr__(name):
+	if not name.startswith('__'):
+		for module_name in LAZY_MODULES:
+			module = importlib.import_module(module_name)
+			if hasattr(module, name):
+				return getattr(module, name)
+	raise AttributeError("module %r has no attribute %r" % (__name__, name))
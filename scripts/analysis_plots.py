@@ -0,0 +1,101 @@
+"""
+Plots of analysis_helper.Data groups. Split out of analysis_helper so that matplotlib (and statsmodels,
+only needed by the q-q plots) are imported by notebooks that draw, not by every batch job.
+"""
+import matplotlib.pyplot as plt
+
+import analysis_helper
+
+
+def __group_axes(data, ax_width=6.5, ax_height=5):
+	"""one row of axes, one per group"""
+	fig, axes = plt.subplots(nrows=1, ncols=len(data.groups), squeeze=False)
+	fig.set_size_inches(ax_width * len(data.groups), ax_height)
+	return axes[0]
+
+
+def draw_pie_chart(data, col, axes):
+	def do_plot(df, ax, group):
+		yes = df[df[col] == 1]
+		no = df[df[col] == 0]
+
+		total_num = len(df)
+		yes_float = float(len(yes)) / float(total_num)
+		no_float = float(len(no)) / float(total_num)
+		yes_num = round(yes_float, 2) * 100
+		no_num = round(no_float, 2) * 100
+
+		sizes = [yes_num, no_num]
+		explode = (0, 0.1)  # only "explode" the 1st slice (i.e. 'yes')
+
+		labels = ['yes_%s' % col, 'no_%s' % col]
+		ax.pie(sizes, explode=explode, labels=labels, autopct='%1.1f%%', shadow=True, startangle=90)
+		ax.axis('equal')  # Equal aspect ratio ensures that pie is drawn as a circle.
+		ax.set_title('%s_%s' % (group, col))
+
+	for group in data.groups:
+		do_plot(df=group.data, ax=axes[group.axis], group=group.name)
+
+
+def pie_chart(data, col):
+	draw_pie_chart(data, col, __group_axes(data))
+
+
+def draw_hist(data, col, axes, verbose=False):
+	def do_plot(group, ax):
+		summary = data.summary(group, col)
+		if verbose:
+			analysis_helper.print_descript(summary)
+		ax.hist(summary.hist_edges[:-1], bins=summary.hist_edges, weights=summary.hist_counts)
+		ax.grid(True)
+		ax.set_xlabel(col)
+		ax.set_ylabel('count')
+		ax.set_title('%s_%s' % (group.name, col))
+		ax.axvline(summary.mean, color='g')
+		ax.axvline(summary.median, color='y')
+
+	for group in data.groups:
+		if verbose:
+			print("\t\t\t*** Info for: %s group ***" % group.name)
+		do_plot(group=group, ax=axes[group.axis])
+
+
+def plot_hist(data, col):
+	draw_hist(data, col, __group_axes(data), verbose=True)
+	print("\t\t\t\t\t{HISTOGRAMS}")
+	plt.show()
+
+
+def draw_percents(data, col, ax):
+	p_centiles = [10, 20, 30, 40, 50, 60, 70, 80, 90, 99]
+	for group in data.groups:
+		data_centiles = analysis_helper.sorted_percentile(data.summary(group, col).sorted_values, p_centiles)
+		ax.plot(p_centiles, data_centiles, label=group.name)
+	ax.set_xlabel("Percentiles")
+	ax.set_ylabel("Length of Stay (LOS) in Days for %s" % col)
+	ax.set_title("Percentiles of %s Relative to Opiates on Admission" % col)
+	ax.legend()
+
+
+def plot_percents(data, col):
+	fig, axes = plt.subplots(nrows=1, ncols=1)
+	fig.set_size_inches(6, 6)
+	draw_percents(data, col, axes)
+
+
+def draw_qq(data, col, axes):
+	from statsmodels.graphics.gofplots import qqplot
+
+	def do_plot(df, ax, group):
+		df_outcome = df[col]
+		qqplot(df_outcome, line='s', ax=ax)
+		ax.set_title('%s_%s' % (group, col))
+
+	for group in data.groups:
+		do_plot(df=group.data, ax=axes[group.axis], group=group.name)
+
+
+def plot_qq(data, col):
+	draw_qq(data, col, __group_axes(data))
+	print("\t\t\t\t\t{Q-Q PLOTS}")
+	plt.show()
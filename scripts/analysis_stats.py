@@ -0,0 +1,163 @@
+"""
+Hypothesis tests of analysis_helper.Data groups. Split out of analysis_helper so that scipy is only
+imported by the jobs that run tests.
+"""
+import pandas as pd
+import numpy as np
+from scipy import stats
+
+import analysis_helper
+
+
+def check_p_val(pval, alpha):
+	if pval > alpha:
+		print('Pval=%s greater than alpha=%.3f. Same distribution (fail to reject H0)' % (pval, alpha))
+	else:
+		print('Pval=%s less than alpha=%.3f. Different distribution (reject H0)' % (pval, alpha))
+
+
+def kstest_normal(summary):
+	"""one sample KS test against a normal with the sample's own mean/std, same as stats.kstest(series, 'norm', ...)"""
+	n = summary.n
+	cdf = stats.norm.cdf(summary.sorted_values, summary.mean, summary.std_dev)
+	d_plus = (np.arange(1, n + 1) / float(n) - cdf).max()
+	d_minus = (cdf - np.arange(0, n) / float(n)).max()
+	stat = max(d_plus, d_minus)
+	pval = np.clip(stats.kstwo.sf(stat, n), 0, 1)
+	return stat, pval
+
+
+def mannwhitney_sorted(x, y, alternative='greater'):
+	"""
+	mann whitney u-test of two sorted samples. midranks come from binary searches into both sorted arrays
+	instead of re-sorting the pooled sample. same result as stats.mannwhitneyu (asymptotic, tie and
+	continuity corrected); tiny samples are handed to scipy for the exact test
+	"""
+	n1, n2 = len(x), len(y)
+	if min(n1, n2) <= 8:
+		return stats.mannwhitneyu(x, y, alternative=alternative)
+
+	below = np.searchsorted(x, x, 'left') + np.searchsorted(y, x, 'left')
+	below_or_equal = np.searchsorted(x, x, 'right') + np.searchsorted(y, x, 'right')
+	rank_sum = ((below + below_or_equal + 1) / 2.0).sum()
+	u1 = rank_sum - n1 * (n1 + 1) / 2.0
+	u2 = n1 * n2 - u1
+
+	# merging two sorted runs is linear with a stable sort
+	pooled = np.sort(np.concatenate([x, y]), kind='stable')
+	breaks = np.flatnonzero(np.concatenate([[True], pooled[1:] != pooled[:-1], [True]]))
+	ties = np.diff(breaks).astype(float)
+	n = float(n1 + n2)
+	std_dev = np.sqrt(n1 * n2 / 12.0 * ((n + 1) - (ties ** 3 - ties).sum() / (n * (n - 1))))
+	mean = n1 * n2 / 2.0
+
+	if alternative == 'greater':
+		pval = stats.norm.sf((u1 - mean - 0.5) / std_dev)
+	elif alternative == 'less':
+		pval = stats.norm.sf((u2 - mean - 0.5) / std_dev)
+	else:
+		pval = min(1.0, 2 * stats.norm.sf((max(u1, u2) - mean - 0.5) / std_dev))
+	return u1, pval
+
+
+def do_normality(data, col, alpha=0.05):
+	print("\n\t\t\t{Kolmogorov-Smirnov Test for Normality}")
+	for group in data.groups:
+		print("%s samples" % group.name)
+		stat, p = kstest_normal(data.summary(group, col))
+		check_p_val(p, alpha)
+
+
+def do_mannwhitney(data, col, test='greater', alpha=0.05):
+	control = data.reference
+	for group in data.exposed:
+		print("\n\t\t\t{Mann Whitney U-test Comparing %s between %s/%s}" % (col, group.name, control.name))
+		stat, p = mannwhitney_sorted(data.summary(group, col).sorted_values,
+									 data.summary(control, col).sorted_values, alternative=test)
+		print('Statistics=%s, p=%.3f' % (stat, p))
+		check_p_val(p, alpha)
+
+
+def do_chisquare(table, alpha=0.05):
+	stat, p, dof, expected = stats.chi2_contingency(table)
+	print("observed data=%s" % table)
+	print("expected data=%s" % expected)
+	print('Statistics=%s, p=%.3f' % (stat, p))
+	check_p_val(p, alpha)
+
+
+def __chisquare_2x2(counts):
+	"""chi-square test with yates correction for a stack of 2x2 tables (same as stats.chi2_contingency)"""
+	observed = counts[['exposed_true', 'exposed_false', 'control_true', 'control_false']].values.astype(float)
+	observed = observed.reshape(-1, 2, 2)
+	row_totals = observed.sum(axis=2, keepdims=True)
+	col_totals = observed.sum(axis=1, keepdims=True)
+	expected = row_totals * col_totals / observed.sum(axis=(1, 2), keepdims=True)
+
+	diff = expected - observed
+	observed = observed + np.sign(diff) * np.minimum(0.5, np.abs(diff))
+	with np.errstate(divide='ignore', invalid='ignore'):
+		stat = ((observed - expected) ** 2 / expected).sum(axis=(1, 2))
+	pval = stats.chi2.sf(stat, 1)
+	return stat, pval
+
+
+def __compare_binary(data, cols, z):
+	counts = analysis_helper.count_outcomes(data, cols)
+	stat, pval = __chisquare_2x2(counts)
+	odds_ratio, lower, upper = analysis_helper.odds_ratio_ci(counts.exposed_true.values, counts.exposed_false.values,
+															 counts.control_true.values, counts.control_false.values,
+															 z=z)
+	df = counts.reset_index().rename(columns={'index': 'outcome'})
+	df['test'] = 'chisquare'
+	df['statistic'] = stat
+	df['pval'] = pval
+	df['odds_ratio'] = odds_ratio
+	df['ci_lower'] = lower
+	df['ci_upper'] = upper
+	return df
+
+
+def __compare_continuous(data, cols, test):
+	rows = []
+	control = data.reference
+	for col in cols:
+		control_summary = data.summary(control, col)
+		for group in data.exposed:
+			exposed_summary = data.summary(group, col)
+			stat, pval = mannwhitney_sorted(exposed_summary.sorted_values, control_summary.sorted_values,
+											alternative=test)
+			rows.append({'outcome': col,
+						 'group': group.name,
+						 'test': 'mannwhitney_%s' % test,
+						 'statistic': stat,
+						 'pval': pval,
+						 'exposed_median': exposed_summary.median,
+						 'control_median': control_summary.median})
+	return pd.DataFrame(rows)
+
+
+def compare_outcomes(data, cols, test='greater', alpha=0.05, z=1.96):
+	"""
+	screen many outcomes in one call. binary (0/1) cols get a chi-square test plus odds ratio/CI,
+	all other cols get a mann whitney u-test. returns one tidy row per outcome and exposed group,
+	each compared against the reference group
+	"""
+	is_binary = data.raw_df[cols].isin([0, 1]).all()
+	binary_cols = [col for col in cols if is_binary[col]]
+	continuous_cols = [col for col in cols if not is_binary[col]]
+
+	results = []
+	if binary_cols:
+		results.append(__compare_binary(data, binary_cols, z))
+	if continuous_cols:
+		results.append(__compare_continuous(data, continuous_cols, test))
+
+	columns = ['outcome', 'group', 'test', 'statistic', 'pval', 'reject_h0', 'odds_ratio', 'ci_lower', 'ci_upper',
+			   'exposed_true', 'exposed_false', 'control_true', 'control_false', 'exposed_median', 'control_median']
+	df = pd.concat(results, ignore_index=True, sort=False)
+	df['reject_h0'] = df.pval <= alpha
+	df = df.reindex(columns=columns)
+	order = dict((col, i) for i, col in enumerate(cols))
+	df['order'] = df.outcome.map(order)
+	return df.sort_values(['order', 'group'], kind='stable').drop(columns='order').reset_index(drop=True)
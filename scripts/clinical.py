@@ -0,0 +1,188 @@
+"""
+Phase three clinical linkage: min/max/mean of first-day vitals (chartevents) and labs (labevents)
+per ICU stay, for the window [intime, intime + hours].
+
+Both tables are far too big to pull into pandas, so there are two ways to get the aggregates,
+giving the same wide table (<variable>_min, <variable>_max, <variable>_mean per icustay_id):
+
+    how='sql'     the whole aggregate is pushed down into one grouped query
+    how='stream'  only the windowed (icustay_id, variable, value) rows are extracted, through a
+                  server-side cursor, and folded chunk by chunk into a WindowAggregator. memory is
+                  bounded by the chunk size plus one row of running totals per stay and variable
+
+The sql path is the default. The stream path suits servers that cancel long-running queries
+and aggregates that are easier to write in pandas than in sql.
+Both paths drop values outside the itemids valid ranges in window_events.
+"""
+import uuid
+
+import pandas as pd
+
+import itemids
+import notebook_helper
+import queries
+
+STAY_KEYS = ['subject_id', 'hadm_id', 'icustay_id']
+STATS = ['min', 'max', 'mean']
+
+# chartevents and labevents differ in how events reach a stay: chartevents carry the
+# icustay_id, labevents only the admission
+SOURCES = {
+    'vitals': dict(table='chartevents', variables=itemids.vitals, ranges=itemids.vital_ranges,
+                   join='events.icustay_id = stays.icustay_id',
+                   where='AND events.error IS DISTINCT FROM 1',
+                   value='CASE WHEN events.itemid IN (%s) THEN (events.valuenum - 32) / 1.8 ELSE events.valuenum END'
+                         % ', '.join(map(str, itemids.fahrenheit))),
+    'labs': dict(table='labevents', variables=itemids.labs, ranges=itemids.lab_ranges,
+                 join='events.subject_id = stays.subject_id AND events.hadm_id = stays.hadm_id',
+                 where='',
+                 value='events.valuenum'),
+}
+
+
+def __variable_case(variables):
+    whens = ["WHEN events.itemid IN (%s) THEN '%s'" % (', '.join(map(str, ids)), variable)
+             for variable, ids in variables.items()]
+    return 'CASE %s END' % ' '.join(whens)
+
+
+def range_case(ranges):
+    """sql condition, true when a windowed (converted) valuenum is inside its variable's valid range"""
+    whens = []
+    for variable, (low, high) in ranges.items():
+        check = 'valuenum > %s' % low
+        if high is not None:
+            check += ' AND valuenum <= %s' % high
+        whens.append("WHEN '%s' THEN %s" % (variable, check))
+    return 'CASE variable %s END' % ' '.join(whens)
+
+
+def window_events(source='vitals', hours=24, shard=None):
+    """narrow (stay keys, variable, valuenum) rows of source inside each stay's first hours, in valid range"""
+    spec = SOURCES[source]
+    all_ids = sorted(set(itemid for ids in spec['variables'].values() for itemid in ids))
+    # the range check runs on the converted value, so it sits outside the select that converts
+    query = """
+    WITH stays AS (
+        SELECT subject_id
+            , hadm_id
+            , icustay_id
+            , intime
+        FROM icustays
+        {shard_filter}
+    ), windowed AS (
+        SELECT stays.subject_id
+            , stays.hadm_id
+            , stays.icustay_id
+            , {variable_case} AS variable
+            , {value} AS valuenum
+        FROM stays
+        INNER JOIN {table} events
+        ON {join}
+            AND events.charttime BETWEEN stays.intime AND stays.intime + interval '{hours} hours'
+        WHERE events.itemid IN ({itemids})
+            AND events.valuenum IS NOT NULL
+            {where}
+    )
+    SELECT subject_id
+        , hadm_id
+        , icustay_id
+        , variable
+        , valuenum
+    FROM windowed
+    WHERE {valid_range}
+    """
+    query = query.format(shard_filter=queries.shard_filter('subject_id', shard),
+                         variable_case=__variable_case(spec['variables']),
+                         value=spec['value'],
+                         table=spec['table'],
+                         join=spec['join'],
+                         hours=int(hours),
+                         itemids=', '.join(map(str, all_ids)),
+                         where=spec['where'],
+                         valid_range=range_case(spec['ranges']))
+    return query
+
+
+def window_aggregates(source='vitals', hours=24, shard=None):
+    """window_events grouped per stay in the database, one wide row per stay"""
+    spec = SOURCES[source]
+    columns = []
+    for variable in spec['variables']:
+        for stat, function in zip(STATS, ['MIN', 'MAX', 'AVG']):
+            columns.append(", %s(valuenum) FILTER (WHERE variable = '%s') AS %s_%s"
+                           % (function, variable, variable, stat))
+    query = """
+    WITH events AS (
+        {events}
+    )
+    SELECT subject_id
+        , hadm_id
+        , icustay_id
+        {columns}
+    FROM events
+    GROUP BY subject_id, hadm_id, icustay_id
+    ORDER BY subject_id, hadm_id, icustay_id
+    """
+    query = query.format(events=window_events(source, hours, shard), columns='\n        '.join(columns))
+    return query
+
+
+def stream_query(query, db_connection, chunksize=500000):
+    """yield the rows of query as DataFrames of at most chunksize rows, from a server-side cursor"""
+    with db_connection.cursor() as cursor:
+        cursor.execute('SET search_path to mimiciii;')
+    # a named cursor keeps the result on the server; the default cursor would fetch it all.
+    # the name is unique so two streams can be open on one connection
+    with db_connection.cursor(name='clinical_stream_%s' % uuid.uuid4().hex) as cursor:
+        cursor.itersize = chunksize
+        cursor.execute(query)
+        while True:
+            rows = cursor.fetchmany(chunksize)
+            if not rows:
+                break
+            yield pd.DataFrame.from_records(rows, columns=[column[0] for column in cursor.description],
+                                            coerce_float=True)
+
+
+class WindowAggregator(object):
+    """running count/sum/min/max of valuenum per (stay, variable), fed one chunk at a time"""
+
+    def __init__(self, variables):
+        self.variables = list(variables)
+        self.state = None
+        self.rows = 0
+
+    def add(self, chunk):
+        self.rows += len(chunk)
+        partial = chunk.groupby(STAY_KEYS + ['variable'], sort=False)['valuenum'].agg(['count', 'sum', 'min', 'max'])
+        if self.state is None:
+            self.state = partial
+        else:
+            self.state = pd.concat([self.state, partial]).groupby(level=list(range(len(STAY_KEYS) + 1)), sort=False) \
+                .agg({'count': 'sum', 'sum': 'sum', 'min': 'min', 'max': 'max'})
+
+    def result(self):
+        """same wide table as window_aggregates"""
+        columns = ['%s_%s' % (variable, stat) for variable in self.variables for stat in STATS]
+        if self.state is None:
+            return pd.DataFrame(columns=STAY_KEYS + columns)
+        state = self.state.assign(mean=self.state['sum'] / self.state['count'])[STATS]
+        wide = state.unstack('variable')
+        wide.columns = ['%s_%s' % (variable, stat) for stat, variable in wide.columns]
+        wide = wide.reindex(columns=columns)
+        return wide.sort_index().reset_index()
+
+
+def get_window_aggregates(con, source='vitals', hours=24, how='sql', shard=None, chunksize=500000):
+    """per icu stay min/max/mean of the first-day vitals or labs, see module docstring for how"""
+    if how == 'sql':
+        return notebook_helper.run_query(window_aggregates(source, hours, shard), con, check_events=False)
+    if how != 'stream':
+        raise ValueError("how must be 'sql' or 'stream', got %r" % how)
+
+    aggregator = WindowAggregator(SOURCES[source]['variables'])
+    for chunk in stream_query(window_events(source, hours, shard), con, chunksize=chunksize):
+        aggregator.add(chunk)
+    print("Aggregated %d %s events" % (aggregator.rows, source))
+    return aggregator.result()
@@ -0,0 +1,104 @@
+"""
+Sharded phase-one cohort build.
+
+Runs the phase_one_inclusion_exclusion steps (discharge_events query, drug search, ambiguous
+admission removal, LOS/mortality outcomes, skew removal) on hash partitions of the cohort,
+mod(subject_id, n_shards), each in its own process with its own database connection.
+Every window function and join in those steps is keyed on subject_id, so a shard never
+needs rows from another one and the concatenated shards equal the single-pass build.
+
+Only the shard being built is in memory in a worker (discharge texts never leave it), and
+workers are replaced after each shard so their memory is handed back.
+"""
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+
+import pandas as pd
+
+import finddrugs_refactor as finder
+import notebook_helper as helper
+import queries
+
+SORT_KEYS = ['subject_id', 'hadm_id', 'row_id']
+
+
+def build_shard(shard, connect_kwargs, druglist_file, work_dir):
+    """run every phase-one step for one (index, count) shard and return its cleaned rows"""
+    import psycopg2
+
+    index, count = shard
+    start = time.time()
+    summary_file = os.path.join(work_dir, 'medications_%d_of_%d.csv' % (index, count))
+    if os.path.isfile(summary_file):
+        os.remove(summary_file)
+    con = psycopg2.connect(**connect_kwargs)
+    try:
+        df_events = helper.run_query(query=queries.discharge_events(shard), db_connection=con)
+        finder.search(df_events, DRUGLIST_FILE=druglist_file, SUMMARY_FILE=summary_file)
+        medications = pd.read_csv(summary_file)
+        df_clean_admit_groups = helper.remove_ambiguous_data(medications)
+        df_admits = helper.get_admit_df(df_events, df_clean_admit_groups)
+        del df_events
+        df_outcomes = helper.get_outcomes(df_admits, con, shard=shard)
+    finally:
+        con.close()
+    df_with_admit = helper.get_reason_for_admit(df_outcomes)
+    df_shard = helper.remove_skew_data(df=df_with_admit, expected_count=None)
+    print("Shard %d/%d: %d rows in %.1f seconds" % (index + 1, count, len(df_shard), time.time() - start))
+    return df_shard
+
+
+def _build_shard_task(args):
+    return build_shard(*args)
+
+
+def concat_shards(shards):
+    """stack shard results in a fixed (subject_id, hadm_id, row_id) order, independent of shard count"""
+    df = pd.concat(shards, ignore_index=True)
+    return df.sort_values(SORT_KEYS, kind='mergesort').reset_index(drop=True)
+
+
+def build_cohort(connect_kwargs, druglist_file='../data/opiates.txt', n_shards=4, n_jobs=None,
+                 expected_count=26657, work_dir=None):
+    """
+    sharded equivalent of the phase_one_inclusion_exclusion notebook.
+    connect_kwargs are passed to psycopg2.connect in each worker, e.g.
+    dict(dbname='mimic', user=sqluser, password=sqlpass, host='localhost').
+    n_jobs defaults to min(n_shards, cpu count). expected_count is checked on the
+    concatenated cohort, None skips the check
+    """
+    import psycopg2
+
+    # every shard joins against the discharge report view, create it once up front
+    con = psycopg2.connect(**connect_kwargs)
+    try:
+        helper.provision_discharge_view(con)
+    finally:
+        con.close()
+
+    n_jobs = n_jobs or min(n_shards, multiprocessing.cpu_count())
+    tmp_dir = work_dir or tempfile.mkdtemp(prefix='cohort_build_')
+    tasks = [((index, n_shards), connect_kwargs, druglist_file, tmp_dir) for index in range(n_shards)]
+    try:
+        if n_jobs == 1:
+            shards = [_build_shard_task(task) for task in tasks]
+        else:
+            pool = multiprocessing.Pool(processes=n_jobs, maxtasksperchild=1)
+            try:
+                shards = pool.map(_build_shard_task, tasks, chunksize=1)
+            finally:
+                pool.close()
+                pool.join()
+    finally:
+        if work_dir is None:
+            shutil.rmtree(tmp_dir)
+
+    df_cohort = concat_shards(shards)
+    cnt_df = len(df_cohort)
+    if expected_count is not None:
+        assert cnt_df == expected_count, "clean count=%d is not same as expected count=%d" % (cnt_df, expected_count)
+    print("Built cohort of %d rows from %d shards" % (cnt_df, n_shards))
+    return df_cohort
@@ -0,0 +1,195 @@
+"""
+Elixhauser and Charlson comorbidity indexes from the full icd9_codes list of every admission
+(queries.aggregate_icd9_codes), rather than the handful of icd9codes.py conditions matched
+against the primary admit_icd9 only.
+
+Categories follow the Quan et al. (2005) enhanced ICD-9-CM coding algorithms. Scores use the
+van Walraven (2009) Elixhauser weights and the original Charlson (1987) weights. Codes are
+MIMIC style, i.e. without the dot ('4280', 'V420'), and a category matches on code prefix.
+
+Each index is compiled once into a prefix -> category bitmask table. Scoring flattens every
+admission's codes into one array, looks up each distinct code once, and ORs the masks back
+per admission with a segmented reduction, so one call scores the whole cohort.
+"""
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+# Quan 2005, ICD-9-CM. 'a-b' is an inclusive range of prefixes of the same length
+ELIXHAUSER = {
+    'chf': ['39891', '40201', '40211', '40291', '40401', '40403', '40411', '40413', '40491', '40493',
+            '4254-4259', '428'],
+    'arrhythmia': ['4260', '42613', '4267', '4269', '42610', '42612', '4270-4274', '4276-4279', '7850',
+                   '99601', '99604', 'V450', 'V533'],
+    'valvular': ['0932', '394-397', '424', '7463-7466', 'V422', 'V433'],
+    'pulmonary_circulation': ['4150', '4151', '416', '4170', '4178', '4179'],
+    'peripheral_vascular': ['0930', '4373', '440', '441', '4431-4439', '4471', '5571', '5579', 'V434'],
+    'hypertension_uncomplicated': ['401'],
+    'hypertension_complicated': ['402-405'],
+    'paralysis': ['3341', '342', '343', '3440-3446', '3449'],
+    'other_neurological': ['3319', '3320', '3321', '3334', '3335', '33392', '334-335', '3362', '340', '341',
+                           '345', '3481', '3483', '7803', '7843'],
+    'chronic_pulmonary': ['4168', '4169', '490-505', '5064', '5081', '5088'],
+    'diabetes_uncomplicated': ['2500-2503'],
+    'diabetes_complicated': ['2504-2509'],
+    'hypothyroidism': ['2409', '243', '244', '2461', '2468'],
+    'renal_failure': ['40301', '40311', '40391', '40402', '40403', '40412', '40413', '40492', '40493', '585',
+                      '586', '5880', 'V420', 'V451', 'V56'],
+    'liver_disease': ['07022', '07023', '07032', '07033', '07044', '07054', '0706', '0709', '4560-4562', '570',
+                      '571', '5722-5728', '5733', '5734', '5738', '5739', 'V427'],
+    'peptic_ulcer': ['5317', '5319', '5327', '5329', '5337', '5339', '5347', '5349'],
+    'aids': ['042-044'],
+    'lymphoma': ['200-202', '2030', '2386'],
+    'metastatic_cancer': ['196-199'],
+    'solid_tumor': ['140-172', '174-195'],
+    'rheumatoid_arthritis': ['446', '7010', '7100-7104', '7108', '7109', '7112', '714', '7193', '720', '725',
+                             '7285', '72889', '72930'],
+    'coagulopathy': ['286', '2871', '2873-2875'],
+    'obesity': ['2780'],
+    'weight_loss': ['260-263', '7832', '7994'],
+    'fluid_electrolyte': ['2536', '276'],
+    'blood_loss_anemia': ['2800'],
+    'deficiency_anemia': ['2801-2809', '281'],
+    'alcohol_abuse': ['2652', '2911-2913', '2915-2919', '3030', '3039', '3050', '3575', '4255', '5353',
+                      '5710-5713', '980', 'V113'],
+    'drug_abuse': ['292', '304', '3052-3059', 'V6542'],
+    'psychoses': ['2938', '295', '29604', '29614', '29644', '29654', '297', '298'],
+    'depression': ['2962', '2963', '2965', '3004', '309', '311'],
+}
+
+# van Walraven 2009
+ELIXHAUSER_WEIGHTS = {
+    'chf': 7, 'arrhythmia': 5, 'valvular': -1, 'pulmonary_circulation': 4, 'peripheral_vascular': 2,
+    'hypertension_uncomplicated': 0, 'hypertension_complicated': 0, 'paralysis': 7, 'other_neurological': 6,
+    'chronic_pulmonary': 3, 'diabetes_uncomplicated': 0, 'diabetes_complicated': 0, 'hypothyroidism': 0,
+    'renal_failure': 5, 'liver_disease': 11, 'peptic_ulcer': 0, 'aids': 0, 'lymphoma': 9, 'metastatic_cancer': 12,
+    'solid_tumor': 4, 'rheumatoid_arthritis': 0, 'coagulopathy': 3, 'obesity': -4, 'weight_loss': 6,
+    'fluid_electrolyte': 5, 'blood_loss_anemia': -2, 'deficiency_anemia': -2, 'alcohol_abuse': 0, 'drug_abuse': -7,
+    'psychoses': 0, 'depression': -3,
+}
+
+CHARLSON = {
+    'myocardial_infarction': ['410', '412'],
+    'chf': ['39891', '40201', '40211', '40291', '40401', '40403', '40411', '40413', '40491', '40493',
+            '4254-4259', '428'],
+    'peripheral_vascular': ['0930', '4373', '440', '441', '4431-4439', '4471', '5571', '5579', 'V434'],
+    'cerebrovascular': ['36234', '430-438'],
+    'dementia': ['290', '2941', '3312'],
+    'chronic_pulmonary': ['4168', '4169', '490-505', '5064', '5081', '5088'],
+    'rheumatic': ['4465', '7100-7104', '7140-7142', '7148', '725'],
+    'peptic_ulcer': ['531-534'],
+    'mild_liver': ['07022', '07023', '07032', '07033', '07044', '07054', '0706', '0709', '570', '571', '5733',
+                   '5734', '5738', '5739', 'V427'],
+    'diabetes_uncomplicated': ['2500-2503', '2508', '2509'],
+    'diabetes_complicated': ['2504-2507'],
+    'hemiplegia': ['3341', '342', '343', '3440-3446', '3449'],
+    'renal': ['40301', '40311', '40391', '40402', '40403', '40412', '40413', '40492', '40493', '582',
+              '5830-5837', '585', '586', '5880', 'V420', 'V451', 'V56'],
+    'cancer': ['140-172', '1740-1958', '200-208', '2386'],
+    'severe_liver': ['4560-4562', '5722-5728'],
+    'metastatic_cancer': ['196-199'],
+    'aids': ['042-044'],
+}
+
+# Charlson 1987
+CHARLSON_WEIGHTS = {
+    'myocardial_infarction': 1, 'chf': 1, 'peripheral_vascular': 1, 'cerebrovascular': 1, 'dementia': 1,
+    'chronic_pulmonary': 1, 'rheumatic': 1, 'peptic_ulcer': 1, 'mild_liver': 1, 'diabetes_uncomplicated': 1,
+    'diabetes_complicated': 2, 'hemiplegia': 2, 'renal': 2, 'cancer': 2, 'severe_liver': 3, 'metastatic_cancer': 6,
+    'aids': 6,
+}
+
+# (milder, more severe): an admission with both only counts the severe one in the score
+ELIXHAUSER_HIERARCHY = [('diabetes_uncomplicated', 'diabetes_complicated'),
+                        ('solid_tumor', 'metastatic_cancer'),
+                        ('hypertension_uncomplicated', 'hypertension_complicated')]
+CHARLSON_HIERARCHY = [('diabetes_uncomplicated', 'diabetes_complicated'),
+                      ('mild_liver', 'severe_liver'),
+                      ('cancer', 'metastatic_cancer')]
+
+Index = namedtuple('Index', ['name', 'categories', 'weights', 'hierarchy', 'table'])
+
+
+def __expand(item):
+    """'4254-4259' -> ['4254', ..., '4259'], keeping any letter prefix and zero padding"""
+    if '-' not in item:
+        return [item]
+    low, high = item.split('-')
+    head = low.rstrip('0123456789')
+    width = len(low) - len(head)
+    return ['%s%0*d' % (head, width, number) for number in range(int(low[len(head):]), int(high[len(head):]) + 1)]
+
+
+def compile_index(name, codes, weights, hierarchy):
+    """Index whose table maps every code prefix to the bitmask of the categories it belongs to"""
+    categories = list(codes)
+    table = {}
+    for bit, category in enumerate(categories):
+        for item in codes[category]:
+            for prefix in __expand(item):
+                table[prefix] = table.get(prefix, 0) | (1 << bit)
+    weights = np.array([weights[category] for category in categories])
+    hierarchy = [(categories.index(mild), categories.index(severe)) for mild, severe in hierarchy]
+    return Index(name=name, categories=categories, weights=weights, hierarchy=hierarchy, table=table)
+
+
+INDEXES = {
+    'elixhauser': compile_index('elixhauser', ELIXHAUSER, ELIXHAUSER_WEIGHTS, ELIXHAUSER_HIERARCHY),
+    'charlson': compile_index('charlson', CHARLSON, CHARLSON_WEIGHTS, CHARLSON_HIERARCHY),
+}
+PREFIX_LENGTHS = sorted(set(len(prefix) for index in INDEXES.values() for prefix in index.table))
+
+
+def __flatten(code_lists):
+    """one array of all codes plus the start offset of every admission's codes"""
+    lengths = np.array([len(codes) if isinstance(codes, (list, tuple, np.ndarray)) else 0 for codes in code_lists])
+    flat = [code for codes in code_lists if isinstance(codes, (list, tuple, np.ndarray)) for code in codes]
+    flat = np.array(['' if code is None else str(code).replace('.', '').strip() for code in flat], dtype=object)
+    starts = np.zeros(len(lengths), dtype=np.int64)
+    starts[1:] = np.cumsum(lengths)[:-1]
+    return flat, starts, lengths
+
+
+def __code_masks(code, table):
+    mask = 0
+    for length in PREFIX_LENGTHS:
+        mask |= table.get(code[:length], 0)
+    return mask
+
+
+def flag_categories(code_lists, index='elixhauser'):
+    """(admissions x categories) 0/1 int8 matrix of an index for a sequence of icd9 code lists"""
+    index = INDEXES[index] if isinstance(index, str) else index
+    flat, starts, lengths = __flatten(code_lists)
+    # admissions repeat the same few thousand codes, so look each distinct code up once
+    distinct, inverse = np.unique(flat.astype(str), return_inverse=True)
+    masks = np.array([__code_masks(code, index.table) for code in distinct], dtype=np.int64)[inverse]
+
+    admission_masks = np.zeros(len(lengths), dtype=np.int64)
+    has_codes = lengths > 0
+    if has_codes.any():
+        admission_masks[has_codes] = np.bitwise_or.reduceat(masks, starts[has_codes])
+    bits = np.arange(len(index.categories), dtype=np.int64)
+    return ((admission_masks[:, None] >> bits) & 1).astype(np.int8)
+
+
+def score_admissions(df, index='elixhauser', codes_col='icd9_codes'):
+    """
+    <index>_<category> flags and the weighted <index>_score for every row of df, indexed like df.
+    the score applies the index hierarchy; the flags don't
+    """
+    index = INDEXES[index] if isinstance(index, str) else index
+    flags = flag_categories(df[codes_col].values, index)
+    scored = flags.copy()
+    for mild, severe in index.hierarchy:
+        scored[:, mild] &= 1 - scored[:, severe]
+    columns = ['%s_%s' % (index.name, category) for category in index.categories]
+    result = pd.DataFrame(flags, columns=columns, index=df.index)
+    result['%s_score' % index.name] = scored.astype(np.int64) @ index.weights
+    return result
+
+
+def add_comorbidities(df, indexes=('elixhauser', 'charlson'), codes_col='icd9_codes'):
+    """df with the flags and score of every index appended"""
+    return pd.concat([df] + [score_admissions(df, index, codes_col) for index in indexes], axis=1)
@@ -0,0 +1,132 @@
+"""
+Drug co-occurrence, lift and polypharmacy per cohort arm, from the per-note drug flags of a
+finddrugs_refactor.search() summary file.
+
+The flags are kept as a SciPy sparse (notes x drugs) matrix, read chunk by chunk, so a long
+drug list (the planned MISC lists) never becomes a dense notes x drugs frame or a drugs x drugs
+crosstab per pair. Notes are OR-ed into admissions, and every count is a sparse product:
+
+    admissions x drugs   A = (M @ F) > 0     M: admission x note indicator
+    co-occurrence        C = A.T @ A         C[i, i] = admissions on drug i
+    lift                 C[i, j] * n / (C[i, i] * C[j, j]), only for pairs that occur
+    polypharmacy         A @ 1               drugs per admission
+"""
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+ID_COLUMNS = ['row_id', 'subject_id', 'hadm_id']
+# summary columns between the ids and the drug flags
+SUMMARY_COLUMNS = ['hist_found', 'opiate_history', 'admit_found', 'dis_found', 'group', 'opiates']
+ARM_COL = 'opiates'
+
+FlagMatrix = namedtuple('FlagMatrix', ['ids', 'generics', 'flags'])
+
+
+def flag_columns(columns):
+    """drug flag columns of a summary file header (token mode <drug>_confidence columns left out)"""
+    return [col for col in columns
+            if col not in ID_COLUMNS + SUMMARY_COLUMNS and not col.endswith('_confidence')]
+
+
+def load_flags(path, chunksize=100000):
+    """
+    FlagMatrix of a summary file (.csv or .parquet): ids holds the id columns plus the opiates
+    column, flags a csr int8 (notes x generics) matrix
+    """
+    if path.endswith('.parquet'):
+        chunks = [pd.read_parquet(path)]
+    else:
+        chunks = pd.read_csv(path, chunksize=chunksize)
+    ids, blocks, generics = [], [], None
+    for chunk in chunks:
+        generics = generics or flag_columns(chunk.columns)
+        ids.append(chunk[ID_COLUMNS + [ARM_COL]])
+        blocks.append(sp.csr_matrix(chunk[generics].values == 1, dtype=np.int8))
+    if not blocks:
+        raise ValueError("%s has no notes" % path)
+    return FlagMatrix(ids=pd.concat(ids, ignore_index=True), generics=generics, flags=sp.vstack(blocks).tocsr())
+
+
+def by_admission(matrix, key='hadm_id'):
+    """FlagMatrix with the notes of each admission OR-ed together (an admission is on opiates if any note is)"""
+    codes, keys = pd.factorize(matrix.ids[key])
+    notes = len(codes)
+    membership = sp.csr_matrix((np.ones(notes, dtype=np.int32), (codes, np.arange(notes))), shape=(len(keys), notes))
+    flags = membership @ matrix.flags.astype(np.int32)
+    flags.data = (flags.data > 0).astype(np.int8)
+    flags.eliminate_zeros()
+    ids = matrix.ids.groupby(codes).agg({'subject_id': 'first', key: 'first', ARM_COL: 'max'}).reset_index(drop=True)
+    return FlagMatrix(ids=ids, generics=matrix.generics, flags=flags.astype(np.int8))
+
+
+def cooccurrence(flags):
+    """(drugs x drugs) csr counts of admissions on both drugs; the diagonal counts each drug alone"""
+    flags = flags.astype(np.int32)
+    return (flags.T @ flags).tocsr()
+
+
+def lift(counts, n):
+    """csr lift of every co-occurring pair: observed / expected-if-independent admissions"""
+    counts = counts.tocoo()
+    single = counts.diagonal().astype(float)
+    data = counts.data * float(n) / (single[counts.row] * single[counts.col])
+    return sp.csr_matrix((data, (counts.row, counts.col)), shape=counts.shape)
+
+
+def polypharmacy(flags):
+    """number of distinct drugs per admission"""
+    return np.asarray(flags.sum(axis=1)).ravel()
+
+
+def pair_table(counts, generics, n):
+    """tidy (drug_a, drug_b) rows of the co-occurring pairs, each pair once, most frequent first"""
+    upper = sp.triu(counts, k=1).tocoo()
+    single = counts.diagonal().astype(float)
+    df = pd.DataFrame({'drug_a': np.asarray(generics)[upper.row],
+                       'drug_b': np.asarray(generics)[upper.col],
+                       'count': upper.data,
+                       'support': upper.data / float(n),
+                       'lift': upper.data * float(n) / (single[upper.row] * single[upper.col])})
+    return df.sort_values(['count', 'drug_a', 'drug_b'], ascending=[False, True, True]).reset_index(drop=True)
+
+
+def arm_labels(matrix, data=None, key='hadm_id'):
+    """
+    cohort arm of each row of matrix: the group name of the row's admission in an analysis_helper.Data
+    (NaN when the admission isn't in it), or without data the opiate / non_opiate split of the summary
+    """
+    if data is None:
+        return matrix.ids[ARM_COL].map({0: 'non_opiate', 1: 'opiate'}).values
+    names = np.array([group.name for group in data.groups] + [np.nan], dtype=object)
+    arms = pd.Series(names[data.group_codes], index=data.raw_df[key].values)
+    arms = arms[~arms.index.duplicated()]
+    return arms.reindex(matrix.ids[key].values).values
+
+
+def arm_summary(matrix, arms=None):
+    """
+    co-occurring pairs and the polypharmacy distribution of every arm, from one product per arm.
+    arms: label per row of matrix (default arm_labels(matrix)); rows labelled NaN are left out.
+    returns (pairs with an arm column, arms x number-of-drugs admission counts)
+    """
+    arms = arm_labels(matrix) if arms is None else np.asarray(arms, dtype=object)
+    labelled = pd.notnull(arms)
+    codes, names = pd.factorize(arms[labelled])
+    flags = matrix.flags[np.flatnonzero(labelled)]
+
+    pairs = []
+    for code, name in enumerate(names):
+        arm_flags = flags[codes == code]
+        table = pair_table(cooccurrence(arm_flags), matrix.generics, arm_flags.shape[0])
+        pairs.append(table.assign(arm=name, admissions=arm_flags.shape[0]))
+    pairs = pd.concat(pairs, ignore_index=True) if pairs else pd.DataFrame()
+
+    drugs = polypharmacy(flags)
+    counts = np.zeros((len(names), len(matrix.generics) + 1), dtype=np.int64)
+    np.add.at(counts, (codes, drugs), 1)
+    distribution = pd.DataFrame(counts, index=pd.Index(names, name='arm'))
+    distribution.columns.name = 'drugs'
+    return pairs, distribution
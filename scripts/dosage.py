@@ -0,0 +1,130 @@
+"""
+Dose, unit, route and frequency extraction for opioid mentions, and conversion to
+morphine milligram equivalents (MME) per day.
+
+extract() reads the text following a drug name on a medication line, e.g.
+"oxycontin 20 mg po q12h" -> Dose(amount=20, unit='mg', route='oral', per_day=2).
+daily_mme() converts it with the CDC (2016) oral MME conversion factors, keyed by the
+generics of data/opiates.txt. Anything the table can't convert honestly (parenteral
+routes, buprenorphine, a tablet count without a strength, a missing frequency) is NaN
+rather than a guess, so a NaN cell means "on the drug, dose unknown" and 0 means absent.
+"""
+import re
+from collections import namedtuple
+
+import numpy as np
+
+Dose = namedtuple('Dose', ['amount', 'unit', 'route', 'per_day'])
+
+ROUTES = ('unknown', 'oral', 'transdermal', 'transmucosal', 'parenteral', 'rectal')
+ROUTE_CODES = dict((route, code) for code, route in enumerate(ROUTES))
+
+# oral morphine mg per mg of drug (fentanyl: per mcg/hr patch, or per mcg buccal)
+MME_FACTORS = {
+    'codeine': 0.15,
+    'hydrocodone': 1.0,
+    'hydromorphone': 4.0,
+    'morphine': 1.0,
+    'oxycodone': 1.5,
+    'oxymorphone': 3.0,
+    'tapentadol': 0.4,
+    'tramadol': 0.1,
+    'meperidine': 0.1,
+}
+FENTANYL_PATCH_FACTOR = 2.4
+FENTANYL_BUCCAL_FACTOR = 0.13
+# methadone factor rises with the daily dose: (upper bound of daily mg, factor)
+METHADONE_TIERS = [(20, 4.0), (40, 8.0), (60, 10.0), (np.inf, 12.0)]
+
+# strength, keeping only the first number of a combination ("5-325 mg" is 5 mg hydrocodone)
+DOSE_PATTERN = re.compile(r"(\d+(?:\.\d+)?)(?:\s*[-/]\s*\d+(?:\.\d+)?)?\s*(mcg/hr|mcg/h|mcg|mg|g)\b", re.I)
+ROUTE_PATTERN = re.compile(r"\b(po|oral|by mouth|td|transdermal|patch|sl|buccal|iv|im|sc|sq|subq|subcut|pr)\b", re.I)
+ROUTE_NAMES = {'po': 'oral', 'oral': 'oral', 'by mouth': 'oral',
+               'td': 'transdermal', 'transdermal': 'transdermal', 'patch': 'transdermal',
+               'sl': 'transmucosal', 'buccal': 'transmucosal',
+               'iv': 'parenteral', 'im': 'parenteral', 'sc': 'parenteral', 'sq': 'parenteral',
+               'subq': 'parenteral', 'subcut': 'parenteral', 'pr': 'rectal'}
+# "q4h", "q4-6h" (most frequent end), "q 12 hrs"
+INTERVAL_PATTERN = re.compile(r"\bq\s*(\d+)(?:\s*-\s*\d+)?\s*(?:h|hr|hrs|hour|hours)\b", re.I)
+FREQUENCY_PATTERN = re.compile(r"\b(qd|daily|qday|qam|qpm|qhs|nightly|bid|twice|tid|qid)\b", re.I)
+FREQUENCIES = {'qd': 1, 'daily': 1, 'qday': 1, 'qam': 1, 'qpm': 1, 'qhs': 1, 'nightly': 1,
+               'bid': 2, 'twice': 2, 'tid': 3, 'qid': 4}
+
+
+def __per_day(text):
+    match = INTERVAL_PATTERN.search(text)
+    if match and int(match.group(1)) > 0:
+        return 24.0 / int(match.group(1))
+    # "b.i.d." -> "bid"; only done here so decimal doses keep their point
+    match = FREQUENCY_PATTERN.search(text.replace('.', ''))
+    if match:
+        return float(FREQUENCIES[match.group(1).lower()])
+    return np.nan
+
+
+def extract(text):
+    """Dose read from the text after a drug name. missing parts are NaN (numbers) or 'unknown' (route)"""
+    amount, unit = np.nan, None
+    match = DOSE_PATTERN.search(text)
+    if match:
+        amount, unit = float(match.group(1)), match.group(2).lower()
+        if unit == 'mcg/h':
+            unit = 'mcg/hr'
+        elif unit == 'g':
+            amount, unit = amount * 1000, 'mg'
+
+    match = ROUTE_PATTERN.search(text)
+    if match:
+        route = ROUTE_NAMES[match.group(1).lower()]
+    elif unit == 'mcg/hr':
+        route = 'transdermal'
+    else:
+        route = 'unknown'
+    return Dose(amount=amount, unit=unit, route=route, per_day=__per_day(text))
+
+
+def daily_mme(generic, dose):
+    """morphine milligram equivalents per day of one dose of generic, NaN when it can't be converted"""
+    if generic == 'fentanyl':
+        # patches are dosed by rate, so the frequency doesn't matter
+        if dose.unit == 'mcg/hr':
+            return dose.amount * FENTANYL_PATCH_FACTOR
+        if dose.unit == 'mcg' and dose.route == 'transmucosal':
+            return dose.amount * dose.per_day * FENTANYL_BUCCAL_FACTOR
+        return np.nan
+
+    # the factors are for oral doses; an unstated route on a home med list is taken as oral
+    if dose.unit != 'mg' or dose.route not in ('oral', 'unknown'):
+        return np.nan
+    daily_mg = dose.amount * dose.per_day
+    if generic == 'methadone':
+        # a missing frequency leaves daily_mg NaN, which no tier holds
+        factor = next((factor for upper, factor in METHADONE_TIERS if daily_mg <= upper), np.nan)
+    else:
+        factor = MME_FACTORS.get(generic, np.nan)
+    return daily_mg * factor
+
+
+def write_matrix(path, row_ids, subject_ids, hadm_ids, generics, doses):
+    """
+    save per-admission doses as one compressed npz: id columns, the generic names and
+    float32 (notes x generics) matrices mme, amount, per_day plus int8 route codes (see ROUTES).
+    doses holds one list per note of Dose/MME pairs per generic, None where the drug wasn't found
+    """
+    shape = (len(doses), len(generics))
+    mme = np.zeros(shape, dtype=np.float32)
+    amount = np.zeros(shape, dtype=np.float32)
+    per_day = np.zeros(shape, dtype=np.float32)
+    route = np.zeros(shape, dtype=np.int8)
+    for i, note_doses in enumerate(doses):
+        for j, found in enumerate(note_doses):
+            if found is None:
+                continue
+            dose, mme[i, j] = found
+            amount[i, j], per_day[i, j] = dose.amount, dose.per_day
+            route[i, j] = ROUTE_CODES[dose.route]
+    np.savez_compressed(path, row_id=np.asarray(row_ids, dtype=np.int64),
+                        subject_id=np.asarray(subject_ids, dtype=np.int64),
+                        hadm_id=np.asarray(hadm_ids, dtype=np.int64),
+                        generics=np.array(generics), routes=np.array(ROUTES),
+                        mme=mme, amount=amount, per_day=per_day, route=route)
@@ -0,0 +1,86 @@
+"""
+Drug list loading for the note scanners.
+
+A drug list has one line per generic, "generic|brand1|brand2", e.g. data/opiates.txt. Each
+line becomes one entry keyed by the lower-cased generic. DrugList.patterns maps it to a
+case-insensitive regex alternation over the generic and its brands (the same map
+finddrugs_refactor has always used, names regex-escaped so they match literally), and
+DrugList.names to the plain lower-cased names, for token matching.
+
+The parsed list is pickled next to the list (<list>.pkl) and reused while the list's
+mtime and size are unchanged, so every scanner process (notebook, shard worker, CLI)
+loads it without re-validating the file.
+"""
+import os
+import pickle
+import re
+from collections import OrderedDict, namedtuple
+
+CACHE_SUFFIX = '.pkl'
+CACHE_VERSION = 2
+
+DrugList = namedtuple('DrugList', ['patterns', 'names'])
+
+
+def parse(text, source='<drug list>'):
+    """
+    validate drug list text and return its DrugList.
+    blank lines are skipped, a line without '|' is a generic with no brand names.
+    empty names and repeated generics raise ValueError
+    """
+    patterns = OrderedDict()
+    drug_names = OrderedDict()
+    for lineno, line in enumerate(text.split('\n'), 1):
+        if not line.strip():
+            continue
+        names = [name.strip().lower() for name in line.split('|')]
+        if not all(names):
+            raise ValueError("%s line %d: empty drug name in %r" % (source, lineno, line))
+        generic = names[0]
+        if generic in patterns:
+            raise ValueError("%s line %d: generic %r is listed twice" % (source, lineno, generic))
+        patterns[generic] = '|'.join(re.escape(name) for name in names)
+        drug_names[generic] = tuple(names)
+    return DrugList(patterns=patterns, names=drug_names)
+
+
+def __cache_key(path):
+    stat = os.stat(path)
+    return CACHE_VERSION, stat.st_mtime_ns, stat.st_size
+
+
+def __read_cache(cache_path, key):
+    try:
+        with open(cache_path, 'rb') as f:
+            cached_key, drug_list = pickle.load(f)
+    except (OSError, EOFError, pickle.UnpicklingError, ValueError, AttributeError):
+        return None
+    return drug_list if cached_key == key else None
+
+
+def __write_cache(cache_path, key, drug_list):
+    # write then rename, so a worker loading at the same time never sees half a file
+    tmp_path = '%s.%d' % (cache_path, os.getpid())
+    try:
+        with open(tmp_path, 'wb') as f:
+            pickle.dump((key, drug_list), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, cache_path)
+    except OSError:
+        # read-only data dir, just parse again next time
+        pass
+
+
+def load(path, cache=True):
+    """DrugList parsed from path, read from the cached artifact when the list hasn't changed since it was written"""
+    if not cache:
+        with open(path) as f:
+            return parse(f.read(), source=path)
+
+    key = __cache_key(path)
+    cache_path = path + CACHE_SUFFIX
+    drug_list = __read_cache(cache_path, key)
+    if drug_list is None:
+        with open(path) as f:
+            drug_list = parse(f.read(), source=path)
+        __write_cache(cache_path, key, drug_list)
+    return drug_list
@@ -17,6 +17,7 @@ import re
 import string
 import sys
 import time
+import druglist
 
 def addToDrugs(line, drugs, listing, genList):
     """
@@ -46,14 +47,11 @@ def readDrugs(f, genList):
     #
     #   Converts lines of the form "generic|brand1|brand2" to a
     #   dictionary keyed by "generic" with value "generic|brand1|brand2
+    #   (validated and regex-escaped by druglist.parse)
     """
-    lines = f.read()
-    generics = re.findall("^(.*?)\|", lines, re.MULTILINE)
-    generics = [x.lower() for x in generics]
-    lines = lines.split("\n")
-    lines = [x.lower() for x in lines]
-    genList.append(generics)
-    return dict(zip(generics, lines))
+    drugs = druglist.parse(f.read(), source=getattr(f, 'name', '<drug list>')).patterns
+    genList.append(list(drugs.keys()))
+    return dict(drugs)
 
 def search(NOTES,
            SSRI_FILE = os.path.join(os.getcwd(), "opiates.txt"),
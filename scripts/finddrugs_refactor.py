@@ -9,12 +9,94 @@
 # mghassem {AT} mit {DOT} edu
 #--------------------------------
 
+import argparse
+import contextlib
+import cProfile
+import hashlib
+import json
+import math
+import multiprocessing
 import os
 import os.path
+import pstats
 import re
+import shutil
 import sys
+import tempfile
 import time
-from collections import OrderedDict
+from collections import namedtuple
+
+import dosage
+import druglist
+import notestore
+import sectionindex
+
+
+# Section header heuristic of the original scanner. Kept for reference and
+# for findHeaderMismatches; isSectionHeader gives the same answer in linear time
+HEADER_PATTERN = re.compile("""^((\d|[A-Z])(\.|\)))?\s*([a-zA-Z',\.\-\*\d\[\]\(\) ]+)(:| WERE | IS | ARE |INCLUDED|INCLUDING)""", re.I)
+
+# Pieces of HEADER_PATTERN, each matched on its own without backtracking
+HEADER_NUMBERING = re.compile("""(\d|[A-Z])(\.|\))""", re.I)
+HEADER_SPACE = re.compile("""\s*""", re.I)
+HEADER_CHARS = re.compile("""[a-zA-Z',\.\-\*\d\[\]\(\) ]*""", re.I)
+HEADER_NON_CHAR = re.compile("""[^a-zA-Z',\.\-\*\d\[\]\(\) ]""", re.I)
+HEADER_TERMINATOR = re.compile(""" WERE | IS | ARE |INCLUDED|INCLUDING""", re.I)
+
+ParsedNote = namedtuple('ParsedNote', ['fields', 'longLines', 'doses', 'sections', 'matches'])
+
+# sectionindex kind codes of the sections parseNote tracks
+SECTION_CODES = {'hist': 1, 'admit': 2, 'discharge': 3}
+
+
+def isSectionHeader(line):
+    """
+    ###### function isSectionHeader
+    #   line:    line of text to check
+    #
+    #   Same answer as HEADER_PATTERN.search(line), without its
+    #   backtracking. The header text is a run of header characters,
+    #   so it has to end right before a ':' or contain one of the
+    #   terminator words (which are made of header characters), and
+    #   the run can only start after the optional "1." / "A)" numbering
+    #   and some of the leading whitespace. Each piece is one linear
+    #   regex match, so long lines without a colon no longer blow up.
+    """
+    bases = [0]
+    numbering = HEADER_NUMBERING.match(line)
+    if numbering:
+        bases.append(numbering.end())
+
+    for base in bases:
+        spaceEnd = HEADER_SPACE.match(line, base).end()
+        # Whitespace that is not a header character (tabs, ...) cuts the
+        # run short, so the run may also start after the last one
+        starts = [base]
+        lastNonChar = None
+        for nonChar in HEADER_NON_CHAR.finditer(line, base, spaceEnd):
+            lastNonChar = nonChar
+        if lastNonChar:
+            starts.append(lastNonChar.end())
+
+        for start in starts:
+            end = HEADER_CHARS.match(line, start).end()
+            if end == start:
+                continue
+            if end < len(line) and line[end] == ':':
+                return True
+            if HEADER_TERMINATOR.search(line, start + 1, end):
+                return True
+    return False
+
+
+def findHeaderMismatches(lines):
+    """
+    ###### function findHeaderMismatches
+    #   lines:   regression corpus, e.g. every line of a note store
+    #
+    #   Returns the lines where isSectionHeader and HEADER_PATTERN disagree
+    """
+    return [line for line in lines if isSectionHeader(line) != bool(HEADER_PATTERN.search(line))]
 
 
 def addToDrugsFound(line, drugFlagArr, genericToBrandDrugMap, genericDrugToIndex):
@@ -36,43 +118,468 @@ def addToDrugsFound(line, drugFlagArr, genericToBrandDrugMap, genericDrugToIndex
     return drugFlagArr
 
 
+# Words (keeping "d/c'd", "o'clock" whole) and the punctuation that ends a
+# negation's scope, e.g. "no nausea, oxycodone 5mg" does not negate oxycodone
+TOKEN_PATTERN = re.compile("""[a-z0-9]+(?:['/][a-z0-9]+)*|[,;:.()]""")
+SCOPE_BREAKS = frozenset(',;:.()')
+
+# Cues before a drug name ("no oxycodone", "d/c'd fentanyl") and after it
+# ("oxycodone was stopped", "fentanyl held")
+NEGATION_CUES_BEFORE = frozenset(['no', 'not', 'denies', 'without', 'never', 'stop', 'stopped', 'held', 'hold',
+                                  'holding', 'discontinue', 'discontinued', "d/c", "d/c'd", "dc'd", 'dced',
+                                  'allergy', 'allergic', 'allergies'])
+NEGATION_CUES_AFTER = frozenset(['stopped', 'held', 'discontinued', "d/c'd", "dc'd", 'dced', 'allergy'])
+
+# Allergy cues reach across a colon or parentheses ("allergies: morphine",
+# "morphine (allergy)"), and an "allergies:" heading negates the rest of its line
+ALLERGY_CUES = frozenset(['allergy', 'allergic', 'allergies'])
+ALLERGY_SCOPE = frozenset(':()')
+
+MATCH_MODES = ('substring', 'token')
+
+
+def tokenize(line):
+    """
+    ###### function tokenize
+    #   Lower-cased word and scope-break tokens of a line
+    """
+    return TOKEN_PATTERN.findall(line.lower())
+
+
+def buildTokenTable(genericToDrugNames):
+    """
+    ###### function buildTokenTable
+    #   genericToDrugNames: generic -> (generic, brand1, ...) as in druglist.DrugList.names
+    #
+    #   Keys every drug name by its first token, so a line is matched
+    #   with one dictionary lookup per token: first token ->
+    #   [(name tokens, generic), ...]
+    """
+    tokenTable = {}
+    for generic, names in genericToDrugNames.items():
+        for name in names:
+            nameTokens = tuple(tokenize(name))
+            if nameTokens:
+                tokenTable.setdefault(nameTokens[0], []).append((nameTokens, generic))
+    return tokenTable
+
+
+def isNegated(tokens, start, stop, NEGATION_WINDOW):
+    """
+    ###### function isNegated
+    #   True if a negation cue is within NEGATION_WINDOW tokens of
+    #   tokens[start:stop] without a scope break in between (past a
+    #   colon or parenthesis only an allergy cue still counts)
+    """
+    allergyOnly = False
+    for i in range(start - 1, max(start - NEGATION_WINDOW, 0) - 1, -1):
+        if tokens[i] in SCOPE_BREAKS:
+            if tokens[i] not in ALLERGY_SCOPE:
+                break
+            allergyOnly = True
+        elif tokens[i] in (ALLERGY_CUES if allergyOnly else NEGATION_CUES_BEFORE):
+            return True
+    allergyOnly = False
+    for i in range(stop, min(stop + NEGATION_WINDOW, len(tokens))):
+        if tokens[i] in SCOPE_BREAKS:
+            if tokens[i] not in ALLERGY_SCOPE:
+                break
+            allergyOnly = True
+        elif tokens[i] in (ALLERGY_CUES if allergyOnly else NEGATION_CUES_AFTER):
+            return True
+    return False
+
+
+def allergyListStart(tokens):
+    """
+    ###### function allergyListStart
+    #   Index of the first token after an "allergies:" heading on the
+    #   line, len(tokens) if there is none
+    """
+    for i in range(len(tokens) - 1):
+        if tokens[i] in ALLERGY_CUES and tokens[i + 1] == ':':
+            return i + 2
+    return len(tokens)
+
+
+def addToDrugsFoundTokens(line, drugFlagArr, drugMentionArr, tokenTable, genericDrugToIndex, NEGATION_WINDOW=3):
+    """
+    ###### function addToDrugsFoundTokens
+    #   line:    line of text to search
+    #   drugFlagArr: flag array to modify
+    #   drugMentionArr: [mentions, negated mentions] counters to modify
+    #   tokenTable: drug names by first token, from buildTokenTable
+    #
+    #   Token mode of addToDrugsFound: names only match whole tokens
+    #   ("morphine" no longer matches inside "hydromorphone"), and a
+    #   mention next to a negation cue, or listed after an
+    #   "allergies:" heading, is counted but not flagged
+    """
+    tokens = tokenize(line)
+    allergyStart = allergyListStart(tokens)
+    for start, token in enumerate(tokens):
+        for nameTokens, generic in tokenTable.get(token, ()):
+            stop = start + len(nameTokens)
+            if tuple(tokens[start:stop]) != nameTokens:
+                continue
+            flagIndex = genericDrugToIndex[generic]
+            drugMentionArr[0][flagIndex] += 1
+            if start >= allergyStart or isNegated(tokens, start, stop, NEGATION_WINDOW):
+                drugMentionArr[1][flagIndex] += 1
+            else:
+                drugFlagArr[flagIndex] = 1
+    return drugFlagArr
+
+
+def findDrugSpans(line, lineDrugFlagArr, genericToBrandDrugMap, genericDrugToIndex, wholeTokens=False):
+    """
+    ###### function findDrugSpans
+    #   line:    medication line the drugs were found on
+    #   lineDrugFlagArr: drugs flagged on this line
+    #   wholeTokens: only match names on word boundaries (token mode)
+    #
+    #   Returns (generic, flagIndex, start, end) of the first mention
+    #   of each flagged drug, as character offsets in the line
+    """
+    spans = []
+    for generic, flagIndex in genericDrugToIndex.items():
+        if not lineDrugFlagArr[flagIndex]:
+            continue
+        pattern = genericToBrandDrugMap[generic]
+        if wholeTokens:
+            pattern = r"\b(?:" + pattern + r")\b"
+        m = re.search(pattern, line, re.I)
+        if m:
+            spans.append((generic, flagIndex, m.start(), m.end()))
+    return spans
+
+
+def addDosesFound(line, drugSpans, drugDoses):
+    """
+    ###### function addDosesFound
+    #   line:    medication line the drugs were found on
+    #   drugSpans: drug mentions on the line, from findDrugSpans
+    #   drugDoses: per drug (Dose, daily MME) to modify, None if not found yet
+    #
+    #   Reads dose, unit, route and frequency after each drug name, up
+    #   to the next drug on the line ("oxycodone prn, morphine 15 mg"
+    #   gives oxycodone no dose), and keeps the highest daily MME seen
+    #   for the drug
+    """
+    starts = sorted(start for generic, flagIndex, start, end in drugSpans)
+    for generic, flagIndex, start, end in drugSpans:
+        stop = next((nextStart for nextStart in starts if nextStart >= end), len(line))
+        dose = dosage.extract(line[end:stop])
+        mme = dosage.daily_mme(generic, dose)
+        found = drugDoses[flagIndex]
+        if found is None or mme > found[1] or (math.isnan(found[1]) and not math.isnan(mme)):
+            drugDoses[flagIndex] = (dose, mme)
+    return drugDoses
+
+
+def lineSpansToBytes(line, lineStart, drugSpans):
+    """
+    ###### function lineSpansToBytes
+    #   Turns findDrugSpans character offsets in a line starting at
+    #   byte lineStart into (drug index, start, end) note byte offsets
+    """
+    if line.isascii():
+        return [(flagIndex, lineStart + start, lineStart + end) for generic, flagIndex, start, end in drugSpans]
+    return [(flagIndex, lineStart + len(line[:start].encode('utf-8')), lineStart + len(line[:end].encode('utf-8')))
+            for generic, flagIndex, start, end in drugSpans]
+
+
 def readAndParseDrugList(DRUGLIST_FILE):
     """
     ###### function readDrugs
-    #   f:       file
-    #   genList: list of search terms in (generic:search list) form
+    #   DRUGLIST_FILE: drug list file
+    #
+    #   Converts lines of the form "generic|brand1|brand2" to an
+    #   ordered dictionary keyed by "generic" with value "generic|brand1|brand2"
+    #   (names regex-escaped). Validation and the cached artifact live
+    #   in druglist.load
+    """
+    print("Using drugs from {}".format(DRUGLIST_FILE))
+    return druglist.load(DRUGLIST_FILE).patterns
+
+
+def parseNote(text, genericToBrandDrugMap, genericDrugToIndex, VERBOSE=False, rowId=None, MAX_LINE_LENGTH=None,
+              tokenTable=None, NEGATION_WINDOW=3, EXTRACT_DOSES=False, INDEX_SECTIONS=False):
+    """
+    ###### Parse one note
+    #   text:    full note text
+    #   genericToBrandDrugMap: list of search terms in (generic:search list) form
+    #   genericDrugToIndex: flag array position of each generic
+    #   MAX_LINE_LENGTH: lines longer than this are never section headers
+    #   tokenTable: match drugs in token mode (see buildTokenTable)
+    #   NEGATION_WINDOW: tokens around a name searched for negation cues
+    #   EXTRACT_DOSES: also read the dose of each admission drug (see dosage)
+    #   INDEX_SECTIONS: also record byte spans of sections and drug mentions
     #
-    #   Converts lines of the form "generic|brand1|brand2" to a
-    #   dictionary keyed by "generic" with value "generic|brand1|brand2
-    #   and uses an ordered dict to preserve order of drug names
+    #   Walks the note line by line, tracking the current section, and
+    #   returns a ParsedNote with the summary fields written for the note:
+    #   [histFound, opiateHist, admitFound, dischargeFound, group, member] + drugsAdmit
+    #   (+ the confidence of each admission drug in token mode)
+    #   the number of lines that went over MAX_LINE_LENGTH and the
+    #   (Dose, daily MME) of each admission drug if EXTRACT_DOSES
+    #   and, if INDEX_SECTIONS, the (kind code, start, end) sections and
+    #   (drug index, start, end) mentions as UTF-8 byte offsets in the note
+    """
+    # Reset some per-patient variables
+    section = ""
+    newSection = ""
+    admitFound = 0  # admission note found
+    dischargeFound = 0  # discharge summary found
+    histFound = 0  # medical history found
+    opiateHist = 0
+    drugsAdmit = [0]*len(genericDrugToIndex)  # extend list to number of drugs
+    drugsDis = [0]*len(genericDrugToIndex)
+    # [mentions, negated mentions] per drug, token mode only
+    mentionsAdmit = [[0]*len(genericDrugToIndex), [0]*len(genericDrugToIndex)]
+    mentionsDis = [[0]*len(genericDrugToIndex), [0]*len(genericDrugToIndex)]
+    drugDoses = [None]*len(genericDrugToIndex)
+    longLines = 0
+    sections = []
+    matches = []
+    sectionStart = 0
+    lineStart = 0  # byte offset of the line, only tracked if INDEX_SECTIONS
+
+    # Read through lines sequentially
+    # If this looks like a section header, start looking for drugs
+    for line in text.split("\n"):
+        if INDEX_SECTIONS:
+            lineBytes = len(line.encode('utf-8'))
+
+        # Searches for a section header based on heuristics
+        if MAX_LINE_LENGTH and len(line) > MAX_LINE_LENGTH:
+            longLines += 1
+            m = False
+        else:
+            m = isSectionHeader(line)
+        if m:
+            newSection = ""
+            # Past Medical History Section
+            if re.search('med(ical)?\s+hist(ory)?', line, re.I):
+                newSection = "hist"
+                histFound = 1
+
+            # Discharge Medication Section
+            elif re.search('medication|meds', line, re.I) and re.search('disch(arge)?', line, re.I):
+                newSection = "discharge"
+                dischargeFound = 1
+
+            # Admitting Medication Section
+            elif re.search('admission|admitting|home|nh|nmeds|pre(\-|\s)?(hosp|op)|current|previous|outpatient|outpt|outside|^[^a-zA-Z]*med(ication)?(s)?', line, re.I) \
+            and (section == "admit" or re.search('medication|meds', line, re.I)):
+                newSection = "admit"
+                admitFound = 1
+
+            # Med section ended, now in non-meds section
+            if section != newSection:
+                if INDEX_SECTIONS and section in SECTION_CODES:
+                    sections.append((SECTION_CODES[section], sectionStart, lineStart))
+                sectionStart = lineStart
+                section = newSection
+
+        # If in history section, search for opiates
+        if 'hist' in section:
+            if re.search('opiate(s)?', line, re.I):
+                opiateHist = 1
+
+        # If in meds section, look at each line for specific drugs
+        elif 'admit' in section:
+            lineDrugs = [0]*len(genericDrugToIndex)
+            if tokenTable is None:
+                lineDrugs = addToDrugsFound(line, lineDrugs, genericToBrandDrugMap, genericDrugToIndex)
+            else:
+                lineDrugs = addToDrugsFoundTokens(line, lineDrugs, mentionsAdmit, tokenTable, genericDrugToIndex,
+                                                  NEGATION_WINDOW)
+            drugsAdmit = [max(found, onLine) for found, onLine in zip(drugsAdmit, lineDrugs)]
+            if (EXTRACT_DOSES or INDEX_SECTIONS) and 1 in lineDrugs:
+                drugSpans = findDrugSpans(line, lineDrugs, genericToBrandDrugMap, genericDrugToIndex,
+                                          wholeTokens=tokenTable is not None)
+                if EXTRACT_DOSES:
+                    drugDoses = addDosesFound(line, drugSpans, drugDoses)
+                if INDEX_SECTIONS:
+                    matches += lineSpansToBytes(line, lineStart, drugSpans)
+
+        # Already in meds section, look at each line for specific drugs
+        elif 'discharge' in section:
+            lineDrugs = [0]*len(genericDrugToIndex)
+            if tokenTable is None:
+                lineDrugs = addToDrugsFound(line, lineDrugs, genericToBrandDrugMap, genericDrugToIndex)
+            else:
+                lineDrugs = addToDrugsFoundTokens(line, lineDrugs, mentionsDis, tokenTable, genericDrugToIndex,
+                                                  NEGATION_WINDOW)
+            drugsDis = [max(found, onLine) for found, onLine in zip(drugsDis, lineDrugs)]
+            if INDEX_SECTIONS and 1 in lineDrugs:
+                drugSpans = findDrugSpans(line, lineDrugs, genericToBrandDrugMap, genericDrugToIndex,
+                                          wholeTokens=tokenTable is not None)
+                matches += lineSpansToBytes(line, lineStart, drugSpans)
+
+        # A line with information which we are uncertain about...
+        elif re.search('medication|meds', line, re.I) and re.search('admission|discharge|transfer', line, re.I):
+            if VERBOSE:
+                print('?? {}'.format(line))
+            pass
+
+        if INDEX_SECTIONS:
+            lineStart += lineBytes + 1
+
+    if INDEX_SECTIONS and section in SECTION_CODES:
+        # the last line has no newline after it
+        sections.append((SECTION_CODES[section], sectionStart, lineStart - 1))
+
+    hasDischarge = dischargeFound == 1
+    hasDrugsInDischarge = 1 in drugsDis
+    hasAdmit = admitFound == 1
+    hasDrugsInAdmit = 1 in drugsAdmit
+
+    group = 0
+    # Group 0: Patient has no medications on admission section (or no targeted meds)
+    #          and medications on discharge from the list
+    if hasDischarge and hasDrugsInDischarge and (not hasAdmit or not hasDrugsInAdmit):
+        group = 0
+
+    # Group 1: Patient has a medications on admission section with no targeted meds
+    #          and no medications on discharge
+    elif hasAdmit and not hasDrugsInAdmit and not hasDischarge:
+        group = 1
+
+    # Group 2: Patient has medications on admission section, but none from the list
+    #          and no medications on discharge from the list
+    elif hasAdmit and not hasDrugsInAdmit and hasDischarge and not hasDrugsInDischarge:
+        group = 2
+
+    # Group 3: Patient has medications on admission (at least one from the list)
+    elif hasDrugsInAdmit:
+        group = 3
+
+    else:
+        if VERBOSE:
+            print('Uncertain about group type for row_id = {}'.format(rowId))
+        pass
+
+    if VERBOSE:
+        print('group is {}'.format(group))
+
+    # Combine the admit and discharge drugs lists
+    member = int(hasDrugsInAdmit)
+
+    fields = [histFound, opiateHist, admitFound, dischargeFound, group, member] + drugsAdmit
+
+    # Confidence that an admission drug was taken: share of its
+    # mentions that were not negated. An empty field (NaN when read
+    # back) when never mentioned, so 0 only means every mention was negated
+    if tokenTable is not None:
+        fields += [round(1.0 - negated / float(mentions), 3) if mentions else ''
+                   for mentions, negated in zip(*mentionsAdmit)]
+    return ParsedNote(fields=fields, longLines=longLines, doses=drugDoses if EXTRACT_DOSES else None,
+                      sections=sections if INDEX_SECTIONS else None, matches=matches if INDEX_SECTIONS else None)
+
+
+def noteDigest(text):
+    """
+    ###### function noteDigest
+    #   Fixed size key identifying a note text, so identical texts
+    #   (one discharge summary joined to several ICU stays) are parsed once
+    """
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=16).digest()
+
+
+# Per-process state of the parseStoreChunk workers, set once by initParseWorker
+_workerStore = None
+_workerDrugMap = None
+_workerDrugIndex = None
+_workerParseOptions = {}
+
+
+def initParseWorker(storePath, genericToBrandDrugMap, parseOptions=None, storeWindow=(0, None)):
+    """
+    ###### function initParseWorker
+    #   Opens the note store (memory mapped, so its pages are shared
+    #   with every other worker) or the same start:stop window of it as
+    #   the parent, and keeps the drug map and the extra parseNote
+    #   keyword arguments for the worker
+    """
+    global _workerStore, _workerDrugMap, _workerDrugIndex, _workerParseOptions
+    _workerStore = notestore.NoteStore(storePath, *storeWindow)
+    _workerParseOptions = parseOptions or {}
+    _workerDrugMap = genericToBrandDrugMap
+    _workerDrugIndex = dict((v, k) for k, v in enumerate(genericToBrandDrugMap.keys()))
+
+
+def parseStoreChunk(positions):
+    """
+    ###### function parseStoreChunk
+    #   Parses the store notes at the given positions in a worker and
+    #   returns (digest, ParsedNote) pairs
     """
-    with open(DRUGLIST_FILE) as f:
-        print("Using drugs from {}".format(DRUGLIST_FILE))
-        lines = f.read()
-        drugGenerics = re.findall("^(.*?)\|", lines, re.MULTILINE)
-        drugGenerics = [x.lower() for x in drugGenerics]
-        drugBrandsWithGeneric = lines.split("\n")
-        drugBrandsWithGeneric = [x.lower() for x in drugBrandsWithGeneric]
+    parsed = []
+    for position in positions:
+        note = notestore.StoredNote(_workerStore, position)
+        parsed.append((note.digest, parseNote(note.text, _workerDrugMap, _workerDrugIndex, rowId=note.row_id,
+                                              **_workerParseOptions)))
+    return parsed
 
-    return OrderedDict(zip(drugGenerics, drugBrandsWithGeneric))
+
+def parseStoreParallel(store, genericToBrandDrugMap, N_JOBS, parseOptions=None):
+    """
+    ###### function parseStoreParallel
+    #   Parses every distinct text of a note store in a process pool.
+    #   Workers get store positions, not texts, and return parsed
+    #   notes keyed by note digest
+    """
+    distinct = store.distinct()
+    chunkSize = max(1, len(distinct) // (N_JOBS * 8))
+    chunks = [distinct[i:i + chunkSize] for i in range(0, len(distinct), chunkSize)]
+    parsedNotes = {}
+    pool = multiprocessing.Pool(processes=N_JOBS, initializer=initParseWorker,
+                                initargs=(store.path, genericToBrandDrugMap, parseOptions, (store.start, store.stop)))
+    try:
+        for parsed in pool.imap(parseStoreChunk, chunks):
+            parsedNotes.update(parsed)
+    finally:
+        pool.close()
+        pool.join()
+    return parsedNotes
 
 
 def search(NOTES,
            DRUGLIST_FILE,
            SUMMARY_FILE = "output.csv",
-           VERBOSE = False):
+           VERBOSE = False,
+           N_JOBS = 1,
+           MAX_LINE_LENGTH = None,
+           MATCH_MODE = "substring",
+           NEGATION_WINDOW = 3,
+           DOSE_FILE = None,
+           SECTION_INDEX_FILE = None):
     """
     ###### Search the notes
-    # NOTES: dataframe loaded from the noteevents table
+    # NOTES: dataframe loaded from the noteevents table, or a notestore.NoteStore
     # DRUG_FILE: list of drugList drugs to search for
+    # N_JOBS: worker processes parsing the notes (NoteStore only)
+    # MAX_LINE_LENGTH: skip the header check on longer lines (e.g. pasted lab tables)
+    # MATCH_MODE: "substring" (original regex search) or "token" (whole
+    #      tokens, negated mentions not flagged, adds <drug>_confidence columns)
+    # NEGATION_WINDOW: tokens either side of a drug checked for negation cues
+    # DOSE_FILE: also write admission drug doses / daily MME per note to this .npz
+    # SECTION_INDEX_FILE: also write section and drug mention byte offsets (see sectionindex)
     #
     # NB: files should have a line for each distinct drug type,
     #      and drugs should be separated by a vertical bar '|'
     #
     # LIMIT FOR PARSING: max number of notes to search.
     # OUTPUT: name of the output file.
+    #
+    # Each distinct note text is parsed once; rows sharing a text
+    # (same discharge summary for several ICU stays) reuse the result.
     """
 
+    if MATCH_MODE not in MATCH_MODES:
+        raise ValueError("MATCH_MODE must be one of {}, got {!r}".format(MATCH_MODES, MATCH_MODE))
+
     if os.path.isfile(SUMMARY_FILE):
         print('The output file already exists.\n\nRemove the following file or save with a different filename:')
         print(os.path.join(os.getcwd(), SUMMARY_FILE))
@@ -85,22 +592,34 @@ def search(NOTES,
     genericDrugList = genericToBrandDrugMap.keys()
     genericDrugToIndex = dict((v, k) for k, v in enumerate(genericToBrandDrugMap.keys()))
 
-    # # Create indices for the flat list
-    # # This allows us to understand which "types" are being used
-    # lengths = [len(type) for type in genericDrugList]
-    # prevLeng = 0
-    # starts = []
-    # ends = []
-    # for leng in lengths:
-    #     starts.append(prevLeng)
-    #     ends.append(prevLeng + leng - 1)
-    #     prevLeng = prevLeng + leng
+    isStore = isinstance(NOTES, notestore.NoteStore)
+    if N_JOBS > 1 and not isStore:
+        raise ValueError("N_JOBS > 1 needs NOTES as a notestore.NoteStore, see notestore.build()")
+
+    parseOptions = {'MAX_LINE_LENGTH': MAX_LINE_LENGTH}
+    confidenceColumns = []
+    if MATCH_MODE == "token":
+        parseOptions['tokenTable'] = buildTokenTable(druglist.load(DRUGLIST_FILE).names)
+        parseOptions['NEGATION_WINDOW'] = NEGATION_WINDOW
+        confidenceColumns = [generic + '_confidence' for generic in genericDrugList]
+    if DOSE_FILE:
+        parseOptions['EXTRACT_DOSES'] = True
+        noteIds, noteDoses = [], []
+    if SECTION_INDEX_FILE:
+        parseOptions['INDEX_SECTIONS'] = True
+        indexIds, indexBlocks, blockOfDigest = [], [], {}
+
+    # Parsed notes keyed by note text digest
+    if N_JOBS > 1:
+        parsedNotes = parseStoreParallel(NOTES, genericToBrandDrugMap, N_JOBS, parseOptions=parseOptions)
+    else:
+        parsedNotes = {}
 
     # Write heads and notes to new doc
     with open(SUMMARY_FILE, 'a') as f_out:
         header = '"row_id","subject_id","hadm_id","hist_found","opiate_history",' \
                  '"admit_found","dis_found","group","opiates","'\
-                 + '","'.join(genericDrugList) + '"\n'
+                 + '","'.join(list(genericDrugList) + confidenceColumns) + '"\n'
         f_out.write(header)
 
         # Parse each patient record
@@ -111,106 +630,242 @@ def search(NOTES,
                 print("...index: {}. row_id: {}. subject_id: {}. hadm_id: {}. \n".format(note.Index, note.row_id, note.subject_id, note.hadm_id))
                 sys.stdout.flush()
 
-            # Reset some per-patient variables
-            section = ""
-            newSection = ""
-            admitFound = 0  # admission note found
-            dischargeFound = 0  # discharge summary found
-            histFound = 0  # medical history found
-            opiateHist = 0
-            drugsAdmit = [0]*len(genericDrugList)  # extend list to number of drugs
-            drugsDis = [0]*len(genericDrugList)
-
-            # Read through lines sequentially
-            # If this looks like a section header, start looking for drugs
-            for line in note.text.split("\n"):
-
-                # Searches for a section header based on heuristics
-                m = re.search("""^((\d|[A-Z])(\.|\)))?\s*([a-zA-Z',\.\-\*\d\[\]\(\) ]+)(:| WERE | IS | ARE |INCLUDED|INCLUDING)""", line, re.I)
-                if m:
-                    newSection = ""
-                    # Past Medical History Section
-                    if re.search('med(ical)?\s+hist(ory)?', line, re.I):
-                        newSection = "hist"
-                        histFound = 1
-
-                    # Discharge Medication Section
-                    elif re.search('medication|meds', line, re.I) and re.search('disch(arge)?', line, re.I):
-                        newSection = "discharge"
-                        dischargeFound = 1
-
-                    # Admitting Medication Section
-                    elif re.search('admission|admitting|home|nh|nmeds|pre(\-|\s)?(hosp|op)|current|previous|outpatient|outpt|outside|^[^a-zA-Z]*med(ication)?(s)?', line, re.I) \
-                    and (section == "admit" or re.search('medication|meds', line, re.I)):
-                        newSection = "admit"
-                        admitFound = 1
-
-                    # Med section ended, now in non-meds section
-                    if section != newSection:
-                        section = newSection
-
-                # If in history section, search for opiates
-                if 'hist' in section:
-                    if re.search('opiate(s)?', line, re.I):
-                        opiateHist = 1
-
-                # If in meds section, look at each line for specific drugs
-                elif 'admit' in section:
-                    drugsAdmit = addToDrugsFound(line, drugsAdmit, genericToBrandDrugMap, genericDrugToIndex)
-
-                # Already in meds section, look at each line for specific drugs
-                elif 'discharge' in section:
-                    drugsDis = addToDrugsFound(line, drugsDis, genericToBrandDrugMap, genericDrugToIndex)
-
-                # A line with information which we are uncertain about...
-                elif re.search('medication|meds', line, re.I) and re.search('admission|discharge|transfer', line, re.I):
-                    if VERBOSE:
-                        print('?? {}'.format(line))
-                    pass
-
-            hasDischarge = dischargeFound == 1
-            hasDrugsInDischarge = 1 in drugsDis
-            hasAdmit = admitFound == 1
-            hasDrugsInAdmit = 1 in drugsAdmit
-
-            group = 0
-            # Group 0: Patient has no medications on admission section (or no targeted meds)
-            #          and medications on discharge from the list
-            if hasDischarge and hasDrugsInDischarge and (not hasAdmit or not hasDrugsInAdmit):
-                group = 0
-
-            # Group 1: Patient has a medications on admission section with no targeted meds
-            #          and no medications on discharge
-            elif hasAdmit and not hasDrugsInAdmit and not hasDischarge:
-                group = 1
-
-            # Group 2: Patient has medications on admission section, but none from the list
-            #          and no medications on discharge from the list
-            elif hasAdmit and not hasDrugsInAdmit and hasDischarge and not hasDrugsInDischarge:
-                group = 2
-
-            # Group 3: Patient has medications on admission (at least one from the list)
-            elif hasDrugsInAdmit:
-                group = 3
-
-            else:
-                if VERBOSE:
-                    print('Uncertain about group type for row_id = {}'.format(note.row_id))
-                pass
-
-            if VERBOSE:
-                print('group is {}'.format(group))
-
-            # Combine the admit and discharge drugs lists
-            member = int(hasDrugsInAdmit)
+            digest = note.digest if isStore else noteDigest(note.text)
+            if digest not in parsedNotes:
+                parsedNotes[digest] = parseNote(note.text, genericToBrandDrugMap, genericDrugToIndex,
+                                                VERBOSE=VERBOSE, rowId=note.row_id, **parseOptions)
+            fields = parsedNotes[digest].fields
+            if DOSE_FILE:
+                noteIds.append((note.row_id, note.subject_id, note.hadm_id))
+                noteDoses.append(parsedNotes[digest].doses)
+            if SECTION_INDEX_FILE:
+                indexIds.append((note.row_id, note.subject_id, note.hadm_id))
+                indexBlocks.append(blockOfDigest.setdefault(digest, len(blockOfDigest)))
 
             # save items to csv
-            f_out.write(str(note.row_id) + "," + str(note.subject_id) + "," + str(note.hadm_id) + "," + str(histFound)
-                        + "," + str(opiateHist) + "," + str(admitFound) + "," + str(dischargeFound)  + "," + str(group)
-                        + "," + str(member) + "," + ",".join(map(str, drugsAdmit)) + "\n")
+            f_out.write(str(note.row_id) + "," + str(note.subject_id) + "," + str(note.hadm_id) + ","
+                        + ",".join(map(str, fields)) + "\n")
+
+    if DOSE_FILE:
+        rowIds, subjectIds, hadmIds = zip(*noteIds) if noteIds else ((), (), ())
+        dosage.write_matrix(DOSE_FILE, rowIds, subjectIds, hadmIds, list(genericDrugList), noteDoses)
+    if SECTION_INDEX_FILE:
+        # one block of spans per distinct text, in order of first appearance
+        blockDigests = sorted(blockOfDigest, key=blockOfDigest.get)
+        rowIds, subjectIds, hadmIds = zip(*indexIds) if indexIds else ((), (), ())
+        sectionindex.write(SECTION_INDEX_FILE, rowIds, subjectIds, hadmIds, indexBlocks, list(genericDrugList),
+                           [parsedNotes[digest].sections for digest in blockDigests],
+                           [parsedNotes[digest].matches for digest in blockDigests])
 
     # Print summary of analysis
     stoptime = time.time()
     print("Done analyzing {} documents in {} seconds ({} docs/sec)".format(len(NOTES),
         round(stoptime - starttime, 2), round(len(NOTES) / (stoptime - starttime), 2)))
+    print("Parsed {} distinct note texts, reused {} duplicates".format(len(parsedNotes), len(NOTES) - len(parsedNotes)))
+    if MAX_LINE_LENGTH:
+        longLines = sum(parsed.longLines for parsed in parsedNotes.values())
+        print("{} lines longer than {} characters skipped the header check".format(longLines, MAX_LINE_LENGTH))
     print("Summary file is in {}".format(os.getcwd()))
+    if DOSE_FILE:
+        print("Dose matrix is in {}".format(os.path.abspath(DOSE_FILE)))
+    if SECTION_INDEX_FILE:
+        print("Section index is in {}".format(os.path.abspath(SECTION_INDEX_FILE)))
+
+
+NOTE_COLUMNS = ['row_id', 'subject_id', 'hadm_id', 'text']
+PART_PATTERN = "part-{:05d}.csv"
+MANIFEST_FILE = "manifest.json"
+
+
+def readNotes(path):
+    """
+    ###### function readNotes
+    #   Opens the notes to scan: a note store (path without suffix,
+    #   see notestore.build), or a .csv / .parquet file with the
+    #   row_id, subject_id, hadm_id and text columns of discharge_events()
+    """
+    if os.path.isfile(path + notestore.INDEX_SUFFIX):
+        return notestore.NoteStore(path)
+    import pandas as pd
+    if path.endswith('.parquet'):
+        NOTES = pd.read_parquet(path, columns=NOTE_COLUMNS)
+    else:
+        NOTES = pd.read_csv(path, usecols=NOTE_COLUMNS)
+    NOTES['text'] = NOTES['text'].fillna('')
+    return NOTES.reset_index(drop=True)
+
+
+def noteBytes(NOTES):
+    """
+    ###### function noteBytes
+    #   Size of the note texts in bytes (characters for a dataframe),
+    #   for the throughput report
+    """
+    if isinstance(NOTES, notestore.NoteStore):
+        return int(NOTES.index['length'].sum())
+    return int(NOTES['text'].str.len().sum())
+
+
+def noteBatch(NOTES, start, stop):
+    """
+    ###### function noteBatch
+    #   Notes start:stop of a dataframe or note store
+    """
+    if isinstance(NOTES, notestore.NoteStore):
+        return NOTES.window(start, stop)
+    return NOTES.iloc[start:stop]
+
+
+def openPartsDir(partsDir, manifest, resume):
+    """
+    ###### function openPartsDir
+    #   Creates the directory holding one summary file per batch. With
+    #   resume, an existing directory is reused if it was written for
+    #   the same input and options; finished parts are then skipped
+    """
+    manifestPath = os.path.join(partsDir, MANIFEST_FILE)
+    if os.path.isdir(partsDir):
+        if not resume:
+            raise ValueError("{} exists from an earlier run; pass --resume to continue it or remove it".format(partsDir))
+        with open(manifestPath) as f_in:
+            previous = json.load(f_in)
+        if previous != manifest:
+            raise ValueError("{} was written with other options: {}".format(partsDir, previous))
+        return
+    os.makedirs(partsDir)
+    with open(manifestPath, 'w') as f_out:
+        json.dump(manifest, f_out, indent=1, sort_keys=True)
+
+
+def mergeParts(partPaths, OUTPUT):
+    """
+    ###### function mergeParts
+    #   Joins the batch summary files into OUTPUT: one header and every
+    #   row in note order for .csv (the same file a single search()
+    #   writes), or a parquet table for .parquet
+    """
+    if OUTPUT.endswith('.parquet'):
+        import pandas as pd
+        pd.concat([pd.read_csv(path) for path in partPaths], ignore_index=True).to_parquet(OUTPUT, index=False)
+        return
+    with open(OUTPUT, 'w') as f_out:
+        for i, path in enumerate(partPaths):
+            with open(path) as f_in:
+                header = f_in.readline()
+                if i == 0:
+                    f_out.write(header)
+                shutil.copyfileobj(f_in, f_out)
+
+
+def runBatches(NOTES, DRUGLIST_FILE, OUTPUT, BATCH_SIZE=None, RESUME=False, QUIET=False, **searchOptions):
+    """
+    ###### function runBatches
+    #   Scans the notes BATCH_SIZE at a time with search(), each batch
+    #   into its own part file under <OUTPUT>.parts, then merges the
+    #   parts into OUTPUT. A part is renamed into place only once its
+    #   batch is done, so a killed run can be resumed from the last
+    #   finished batch. Returns (notes scanned now, batches skipped)
+    """
+    if os.path.exists(OUTPUT):
+        raise ValueError("{} already exists".format(OUTPUT))
+    BATCH_SIZE = BATCH_SIZE or max(len(NOTES), 1)
+    partsDir = OUTPUT + '.parts'
+    manifest = {'notes': len(NOTES), 'batch_size': BATCH_SIZE, 'druglist': os.path.abspath(DRUGLIST_FILE),
+                'options': dict((k, v) for k, v in searchOptions.items() if k != 'N_JOBS')}
+    openPartsDir(partsDir, manifest, RESUME)
+
+    scanned, skipped, partPaths = 0, 0, []
+    for batch, start in enumerate(range(0, max(len(NOTES), 1), BATCH_SIZE)):
+        partPath = os.path.join(partsDir, PART_PATTERN.format(batch))
+        partPaths.append(partPath)
+        if os.path.isfile(partPath):
+            skipped += 1
+            continue
+        tmpPath = partPath + '.tmp'
+        if os.path.isfile(tmpPath):
+            os.remove(tmpPath)
+        notes = noteBatch(NOTES, start, start + BATCH_SIZE)
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull if QUIET else sys.stdout):
+            search(notes, DRUGLIST_FILE, SUMMARY_FILE=tmpPath, **searchOptions)
+        if isinstance(notes, notestore.NoteStore):
+            notes.close()
+        os.replace(tmpPath, partPath)
+        scanned += len(notes)
+        print("batch {} done: notes {}-{} of {}".format(batch, start, start + len(notes), len(NOTES)))
+        sys.stdout.flush()
+
+    mergeParts(partPaths, OUTPUT)
+    shutil.rmtree(partsDir)
+    return scanned, skipped
+
+
+def parseArgs(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Flag drugs (default: opiates) in discharge notes, outside of a notebook.")
+    parser.add_argument('notes', help="notes as .csv or .parquet (row_id, subject_id, hadm_id, text), "
+                                      "or a note store path without suffix")
+    parser.add_argument('-d', '--druglist', required=True, help="drug list file, e.g. ../data/opiates.txt")
+    parser.add_argument('-o', '--output', default='output.csv', help="summary file, .csv or .parquet")
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help="worker processes; csv/parquet notes are copied to a note store first")
+    parser.add_argument('-b', '--batch-size', type=int, default=None,
+                        help="notes per batch; every finished batch is a resume point (default: one batch)")
+    parser.add_argument('--resume', action='store_true', help="continue an interrupted run, skipping finished batches")
+    parser.add_argument('--match-mode', choices=MATCH_MODES, default='substring')
+    parser.add_argument('--negation-window', type=int, default=3)
+    parser.add_argument('--max-line-length', type=int, default=None)
+    parser.add_argument('--profile', metavar='STATS_FILE', default=None,
+                        help="run under cProfile (main process only) and save the stats here")
+    parser.add_argument('-q', '--quiet', action='store_true', help="only print batch progress and the summary")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """
+    ###### function main
+    #   Command line entry point, e.g.
+    #   python finddrugs_refactor.py notes.parquet -d ../data/opiates.txt \
+    #       -o flags.parquet -j 8 -b 20000
+    """
+    args = parseArgs(argv)
+    starttime = time.time()
+    NOTES = readNotes(args.notes)
+    print("Loaded {} notes from {} in {} seconds".format(len(NOTES), args.notes, round(time.time() - starttime, 2)))
+
+    workDir = None
+    if args.jobs > 1 and not isinstance(NOTES, notestore.NoteStore):
+        # workers share notes through a memory mapped store, not pickled dataframes
+        workDir = tempfile.mkdtemp(prefix='finddrugs_')
+        NOTES = notestore.build(NOTES, os.path.join(workDir, 'notes'))
+
+    totalNotes, totalBytes = len(NOTES), noteBytes(NOTES)
+    searchOptions = dict(N_JOBS=args.jobs, MAX_LINE_LENGTH=args.max_line_length, MATCH_MODE=args.match_mode,
+                         NEGATION_WINDOW=args.negation_window)
+    profiler = cProfile.Profile() if args.profile else None
+    scanStart = time.time()
+    try:
+        if profiler:
+            profiler.enable()
+        scanned, skipped = runBatches(NOTES, args.druglist, args.output, BATCH_SIZE=args.batch_size,
+                                      RESUME=args.resume, QUIET=args.quiet, **searchOptions)
+    finally:
+        if profiler:
+            profiler.disable()
+        if isinstance(NOTES, notestore.NoteStore):
+            NOTES.close()
+        if workDir:
+            shutil.rmtree(workDir)
+    seconds = time.time() - scanStart
+
+    if profiler:
+        profiler.dump_stats(args.profile)
+        pstats.Stats(args.profile).sort_stats('cumulative').print_stats(20)
+    share = scanned / float(max(totalNotes, 1))
+    print("Scanned {} notes in {} seconds: {} notes/sec, {} MB/sec{}".format(
+        scanned, round(seconds, 2), round(scanned / seconds, 1), round(totalBytes * share / 1e6 / seconds, 2),
+        ", {} finished batches resumed".format(skipped) if skipped else ""))
+    print("Summary file is {}".format(os.path.abspath(args.output)))
+
+
+if __name__ == '__main__':
+    main()
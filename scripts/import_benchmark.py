@@ -0,0 +1,54 @@
+"""
+Import time of the helper modules, each timed in a fresh interpreter (so nothing is cached in
+sys.modules), together with the heavy dependencies the import pulled in.
+
+    python import_benchmark.py
+    python import_benchmark.py analysis_helper analysis_plots --repeat 10
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+import numpy as np
+
+MODULES = ['notebook_helper', 'analysis_helper', 'analysis_stats', 'analysis_plots', 'survival', 'queries']
+HEAVY = ['pandas', 'matplotlib', 'scipy', 'statsmodels', 'queries']
+
+TIMER = """
+import sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+# a LazyLoader stub only counts once its module has really run
+loaded = [name for name in {heavy!r} if type(sys.modules.get(name)).__name__ not in ('NoneType', '_LazyModule')]
+print('%f %s' % (elapsed, ','.join(loaded)))
+"""
+
+
+def time_import(module, repeat=5):
+    """seconds per import of module over repeat fresh interpreters, and the heavy modules it loaded"""
+    here = os.path.dirname(os.path.abspath(__file__))
+    seconds = []
+    for _ in range(repeat):
+        out = subprocess.check_output([sys.executable, '-c', TIMER.format(module=module, heavy=HEAVY)], cwd=here)
+        elapsed, _, loaded = out.decode('utf-8').strip().partition(' ')
+        seconds.append(float(elapsed))
+    return np.array(seconds), loaded.split(',') if loaded else []
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('modules', nargs='*', default=MODULES)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    print("%-20s %10s %10s  %s" % ('module', 'median ms', 'min ms', 'loaded'))
+    for module in args.modules:
+        seconds, loaded = time_import(module, args.repeat)
+        print("%-20s %10.1f %10.1f  %s" % (module, np.median(seconds) * 1000, seconds.min() * 1000,
+                                            ', '.join(loaded) or '-'))
+
+
+if __name__ == '__main__':
+    main()
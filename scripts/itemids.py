@@ -0,0 +1,59 @@
+# MIMIC-III itemids for the phase three first-day aggregates, CareVue and MetaVision ids together.
+# Lists follow the mimic-code firstday vitals/labs concepts: https://github.com/MIT-LCP/mimic-code
+
+# chartevents
+vitals = {
+    'heart_rate': [211, 220045],
+    'sys_bp': [51, 442, 455, 6701, 220179, 220050],
+    'dias_bp': [8368, 8440, 8441, 8555, 220180, 220051],
+    'mean_bp': [456, 52, 6702, 443, 220052, 220181, 225312],
+    'resp_rate': [615, 618, 220210, 224690],
+    'temp_c': [223761, 678, 223762, 676],
+    'spo2': [646, 220277],
+    'glucose': [807, 811, 1529, 3745, 3744, 225664, 220621, 226537],
+}
+
+# valid physiologic ranges from the same concepts: a value is kept when low < value <= high, anything
+# else is a charting error (temp_c is checked after the fahrenheit conversion; None: no upper bound)
+vital_ranges = {
+    'heart_rate': (0, 300),
+    'sys_bp': (0, 400),
+    'dias_bp': (0, 300),
+    'mean_bp': (0, 300),
+    'resp_rate': (0, 70),
+    'temp_c': (10, 50),
+    'spo2': (0, 100),
+    'glucose': (0, None),
+}
+
+# temperatures charted in fahrenheit, converted to celsius before aggregating
+fahrenheit = [223761, 678]
+
+# labevents
+labs = {
+    'bicarbonate': [50882],
+    'bilirubin': [50885],
+    'bun': [51006],
+    'creatinine': [50912],
+    'glucose': [50809, 50931],
+    'hemoglobin': [51222, 50811],
+    'lactate': [50813],
+    'platelet': [51265],
+    'potassium': [50822, 50971],
+    'sodium': [50824, 50983],
+    'wbc': [51300, 51301],
+}
+
+lab_ranges = {
+    'bicarbonate': (0, 10000),
+    'bilirubin': (0, 150),
+    'bun': (0, 300),
+    'creatinine': (0, 150),
+    'glucose': (0, 10000),
+    'hemoglobin': (0, 50),
+    'lactate': (0, 50),
+    'platelet': (0, 10000),
+    'potassium': (0, 30),
+    'sodium': (0, 200),
+    'wbc': (0, 1000),
+}
@@ -0,0 +1,214 @@
+"""
+Propensity score matching of an exposed group (opiate) against the reference group
+(non opiate) of an analysis_helper.Data.
+
+The propensity model is a logistic regression fitted by Newton/IRLS in NumPy. Numeric
+covariates are standardized and categorical ones (admission_type, gender, ...) one-hot
+encoded. Matching is greedy nearest neighbour on the logit of the score, within a caliper
+(in standard deviations of the logit, 0.2 by default), optionally only within exact strata.
+Controls are kept sorted, so each exposed row finds its neighbour with a binary search plus
+skip pointers over already used controls, instead of comparing every exposed row with
+every control.
+
+The matched rows come back as a new Data with the same groups, so every plot and test in
+analysis_helper (and resampling) runs on the matched cohort unchanged.
+"""
+import contextlib
+import io
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+from scipy.special import expit
+
+import analysis_helper
+import resampling
+
+Propensity = namedtuple('propensity', ['coef', 'score', 'logit'])
+Matching = namedtuple('matching', ['data', 'pairs', 'propensity', 'caliper', 'unmatched'])
+
+
+def design_matrix(df, covariates):
+    """intercept + standardized numeric covariates + one-hot categorical covariates (first level dropped)"""
+    numeric = [col for col in covariates if pd.api.types.is_numeric_dtype(df[col]) and not pd.api.types.is_bool_dtype(df[col])]
+    categorical = [col for col in covariates if col not in numeric]
+    parts = [pd.DataFrame({'intercept': 1.0}, index=df.index)]
+    if numeric:
+        values = df[numeric].astype(float)
+        std = values.std().replace(0, 1.0)
+        parts.append((values - values.mean()) / std)
+    if categorical:
+        parts.append(pd.get_dummies(df[categorical].astype(str), drop_first=True, dtype=float))
+    return pd.concat(parts, axis=1)
+
+
+def fit_propensity(df, covariates, treated, max_iter=50, tol=1e-8, ridge=1e-6):
+    """logistic regression of treated (0/1 array) on covariates by IRLS, returns the Propensity of every row"""
+    X = design_matrix(df, covariates)
+    names = X.columns
+    X = X.values
+    y = np.asarray(treated, dtype=float)
+    beta = np.zeros(X.shape[1])
+    # tiny ridge keeps the hessian invertible for sparse one-hot levels
+    penalty = ridge * np.eye(X.shape[1])
+    penalty[0, 0] = 0.0
+    for _ in range(max_iter):
+        p = expit(X @ beta)
+        w = p * (1.0 - p)
+        gradient = X.T @ (y - p) - penalty @ beta
+        hessian = (X.T * w) @ X + penalty
+        step = np.linalg.solve(hessian, gradient)
+        beta += step
+        if np.abs(step).max() < tol:
+            break
+    logit = X @ beta
+    return Propensity(coef=pd.Series(beta, index=names), score=expit(logit), logit=logit)
+
+
+def __find(parent, i):
+    """root of i in a skip-pointer array, compressing the path on the way"""
+    root = i
+    while parent[root] != root:
+        root = parent[root]
+    while parent[i] != root:
+        parent[i], i = root, parent[i]
+    return root
+
+
+def __match_without_replacement(treated_logit, control_logit, caliper, ratio):
+    """greedy nearest available control per treated row (highest score first); returns (treated, control) positions"""
+    order = np.argsort(control_logit, kind='mergesort')
+    sorted_logit = control_logit[order]
+    n_control = len(sorted_logit)
+    # right[i]: first unused sorted control >= i (n_control if none); left[i + 1]: last unused <= i (0 -> none)
+    right = np.arange(n_control + 1)
+    left = np.arange(n_control + 1)
+    insert_at = np.searchsorted(sorted_logit, treated_logit)
+    by_score = np.argsort(-treated_logit, kind='mergesort')
+
+    pairs = []
+    for _ in range(ratio):
+        for t in by_score:
+            position = insert_at[t]
+            r = __find(right, position)
+            l = __find(left, position) - 1
+            best, distance = -1, np.inf
+            if r < n_control:
+                best, distance = r, sorted_logit[r] - treated_logit[t]
+            if l >= 0 and treated_logit[t] - sorted_logit[l] <= distance:
+                best, distance = l, treated_logit[t] - sorted_logit[l]
+            if best < 0 or distance > caliper:
+                continue
+            right[best] = best + 1
+            left[best + 1] = best
+            pairs.append((t, order[best], distance))
+    return pairs
+
+
+def __match_with_replacement(treated_logit, control_logit, caliper, ratio):
+    """ratio nearest controls of every treated row within the caliper, controls reusable"""
+    order = np.argsort(control_logit, kind='mergesort')
+    sorted_logit = control_logit[order]
+    insert_at = np.searchsorted(sorted_logit, treated_logit)
+    candidates = insert_at[:, None] + np.arange(-ratio, ratio)
+    valid = (candidates >= 0) & (candidates < len(sorted_logit))
+    candidates = np.clip(candidates, 0, max(len(sorted_logit) - 1, 0))
+    distance = np.where(valid, np.abs(sorted_logit[candidates] - treated_logit[:, None]), np.inf)
+    nearest = np.argsort(distance, axis=1, kind='mergesort')[:, :ratio]
+    rows = np.arange(len(treated_logit))[:, None]
+    chosen, chosen_distance = candidates[rows, nearest], distance[rows, nearest]
+    keep = chosen_distance <= caliper
+    t = np.broadcast_to(rows, chosen.shape)[keep]
+    return list(zip(t, order[chosen[keep]], chosen_distance[keep]))
+
+
+def match(data, covariates, group=None, caliper=0.2, exact=None, ratio=1, replace=False):
+    """
+    propensity match group (default: the only exposed group, i.e. opiate) against the reference group.
+    caliper is in standard deviations of the logit score (None: no caliper). exact lists columns whose
+    values must agree within a pair (e.g. ['admission_type']). rows with a missing covariate are dropped.
+    returns a Matching whose .data is a Data over the matched rows with a match_id column
+    """
+    group = group or data.exposed[0]
+    exact = exact or []
+    df = pd.concat([group.data, data.reference.data])
+    treated = np.r_[np.ones(len(group.data), dtype=bool), np.zeros(len(data.reference.data), dtype=bool)]
+    complete = df[list(covariates) + list(exact)].notnull().all(axis=1).values
+    df, treated = df[complete], treated[complete]
+
+    propensity = fit_propensity(df, covariates, treated)
+    width = np.inf if caliper is None else caliper * propensity.logit.std()
+    matcher = __match_with_replacement if replace else __match_without_replacement
+
+    strata = df.groupby(exact, sort=False).ngroup().values if exact else np.zeros(len(df), dtype=int)
+    pairs = []
+    for stratum in np.unique(strata):
+        in_stratum = strata == stratum
+        treated_rows = np.flatnonzero(in_stratum & treated)
+        control_rows = np.flatnonzero(in_stratum & ~treated)
+        if not len(treated_rows) or not len(control_rows):
+            continue
+        for t, c, distance in matcher(propensity.logit[treated_rows], propensity.logit[control_rows], width, ratio):
+            pairs.append((treated_rows[t], control_rows[c], distance))
+
+    pairs = pd.DataFrame(pairs, columns=['treated_row', 'control_row', 'distance'])
+    pairs['match_id'] = pd.factorize(pairs['treated_row'])[0]
+    matched_treated = pairs.drop_duplicates('treated_row')
+    rows = np.r_[matched_treated['treated_row'].values, pairs['control_row'].values]
+    match_ids = np.r_[matched_treated['match_id'].values, pairs['match_id'].values]
+    df_matched = df.iloc[rows].assign(match_id=match_ids)
+    pairs['treated_index'] = df.index[pairs['treated_row'].values]
+    pairs['control_index'] = df.index[pairs['control_row'].values]
+
+    unmatched = int(treated.sum()) - len(matched_treated)
+    print("Matched %d of %d %s rows to %d controls (caliper %.4f on the logit)"
+          % (len(matched_treated), treated.sum(), group.name, len(pairs), width))
+    matched = analysis_helper.Data(df=df_matched, by=data.by, reference=data.reference_key)
+    return Matching(data=matched, pairs=pairs[['match_id', 'treated_index', 'control_index', 'distance']],
+                    propensity=propensity, caliper=width, unmatched=unmatched)
+
+
+def standardized_differences(data, covariates, group=None):
+    """standardized mean difference of each (one-hot) covariate between group and the reference group"""
+    group = group or data.exposed[0]
+    df = pd.concat([group.data, data.reference.data])
+    X = pd.get_dummies(df[covariates], dtype=float)
+    exposed, control = X.iloc[:len(group.data)], X.iloc[len(group.data):]
+    pooled_sd = np.sqrt((exposed.var() + control.var()) / 2.0).replace(0, np.nan)
+    return (exposed.mean() - control.mean()) / pooled_sd
+
+
+def balance(data, matching, covariates):
+    """standardized differences before and after matching, side by side"""
+    return pd.DataFrame({'before': standardized_differences(data, covariates),
+                         'after': standardized_differences(matching.data, covariates)})
+
+
+def bootstrap_matched_effect(data, covariates, col, stat=np.mean, n_resamples=200, alpha=0.05, seed=None,
+                             **match_kwargs):
+    """
+    percentile bootstrap of stat(exposed) - stat(reference) of col on the matched cohort. every resample
+    redraws both groups with replacement, refits the propensity model and rematches
+    """
+    rng = np.random.default_rng(seed)
+    # a resample is a new Data with new Group objects: match against the group of the same name in each
+    name = (match_kwargs.pop('group', None) or data.exposed[0]).name
+
+    def named_group(data):
+        return next(group for group in data.groups if group.name == name)
+
+    def effect(matched):
+        exposed, control = named_group(matched).data[col].dropna(), matched.reference.data[col].dropna()
+        return stat(exposed.values) - stat(control.values)
+
+    estimate = effect(match(data, covariates, group=named_group(data), **match_kwargs).data)
+    frames = [named_group(data).data, data.reference.data]
+    resamples = np.empty(n_resamples)
+    # Data and match report every split; 2 lines per resample would drown the notebook
+    with contextlib.redirect_stdout(io.StringIO()):
+        for i in range(n_resamples):
+            df = pd.concat([frame.iloc[rng.integers(0, len(frame), len(frame))] for frame in frames])
+            resampled = analysis_helper.Data(df=df.reset_index(drop=True), by=data.by, reference=data.reference_key)
+            resamples[i] = effect(match(resampled, covariates, group=named_group(resampled), **match_kwargs).data)
+    lower, upper = np.percentile(resamples, [100 * alpha / 2.0, 100 * (1 - alpha / 2.0)])
+    return resampling.Interval(estimate=estimate, ci_lower=lower, ci_upper=upper, n_resamples=n_resamples)
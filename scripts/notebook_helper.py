@@ -1,8 +1,27 @@
+import asyncio
+import contextlib
+import importlib.util
+import sys
+
 import pandas as pd
-import queries
 import numpy as np
 
 
+def __lazy_import(name):
+    """module whose code only runs on its first attribute access, so importing this helper stays cheap"""
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    spec.loader = importlib.util.LazyLoader(spec.loader)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+queries = __lazy_import('queries')
+
+
 def run_query(query, db_connection, check_events=True):
     """Run SQL query using postgres connection"""
     query_schema = 'SET search_path to mimiciii;'
@@ -13,6 +32,83 @@ def run_query(query, db_connection, check_events=True):
     return df
 
 
+async def create_query_pool(dsn=None, schema='mimiciii', min_size=1, max_size=4, **connect_kwargs):
+    """asyncpg connection pool for run_query_async, with search_path set on every connection"""
+    import asyncpg
+    return await asyncpg.create_pool(dsn, min_size=min_size, max_size=max_size,
+                                     server_settings={'search_path': schema}, **connect_kwargs)
+
+
+@contextlib.asynccontextmanager
+async def query_pool(dsn=None, schema='mimiciii', min_size=1, max_size=4, **connect_kwargs):
+    """create_query_pool for an async with block; the pool is closed however the block exits, errors included"""
+    pool = await create_query_pool(dsn, schema=schema, min_size=min_size, max_size=max_size, **connect_kwargs)
+    try:
+        yield pool
+    finally:
+        await pool.close()
+
+
+async def run_query_async(query, pool, check_events=True):
+    """async run_query on a create_query_pool() pool, same DataFrame and quality check"""
+    async with pool.acquire() as con:
+        statement = await con.prepare(query)
+        columns = [attribute.name for attribute in statement.get_attributes()]
+        records = await statement.fetch()
+    # coerce_float like pd.read_sql_query, so numeric columns don't stay Decimal
+    df = pd.DataFrame.from_records([tuple(record) for record in records], columns=columns, coerce_float=True)
+    if check_events:
+        check_distinct_events(df)
+    return df
+
+
+async def run_queries_async(named_queries, pool, check_events=True):
+    """
+    run {name: (query, check_events)} or {name: query} concurrently on the pool,
+    returns {name: DataFrame}. wall time is that of the slowest query, not the sum
+    """
+    names = list(named_queries)
+    runs = []
+    for name in names:
+        query = named_queries[name]
+        query, check = query if isinstance(query, tuple) else (query, check_events)
+        runs.append(run_query_async(query, pool, check_events=check))
+    return dict(zip(names, await asyncio.gather(*runs)))
+
+
+def get_cohort_attrition(con):
+    """
+    flow diagram table from the single queries.cohort_attrition() row: one row per step with the
+    stays remaining, the stays that step removed and the stays failing that criterion on its own
+    """
+    counts = run_query(query=queries.cohort_attrition(), db_connection=con, check_events=False).iloc[0]
+    rows = [('icu_stays', counts['icu_stays'], 0, 0),
+            ('with_diagnoses', counts['with_diagnoses'], counts['icu_stays'] - counts['with_diagnoses'], 0)]
+    for step, _ in queries.ATTRITION_STEPS:
+        rows.append((step, counts[step], rows[-1][1] - counts[step], counts[step + '_failed']))
+    return pd.DataFrame(rows, columns=['step', 'remaining', 'excluded', 'failed_criterion'])
+
+
+def run_statement(statement, db_connection):
+    """Run SQL that returns no rows (ddl, refresh) and commit it"""
+    query_schema = 'SET search_path to mimiciii;'
+    with db_connection.cursor() as cursor:
+        cursor.execute(query_schema + statement)
+    db_connection.commit()
+
+
+def provision_discharge_view(db_connection, refresh=False):
+    """
+    create the discharge report view queries.discharge_events() joins against if it isn't there yet, or
+    refresh it. the view is only analyzed after one of the two, so an existing view costs one catalog lookup
+    """
+    found = run_query(queries.discharge_view_exists(), db_connection, check_events=False)['found'].iloc[0]
+    if not found:
+        run_statement(queries.create_discharge_view(), db_connection)
+    elif refresh:
+        run_statement(queries.refresh_discharge_view(), db_connection)
+
+
 def get_sample(df, subid, hadmid):
     """Get subject/admission sample from dataframe"""
     sub_filter = df.subject_id == subid
@@ -78,15 +174,73 @@ def get_admit_df(df_sql, df_meds):
 
 
 def get_time_diff(df, col_out, col_in, name, days=False):
-    """get length of stay from timeseries column in pandas df"""
+    """get length of stay from timeseries column in pandas df. returns a new df, the input is left untouched"""
     # icu los
     diff_time = df[col_out] - df[col_in]
     diff_time_interval = diff_time / pd.Timedelta('1h')
     if days:
         hours_in_day = 24
         diff_time_interval = diff_time_interval / hours_in_day
-    df[name] = diff_time_interval
-    return df
+    return df.assign(**{name: diff_time_interval})
+
+
+def index_admissions(df_admissions):
+    """key the hospital_outcomes() extract on (subject_id, hadm_id) for derive_outcomes"""
+    return df_admissions.set_index(['subject_id', 'hadm_id'])
+
+
+def index_patients(df_patients):
+    """key the death_outcome() extract on subject_id for derive_outcomes"""
+    return df_patients.set_index('subject_id')
+
+
+def __as_datetime64(df, col):
+    return pd.to_datetime(df[col]).values
+
+
+def derive_outcomes(df_admits, df_admissions, df_patients):
+    """
+    join admits to the pre-indexed admissions/patients tables and derive every LOS/mortality outcome
+    in one vectorized pass over datetime64 arrays (NaT propagates as NaN/0 flags, same as the old steps)
+    """
+    df = df_admits.join(df_admissions, on=['subject_id', 'hadm_id'], how='inner')
+    df = df.join(df_patients, on='subject_id', how='inner')
+
+    hour = np.timedelta64(1, 'h')
+    hours_in_day = 24.0
+    icu_in, icu_out = __as_datetime64(df, 'intime'), __as_datetime64(df, 'outtime')
+    hos_in, hos_out = __as_datetime64(df, 'hospital_intime'), __as_datetime64(df, 'hospital_outtime')
+    dod = __as_datetime64(df, 'dod')
+
+    icu_los_hours = (icu_out - icu_in) / hour
+    hospital_los_hours = (hos_out - hos_in) / hour
+    death_days_since_hospital = (dod - hos_out) / hour / hours_in_day
+    outcomes = pd.DataFrame({
+        'icu_los_hours': icu_los_hours,
+        'hospital_los_hours': hospital_los_hours,
+        'death_days_since_hospital': death_days_since_hospital,
+        '30day_mortality': (death_days_since_hospital <= 30).astype(int),
+        '1year_mortality': (death_days_since_hospital <= 365).astype(int),
+        'icu_los_days': icu_los_hours / hours_in_day,
+        'hospital_los_days': hospital_los_hours / hours_in_day,
+        'icu_death': ((dod >= icu_in) & (dod <= icu_out)).astype(int),
+        'hos_death': ((dod >= hos_in) & (dod <= hos_out)).astype(int),
+    }, index=df.index)
+    return pd.concat([df, outcomes], axis=1)
+
+
+def get_outcomes(df_admits, con, shard=None):
+    """run the admissions/patients extracts once and derive all outcomes (replaces get_los_outcome + get_mortality_outcome)"""
+    df_admissions = run_query(query=queries.hospital_outcomes(shard), db_connection=con)
+    df_patients = run_query(query=queries.death_outcome(shard), db_connection=con, check_events=False)
+    return derive_outcomes(df_admits, index_admissions(df_admissions), index_patients(df_patients))
+
+
+async def get_outcomes_async(df_admits, pool, shard=None):
+    """get_outcomes with the admissions and patients extracts fetched concurrently"""
+    extracts = await run_queries_async({'admissions': queries.hospital_outcomes(shard),
+                                        'patients': (queries.death_outcome(shard), False)}, pool)
+    return derive_outcomes(df_admits, index_admissions(extracts['admissions']), index_patients(extracts['patients']))
 
 
 def get_mortality_outcome(df_hospital, con):
@@ -128,7 +282,8 @@ def get_reason_for_admit(df):
     return df
 
 
-def remove_skew_data(df):
+def remove_skew_data(df, expected_count=26657):
+    """drop repeat icu admits and in-hospital deaths. expected_count=None skips the count check (e.g. for one shard)"""
     def find_mortalities(df):
         print("finding mortalities...")
         icu_death_lower = (df.dod >= df.intime)
@@ -149,21 +304,25 @@ def remove_skew_data(df):
         return df[filter_method]
 
     def extract_los_days(df, hours):
+        # already there when the df comes from derive_outcomes
+        if 'hospital_los_days' in df:
+            return df
         print("adding days to primary outcomes...")
         df['icu_los_days'] = df['icu_los_hours'] / hours
         df['hospital_los_days'] = df['hospital_los_hours'] / hours
         return df
 
     def remove_mortalities(df):
-        df_mort = find_mortalities(df)
+        df_mort = df if 'hos_death' in df else find_mortalities(df)
         return df_mort[df_mort.hos_death == 0]
 
     hours_in_days = 24.0
-    expected_count = 26657
     df_no_multiple_admits = remove_multiple_admits(df=df)
     df_with_days = extract_los_days(df=df_no_multiple_admits, hours=hours_in_days)
     df_no_mort = remove_mortalities(df=df_with_days)
     cnt_df = len(df_no_mort)
+    if expected_count is None:
+        return df_no_mort
     assert cnt_df == expected_count, "clean count=%d is not same as expected count=%d" % (cnt_df, expected_count)
     return df_no_mort
 
@@ -0,0 +1,115 @@
+"""
+Local note corpus store, so drug list experiments don't have to re-run discharge_events() against
+Postgres every time.
+
+A store is two files:
+    <path>.notes      every note text, UTF-8 encoded and concatenated into one blob
+    <path>.index.npy  one record per note: row_id, subject_id, hadm_id, byte offset/length in the
+                      blob and a blake2b digest of the text (same key as finddrugs_refactor.noteDigest)
+
+Both are opened read-only with mmap, so any number of worker processes can open the same store and
+share its pages through the OS page cache instead of each receiving pickled strings. Texts are only
+decoded when a note's .text is read.
+"""
+import hashlib
+import mmap
+
+import numpy as np
+
+BLOB_SUFFIX = '.notes'
+INDEX_SUFFIX = '.index.npy'
+INDEX_DTYPE = np.dtype([('row_id', '<i8'), ('subject_id', '<i8'), ('hadm_id', '<i8'),
+                        ('offset', '<i8'), ('length', '<i8'), ('digest', 'S16')])
+
+
+def build(NOTES, path):
+    """write the row_id/subject_id/hadm_id/text columns of a notes dataframe to a store at path"""
+    index = np.zeros(len(NOTES), dtype=INDEX_DTYPE)
+    offset = 0
+    with open(path + BLOB_SUFFIX, 'wb') as f_out:
+        for i, note in enumerate(NOTES.itertuples()):
+            encoded = note.text.encode('utf-8')
+            f_out.write(encoded)
+            index[i] = (note.row_id, note.subject_id, note.hadm_id, offset, len(encoded),
+                        hashlib.blake2b(encoded, digest_size=16).digest())
+            offset += len(encoded)
+    np.save(path + INDEX_SUFFIX, index)
+    print("Stored {} notes ({} MB) in {}".format(len(index), round(offset / 1e6, 1), path + BLOB_SUFFIX))
+    return NoteStore(path)
+
+
+class StoredNote(object):
+    """one note of a store, shaped like a NOTES.itertuples() row. text is decoded on access"""
+    __slots__ = ('Index', 'row_id', 'subject_id', 'hadm_id', 'digest', '_store')
+
+    def __init__(self, store, position):
+        record = store.index[position]
+        self.Index = position
+        self.row_id = int(record['row_id'])
+        self.subject_id = int(record['subject_id'])
+        self.hadm_id = int(record['hadm_id'])
+        self.digest = record['digest'].tobytes()
+        self._store = store
+
+    @property
+    def text(self):
+        return self._store.text(self.Index)
+
+
+class NoteStore(object):
+    """
+    the notes of a store, or only its notes start:stop (a batch of a larger run). positions are
+    always relative to that window; window() opens another one on the same files
+    """
+    def __init__(self, path, start=0, stop=None):
+        self.path = path
+        self.index = np.load(path + INDEX_SUFFIX, mmap_mode='r')[start:stop]
+        self.start, self.stop = start, start + len(self.index)
+        self.__file = open(path + BLOB_SUFFIX, 'rb')
+        if self.index['length'].sum() > 0:
+            self.__blob = mmap.mmap(self.__file.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self.__blob = b''
+        self.__view = memoryview(self.__blob)
+
+    def __len__(self):
+        return len(self.index)
+
+    def raw(self, position):
+        """zero-copy view of one note's UTF-8 bytes"""
+        record = self.index[position]
+        start = int(record['offset'])
+        return self.__view[start:start + int(record['length'])]
+
+    def text(self, position):
+        return str(self.raw(position), 'utf-8')
+
+    def itertuples(self, start=0, stop=None):
+        """iterate notes in store order, like NOTES.itertuples() over the original dataframe"""
+        stop = len(self) if stop is None else stop
+        for position in range(start, stop):
+            yield StoredNote(self, position)
+
+    def distinct(self):
+        """positions of the first note of every distinct text, in store order"""
+        _, first = np.unique(self.index['digest'], return_index=True)
+        return np.sort(first)
+
+    def lookup(self, row_id=None, subject_id=None, hadm_id=None):
+        """positions of the notes matching every given key"""
+        mask = np.ones(len(self), dtype=bool)
+        for col, value in (('row_id', row_id), ('subject_id', subject_id), ('hadm_id', hadm_id)):
+            if value is not None:
+                mask &= self.index[col] == value
+        return np.flatnonzero(mask)
+
+    def window(self, start, stop=None):
+        """a NoteStore over positions start:stop of this one"""
+        stop = len(self) if stop is None else min(stop, len(self))
+        return NoteStore(self.path, self.start + start, self.start + stop)
+
+    def close(self):
+        self.__view.release()
+        if isinstance(self.__blob, mmap.mmap):
+            self.__blob.close()
+        self.__file.close()
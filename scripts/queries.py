@@ -1,6 +1,19 @@
 import icd9codes
 
 
+def shard_filter(column, shard=None, keyword='WHERE'):
+    """
+    sql clause keeping one hash partition of the cohort, e.g. shard=(0, 4) keeps mod(subject_id, 4) = 0.
+    empty string when shard is None, so unsharded queries are unchanged
+    """
+    if shard is None:
+        return ''
+    index, count = shard
+    if not 0 <= index < count:
+        raise ValueError("shard index must be in [0, %d), got %d" % (count, index))
+    return "%s mod(%s, %d) = %d" % (keyword, column, count, index)
+
+
 def unique_icu_admit():
     query = """
     WITH icu_admits AS (
@@ -199,7 +212,156 @@ def filter_exclusion_criteria():
     return query
 
 
-def discharge_events():
+# cohort criteria in flow diagram order: (step name, condition a stay must meet to stay in)
+ATTRITION_STEPS = [('age_over_18', 'valid_age = 1'),
+                   ('no_death_within_24h', 'valid_death = 1'),
+                   ('no_icu_readmit_within_180d', 'valid_icu_admit = 1'),
+                   ('no_anoxic_brain_injury', 'has_anoxic_brain = 0'),
+                   ('no_cancer', 'has_cancer = 0'),
+                   ('no_opiate_abuse', 'opiate_abuse = 0')]
+
+
+def cohort_attrition():
+    """
+    one row of counts over the filter_exclusion_criteria flags: icu stays, stays with diagnoses,
+    stays left after each ATTRITION_STEPS criterion (cumulative, <step>) and stays failing each
+    criterion on its own (<step>_failed). no intermediate cohort leaves the database
+    """
+    query = """
+    WITH icu_admits AS (
+        SELECT icu.row_id 
+            , icu.subject_id
+            ,icu.hadm_id
+            ,intime AS icu_intime
+            ,outtime AS icu_outtime
+            ,ROUND((CAST(icu.intime as DATE) - cast(pat.dob as DATE))/365.242, 2) AS age
+            ,EXTRACT(epoch FROM(dod - intime))/3600.00 AS diff_death_admit_hrs        
+            ,EXTRACT(days FROM (intime - LAG (outtime) OVER (PARTITION BY icu.subject_id ORDER BY outtime ASC))) AS diff_last_outtime
+        FROM icustays icu
+        INNER JOIN patients pat
+        ON icu.subject_id = pat.subject_id
+        GROUP BY 1,2,3,4,5,6,7
+    ), icd_codes AS (
+        SELECT icu.*
+            , array_agg(icd.icd9_code ORDER BY icd.seq_num) AS icd9_codes
+        FROM icu_admits icu
+        INNER JOIN diagnoses_icd as icd
+        ON icu.subject_id = icd.subject_id AND icu.hadm_id = icd.hadm_id
+        INNER JOIN d_icd_diagnoses as d_names
+        ON icd.icd9_code = d_names.icd9_code
+        GROUP BY 1,2,3,4,5,6,7,8
+    ), flags AS (
+        SELECT icd_codes.*
+            , CASE
+                -- inclusion: unique earliest icu admit, with 180 day offset if multiple records
+                WHEN (diff_last_outtime is null OR diff_last_outtime > 180)
+                THEN 1
+                ELSE 0
+                END AS valid_icu_admit        
+            , CASE
+                -- inclusion: age > 18
+                WHEN age > 18
+                THEN 1
+                ELSE 0
+                END AS valid_age
+            , CASE
+                -- inclusion: death time > 24 hrs of admit
+                WHEN (diff_death_admit_hrs > 24 OR diff_death_admit_hrs is null)
+                THEN 1
+                ELSE 0
+                END AS valid_death  
+            , CASE
+                -- build icd9 poisoning or opiate abuse or heroin use
+                WHEN icd9_codes && {opiate_abuse}::varchar[]
+                THEN 1
+                ELSE 0
+                END AS opiate_abuse
+            , CASE
+                -- anoxic brain injury
+                WHEN icd9_codes && {anoxic_brain}::varchar[]
+                THEN 1
+                ELSE 0
+                END AS has_anoxic_brain
+            , CASE
+                WHEN icd9_codes && {cancer}::varchar[]
+                THEN 1
+                ELSE 0
+                END AS has_cancer    
+        FROM icd_codes
+    )
+    SELECT (SELECT COUNT(*) FROM icu_admits) AS icu_stays
+        , COUNT(*) AS with_diagnoses
+        {counts}
+    FROM flags
+    """
+    counts = []
+    for i, (step, _) in enumerate(ATTRITION_STEPS):
+        cumulative = ' AND '.join(cond for _, cond in ATTRITION_STEPS[:i + 1])
+        counts.append(', COUNT(*) FILTER (WHERE %s) AS %s' % (cumulative, step))
+    for step, condition in ATTRITION_STEPS:
+        counts.append(', COUNT(*) FILTER (WHERE NOT (%s)) AS %s_failed' % (condition, step))
+    query = query.format(cancer=icd9codes.cancer,
+                         opiate_abuse=icd9codes.opiate_abuse,
+                         anoxic_brain=icd9codes.anoxic_brain,
+                         counts='\n        '.join(counts))
+    return query
+
+
+# discharge reports out of noteevents, materialized once so discharge_events joins on an index
+DISCHARGE_VIEW = 'discharge_reports'
+DISCHARGE_NOTE_FILTER = "lower(category) like 'discharge summary' AND lower(description) like 'report'"
+
+
+def discharge_view_exists():
+    """one row with found = 1 when DISCHARGE_VIEW is already in the schema"""
+    query = """
+    SELECT COUNT(*) AS found
+    FROM pg_matviews
+    WHERE schemaname = current_schema()
+        AND matviewname = '{view}'
+    """
+    query = query.format(view=DISCHARGE_VIEW)
+    return query
+
+
+def create_discharge_view():
+    """
+    ddl for the DISCHARGE_VIEW materialized view and its (subject_id, hadm_id) index. safe to re-run, but it
+    analyzes the view every time: notebook_helper.provision_discharge_view only runs it when the view is missing
+    """
+    query = """
+    CREATE MATERIALIZED VIEW IF NOT EXISTS {view} AS
+    SELECT row_id
+        , subject_id
+        , hadm_id
+        , chartdate
+        , category
+        , description
+        , text
+    FROM noteevents
+    WHERE {note_filter};
+    CREATE INDEX IF NOT EXISTS {view}_subject_hadm_idx ON {view} (subject_id, hadm_id);
+    ANALYZE {view};
+    """
+    query = query.format(view=DISCHARGE_VIEW, note_filter=DISCHARGE_NOTE_FILTER)
+    return query
+
+
+def refresh_discharge_view():
+    """re-read noteevents into DISCHARGE_VIEW, e.g. after loading a new MIMIC release"""
+    query = """
+    REFRESH MATERIALIZED VIEW {view};
+    ANALYZE {view};
+    """
+    query = query.format(view=DISCHARGE_VIEW)
+    return query
+
+
+def discharge_events(shard=None, notes=DISCHARGE_VIEW):
+    """
+    cohort discharge summaries. notes is DISCHARGE_VIEW (see create_discharge_view) or
+    'noteevents' to filter the raw table with a sequential scan as before
+    """
     query = """
     WITH icu_admits AS (
         SELECT icu.row_id 
@@ -213,6 +375,7 @@ def discharge_events():
         FROM icustays icu
         INNER JOIN patients pat
         ON icu.subject_id = pat.subject_id
+        {shard_filter}
         GROUP BY 1,2,3,4,5,6,7
         ORDER BY 1 ASC
     ), icd_codes AS (
@@ -270,10 +433,10 @@ def discharge_events():
         , category
         , description
         , text
-        FROM noteevents events
+        FROM {notes} events
         INNER JOIN flags
         ON flags.subject_id = events.subject_id AND flags.hadm_id = events.hadm_id
-        WHERE lower(category) like 'discharge summary' AND lower(description) like 'report'
+        {notes_filter}
     )
     SELECT *
     FROM discharges
@@ -288,11 +451,14 @@ def discharge_events():
     """
     query = query.format(cancer=icd9codes.cancer,
                          opiate_abuse=icd9codes.opiate_abuse,
-                         anoxic_brain=icd9codes.anoxic_brain)
+                         anoxic_brain=icd9codes.anoxic_brain,
+                         shard_filter=shard_filter('icu.subject_id', shard),
+                         notes=notes,
+                         notes_filter='' if notes == DISCHARGE_VIEW else 'WHERE ' + DISCHARGE_NOTE_FILTER)
     return query
 
 
-def hospital_outcomes():
+def hospital_outcomes(shard=None):
     query = """
     SELECT subject_id
         , hadm_id 
@@ -304,11 +470,13 @@ def hospital_outcomes():
         , discharge_location
         , diagnosis
     FROM admissions
+    {shard_filter}
     """
+    query = query.format(shard_filter=shard_filter('subject_id', shard))
     return query
 
 
-def death_outcome():
+def death_outcome(shard=None):
     query = """
     SELECT subject_id
         , gender    
@@ -316,7 +484,9 @@ def death_outcome():
         , dod_hosp
         , dod_ssn
     FROM patients
+    {shard_filter}
     """
+    query = query.format(shard_filter=shard_filter('subject_id', shard))
     return query
 
 
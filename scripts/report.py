@@ -0,0 +1,128 @@
+"""
+Headless EDA report for a list of outcome columns.
+
+Renders the analysis_plots figures straight onto Agg canvases (no pyplot, no plt.show), so it
+runs unattended from a script or batch job. Each worker process keeps one figure per plot
+kind and clears it between columns instead of creating a new figure per plot. The PNGs are
+written by the workers in parallel; the outcome statistics table from compare_outcomes and
+all plots are then bundled into a single self-contained html file.
+"""
+import base64
+import multiprocessing
+import os
+
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+import analysis_helper
+import analysis_plots
+import analysis_stats
+
+# (plot kind, one axes per group?, draw function)
+BINARY_PLOTS = [('pie', True, analysis_plots.draw_pie_chart)]
+CONTINUOUS_PLOTS = [('hist', True, analysis_plots.draw_hist),
+                    ('percents', False, analysis_plots.draw_percents),
+                    ('qq', True, analysis_plots.draw_qq)]
+
+HTML_TEMPLATE = """<html>
+<head><title>{title}</title></head>
+<body>
+<h1>{title}</h1>
+<h2>Outcome statistics</h2>
+{table}
+{sections}
+</body>
+</html>
+"""
+
+# per-process state, set once by __init_worker
+_data = None
+_out_dir = None
+_figures = {}
+
+
+def __init_worker(data, out_dir):
+    global _data, _out_dir
+    _data = data
+    _out_dir = out_dir
+    _figures.clear()
+
+
+def __get_axes(kind, per_group):
+    """reuse one figure per plot kind, cleared between columns"""
+    if kind not in _figures:
+        fig = Figure()
+        FigureCanvasAgg(fig)
+        _figures[kind] = fig
+    fig = _figures[kind]
+    fig.clf()
+    if not per_group:
+        fig.set_size_inches(6, 6)
+        return fig, fig.subplots(nrows=1, ncols=1)
+    fig.set_size_inches(6.5 * len(_data.groups), 5)
+    return fig, fig.subplots(nrows=1, ncols=len(_data.groups), squeeze=False)[0]
+
+
+def _render_column(task):
+    """draw and save every plot for one outcome column, return the written png paths"""
+    col, plots = task
+    paths = []
+    for kind, per_group, draw in plots:
+        fig, axes = __get_axes(kind, per_group)
+        draw(_data, col, axes)
+        path = os.path.join(_out_dir, '%s_%s.png' % (col, kind))
+        fig.savefig(path, format='png')
+        paths.append(path)
+    return col, paths
+
+
+def __trim_data(data, cols):
+    """only ship the outcome columns to the worker processes"""
+    by = data.by if isinstance(data.by, list) else [data.by]
+    keep = cols + [key for key in by if isinstance(key, str) and key not in cols]
+    return analysis_helper.Data(df=data.raw_df[keep], by=data.by, reference=data.reference_key)
+
+
+def __embed_png(path):
+    with open(path, 'rb') as f:
+        encoded = base64.b64encode(f.read()).decode('ascii')
+    return '<img src="data:image/png;base64,%s" alt="%s"/>' % (encoded, os.path.basename(path))
+
+
+def build_report(data, cols, out_dir, title='Phase one EDA', n_jobs=1, test='greater', alpha=0.05):
+    """
+    render all plots for cols into out_dir and write out_dir/report.html with the stats table.
+    binary cols get pie charts, all other cols get histograms, percentiles and q-q plots.
+    returns the compare_outcomes table
+    """
+    if not os.path.isdir(out_dir):
+        os.makedirs(out_dir)
+
+    df_stats = analysis_stats.compare_outcomes(data, cols, test=test, alpha=alpha)
+    is_binary = dict(zip(df_stats.outcome, df_stats.test == 'chisquare'))
+    tasks = [(col, BINARY_PLOTS if is_binary[col] else CONTINUOUS_PLOTS) for col in cols]
+
+    if n_jobs == 1:
+        # draw from data itself so its memoized summaries are reused
+        __init_worker(data, out_dir)
+        rendered = [_render_column(task) for task in tasks]
+    else:
+        pool = multiprocessing.Pool(processes=n_jobs, initializer=__init_worker,
+                                    initargs=(__trim_data(data, cols), out_dir))
+        try:
+            rendered = pool.map(_render_column, tasks)
+        finally:
+            pool.close()
+            pool.join()
+
+    sections = []
+    for col, paths in rendered:
+        images = '\n'.join(__embed_png(path) for path in paths)
+        sections.append('<h2>%s</h2>\n%s' % (col, images))
+
+    df_stats.to_csv(os.path.join(out_dir, 'stats.csv'), index=False)
+    html = HTML_TEMPLATE.format(title=title, table=df_stats.to_html(index=False), sections='\n'.join(sections))
+    with open(os.path.join(out_dir, 'report.html'), 'w') as f:
+        f.write(html)
+    print("Report for %d outcomes written to %s" % (len(cols), os.path.join(out_dir, 'report.html')))
+    return df_stats
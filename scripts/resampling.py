@@ -0,0 +1,181 @@
+"""
+Bootstrap and permutation intervals for opiate vs non-opiate comparisons (or any exposed
+group of analysis_helper.Data against its reference group).
+
+Continuous outcomes (LOS) are resampled through NumPy index matrices, one chunk of
+resamples at a time, so memory is bounded by chunk_size * n_patients instead of
+n_resamples * n_patients. Chunks are seeded from one SeedSequence, so results are the
+same whatever the number of worker processes.
+
+Binary outcomes (mortality) only need the count of positives per resample, which is drawn
+directly (binomial for the bootstrap, hypergeometric for permutations) instead of
+materializing index matrices.
+"""
+import multiprocessing
+from collections import namedtuple
+
+import numpy as np
+
+Interval = namedtuple('interval', ['estimate', 'ci_lower', 'ci_upper', 'n_resamples'])
+PermutationTest = namedtuple('permutation_test', ['estimate', 'pval', 'n_resamples'])
+
+# per-process arrays used by the chunk workers, set once by __init_worker
+_exposed = None
+_control = None
+
+
+def __init_worker(exposed, control):
+    global _exposed, _control
+    _exposed = exposed
+    _control = control
+
+
+def __chunk_sizes(n_resamples, chunk_size):
+    sizes = [chunk_size] * (n_resamples // chunk_size)
+    if n_resamples % chunk_size:
+        sizes.append(n_resamples % chunk_size)
+    return sizes
+
+
+def _bootstrap_median_chunk(args):
+    """median difference for one chunk of bootstrap resamples, drawn within each group"""
+    seed, rows = args
+    rng = np.random.default_rng(seed)
+    idx = rng.integers(0, len(_exposed), size=(rows, len(_exposed)), dtype=np.int32)
+    exposed_medians = np.median(_exposed[idx], axis=1)
+    idx = rng.integers(0, len(_control), size=(rows, len(_control)), dtype=np.int32)
+    control_medians = np.median(_control[idx], axis=1)
+    return exposed_medians - control_medians
+
+
+def __order_stat_median(order_stat, size):
+    """median of a sorted sample of the given size, from a function returning its k-th order statistic"""
+    return (order_stat((size - 1) // 2) + order_stat(size // 2)) / 2.0
+
+
+def _permutation_median_chunk(args):
+    """
+    median difference for one chunk of group-label permutations. only the exposed (smaller) group's
+    positions in the sorted pooled sample are drawn; the control medians are read off the complement
+    of those positions, so each permutation costs O(n_exposed) rather than a full shuffle of all patients
+    """
+    seed, rows = args
+    rng = np.random.default_rng(seed)
+    pooled = np.sort(np.concatenate([_exposed, _control]))
+    n_exposed, n_control = len(_exposed), len(_control)
+
+    positions = np.empty((rows, n_exposed), dtype=np.int32)
+    for row in range(rows):
+        positions[row] = rng.choice(len(pooled), n_exposed, replace=False)
+    positions.sort(axis=1)
+    # k-th complement position is k + #{j : positions[j] - j <= k}
+    shifted = positions - np.arange(n_exposed, dtype=np.int32)
+
+    def exposed_order_stat(k):
+        return pooled[positions[:, k]]
+
+    def control_order_stat(k):
+        return pooled[k + (shifted <= k).sum(axis=1)]
+
+    return __order_stat_median(exposed_order_stat, n_exposed) - __order_stat_median(control_order_stat, n_control)
+
+
+def __run_chunks(worker, exposed, control, n_resamples, chunk_size, n_jobs, seed):
+    seeds = np.random.SeedSequence(seed).spawn(len(__chunk_sizes(n_resamples, chunk_size)))
+    tasks = list(zip(seeds, __chunk_sizes(n_resamples, chunk_size)))
+    if n_jobs == 1:
+        __init_worker(exposed, control)
+        results = [worker(task) for task in tasks]
+    else:
+        pool = multiprocessing.Pool(processes=n_jobs, initializer=__init_worker, initargs=(exposed, control))
+        try:
+            results = pool.map(worker, tasks)
+        finally:
+            pool.close()
+            pool.join()
+    return np.concatenate(results)
+
+
+def __group_values(data, col, group, dtype=float):
+    """values of col in group (default: the only exposed group, i.e. opiate) and in the reference group"""
+    group = group or data.exposed[0]
+    exposed = group.data[col].dropna().values.astype(dtype)
+    control = data.reference.data[col].dropna().values.astype(dtype)
+    return exposed, control
+
+
+def __percentile_interval(estimate, resamples, alpha):
+    lower, upper = np.percentile(resamples, [100 * alpha / 2.0, 100 * (1 - alpha / 2.0)])
+    return Interval(estimate=estimate, ci_lower=lower, ci_upper=upper, n_resamples=len(resamples))
+
+
+def __permutation_pval(estimate, resamples, alternative):
+    if alternative == 'greater':
+        extreme = resamples >= estimate
+    elif alternative == 'less':
+        extreme = resamples <= estimate
+    elif alternative == 'two-sided':
+        extreme = np.abs(resamples) >= np.abs(estimate)
+    else:
+        raise ValueError("alternative must be 'two-sided', 'greater' or 'less', got %r" % alternative)
+    # add-one estimator keeps the p-value valid (never 0) for a finite number of permutations
+    return (1.0 + extreme.sum()) / (1.0 + len(resamples))
+
+
+def __log_odds_ratio(exposed_true, n_exposed, control_true, n_control):
+    """log odds ratio over arrays of counts, haldane +0.5 correction where a cell is empty"""
+    cells = np.array([exposed_true, n_exposed - exposed_true, control_true, n_control - control_true], dtype=float)
+    cells = cells + np.where((cells == 0).any(axis=0), 0.5, 0.0)
+    et, ef, ct, cf = cells
+    return np.log(et) - np.log(ef) - np.log(ct) + np.log(cf)
+
+
+def bootstrap_median_diff(data, col, n_resamples=10000, alpha=0.05, chunk_size=64, n_jobs=1, seed=None, group=None):
+    """percentile bootstrap CI for median(group) - median(reference group) of col, e.g. icu_los_days"""
+    exposed, control = __group_values(data, col, group)
+    estimate = np.median(exposed) - np.median(control)
+    resamples = __run_chunks(_bootstrap_median_chunk, exposed, control, n_resamples, chunk_size, n_jobs, seed)
+    return __percentile_interval(estimate, resamples, alpha)
+
+
+def permutation_median_diff(data, col, n_resamples=10000, alternative='two-sided', chunk_size=64, n_jobs=1,
+                            seed=None, group=None):
+    """permutation test of median(group) - median(reference group) of col"""
+    exposed, control = __group_values(data, col, group)
+    estimate = np.median(exposed) - np.median(control)
+    resamples = __run_chunks(_permutation_median_chunk, exposed, control, n_resamples, chunk_size, n_jobs, seed)
+    pval = __permutation_pval(estimate, resamples, alternative)
+    return PermutationTest(estimate=estimate, pval=pval, n_resamples=n_resamples)
+
+
+def bootstrap_odds_ratio(data, col, n_resamples=10000, alpha=0.05, seed=None, group=None):
+    """percentile bootstrap CI for the odds ratio of a binary outcome col, e.g. 30day_mortality"""
+    exposed, control = __group_values(data, col, group, dtype=np.int8)
+    n_exposed, n_control = len(exposed), len(control)
+    exposed_true, control_true = exposed.sum(), control.sum()
+
+    rng = np.random.default_rng(seed)
+    boot_exposed_true = rng.binomial(n_exposed, exposed_true / float(n_exposed), size=n_resamples)
+    boot_control_true = rng.binomial(n_control, control_true / float(n_control), size=n_resamples)
+
+    estimate = np.exp(__log_odds_ratio(exposed_true, n_exposed, control_true, n_control))
+    resamples = np.exp(__log_odds_ratio(boot_exposed_true, n_exposed, boot_control_true, n_control))
+    return __percentile_interval(estimate, resamples, alpha)
+
+
+def permutation_odds_ratio(data, col, n_resamples=10000, alternative='two-sided', seed=None, group=None):
+    """permutation test of the odds ratio of a binary outcome col, compared on the log scale"""
+    exposed, control = __group_values(data, col, group, dtype=np.int8)
+    n_exposed, n_control = len(exposed), len(control)
+    exposed_true, control_true = exposed.sum(), control.sum()
+    total_true = exposed_true + control_true
+
+    rng = np.random.default_rng(seed)
+    perm_exposed_true = rng.hypergeometric(total_true, n_exposed + n_control - total_true, n_exposed,
+                                           size=n_resamples)
+    perm_control_true = total_true - perm_exposed_true
+
+    log_estimate = __log_odds_ratio(exposed_true, n_exposed, control_true, n_control)
+    resamples = __log_odds_ratio(perm_exposed_true, n_exposed, perm_control_true, n_control)
+    pval = __permutation_pval(log_estimate, resamples, alternative)
+    return PermutationTest(estimate=np.exp(log_estimate), pval=pval, n_resamples=n_resamples)
@@ -0,0 +1,201 @@
+"""
+Accuracy and speed regression check of the drug scanners against reference outputs.
+
+The two reference summaries in data/ cover the same 36,888 notes with different schemas:
+    output.csv    finddrugs.py: UPPER CASE header with gen_opiates_found and a MISC column that
+                  the rows don't have when the MISC list is empty (21 names, 20 fields)
+    test_jan.csv  finddrugs_refactor.py: lower case header, no gen_opiates_found/MISC
+read_output() normalizes both: lower case names and the phantom MISC dropped. Some row_ids
+appear more than once (1,560 repeats in both files, with different flags), so rows are keyed
+by (row_id, occurrence): the n-th row of a row_id matches the n-th row on the other side.
+compare() then reports, per shared column, how many notes disagree and a sample of their
+row_ids, plus the rows and columns only one side has.
+
+regress() runs every engine on the same notes, times it, and compares its summary with a
+reference, so a faster engine is checked before its cohort is trusted:
+
+    python scanner_regression.py                                # data/output.csv vs data/test_jan.csv
+    python scanner_regression.py --notes notes.parquet -e substring token parallel
+"""
+import argparse
+import os
+import time
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+import finddrugs_refactor
+import notestore
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data')
+REFERENCES = {'finddrugs': os.path.join(DATA_DIR, 'output.csv'),
+              'finddrugs_refactor': os.path.join(DATA_DIR, 'test_jan.csv')}
+DRUGLIST_FILE = os.path.join(DATA_DIR, 'opiates.txt')
+KEY = 'row_id'
+OCCURRENCE = 'occurrence'
+PHANTOM_COLUMN = 'misc'
+
+Comparison = namedtuple('Comparison', ['rows', 'only_reference', 'only_candidate', 'columns_only_reference',
+                                       'columns_only_candidate', 'disagreements'])
+
+
+def read_output(path):
+    """scanner summary (.csv or .parquet) with normalized column names, indexed by (row_id, occurrence)"""
+    if path.endswith('.parquet'):
+        df = pd.read_parquet(path)
+        df.columns = [col.lower() for col in df.columns]
+    else:
+        with open(path) as f_in:
+            names = [name.strip('"').lower() for name in f_in.readline().strip().split(',')]
+            first = f_in.readline().strip()
+        fields = len(first.split(',')) if first else len(names)
+        if fields == len(names) - 1 and PHANTOM_COLUMN in names:
+            names.remove(PHANTOM_COLUMN)
+        if fields != len(names):
+            raise ValueError("%s: header has %d names but rows have %d fields" % (path, len(names), fields))
+        df = pd.read_csv(path, header=None, skiprows=1, names=names)
+    df[OCCURRENCE] = df.groupby(KEY).cumcount()
+    return df.set_index([KEY, OCCURRENCE])
+
+
+def compare(reference, candidate, sample=5):
+    """Comparison of two read_output() frames, aligned on (row_id, occurrence)"""
+    rows = reference.index.intersection(candidate.index)
+    columns = [col for col in reference.columns if col in candidate.columns]
+    left = reference.loc[rows, columns]
+    right = candidate.loc[rows, columns]
+    differs = (left.values != right.values) & ~(pd.isnull(left.values) & pd.isnull(right.values))
+
+    counts = differs.sum(axis=0)
+    disagreements = pd.DataFrame({
+        'column': columns,
+        'disagreements': counts,
+        'rate': counts / float(max(len(rows), 1)),
+        'sample_row_ids': [list(rows.get_level_values(KEY)[np.flatnonzero(differs[:, i])[:sample]])
+                           for i in range(len(columns))],
+    })
+    return Comparison(rows=len(rows),
+                      only_reference=len(reference.index.difference(candidate.index)),
+                      only_candidate=len(candidate.index.difference(reference.index)),
+                      columns_only_reference=[col for col in reference.columns if col not in candidate.columns],
+                      columns_only_candidate=[col for col in candidate.columns if col not in reference.columns],
+                      disagreements=disagreements)
+
+
+def print_comparison(name, comparison):
+    print("\n=== %s: %d shared notes, %d only in reference, %d only in candidate"
+          % (name, comparison.rows, comparison.only_reference, comparison.only_candidate))
+    if comparison.columns_only_reference:
+        print("columns only in reference: %s" % ', '.join(comparison.columns_only_reference))
+    if comparison.columns_only_candidate:
+        print("columns only in candidate: %s" % ', '.join(comparison.columns_only_candidate))
+    disagreeing = comparison.disagreements[comparison.disagreements.disagreements > 0]
+    if disagreeing.empty:
+        print("every shared column agrees")
+    else:
+        print(disagreeing.to_string(index=False))
+
+
+def __notes_frame(NOTES):
+    """finddrugs.py only reads dataframes"""
+    if not isinstance(NOTES, notestore.NoteStore):
+        return NOTES
+    return pd.DataFrame([(note.row_id, note.subject_id, note.hadm_id, note.text) for note in NOTES.itertuples()],
+                        columns=finddrugs_refactor.NOTE_COLUMNS)
+
+
+def __run_finddrugs(NOTES, druglist_file, path, n_jobs):
+    # imported here: finddrugs needs nltk, which the other engines don't
+    import finddrugs
+    misc_file = os.path.join(os.path.dirname(druglist_file), 'MISC_list.txt')
+    finddrugs.search(__notes_frame(NOTES), SSRI_FILE=druglist_file, MISC_FILE=misc_file, SUMMARY_FILE=path)
+
+
+def __run_refactor(match_mode, parallel=False):
+    def run(NOTES, druglist_file, path, n_jobs):
+        finddrugs_refactor.search(NOTES, druglist_file, SUMMARY_FILE=path, MATCH_MODE=match_mode,
+                                  N_JOBS=n_jobs if parallel else 1)
+    return run
+
+
+# engine name -> (runner(NOTES, druglist_file, summary path, n_jobs), needs a note store)
+ENGINES = {
+    'finddrugs': (__run_finddrugs, False),
+    'substring': (__run_refactor('substring'), False),
+    'token': (__run_refactor('token'), False),
+    'parallel': (__run_refactor('substring', parallel=True), True),
+}
+
+
+def regress(notes_path, reference, engines=None, druglist_file=DRUGLIST_FILE, out_dir='.', n_jobs=4, sample=5):
+    """
+    run every engine on the notes at notes_path (see finddrugs_refactor.readNotes), time it, and compare its
+    summary with the reference output. returns one row per engine plus the Comparison of each
+    """
+    engines = engines or list(ENGINES)
+    expected = read_output(reference)
+    NOTES = finddrugs_refactor.readNotes(notes_path)
+    store = NOTES if isinstance(NOTES, notestore.NoteStore) else None
+
+    rows, comparisons = [], {}
+    for name in engines:
+        runner, needs_store = ENGINES[name]
+        if needs_store and store is None:
+            # not timed: the store is built once per corpus, not per scan
+            store = notestore.build(NOTES, os.path.join(out_dir, 'regression_notes'))
+        path = os.path.join(out_dir, 'regression_%s.csv' % name)
+        if os.path.exists(path):
+            os.remove(path)
+        start = time.perf_counter()
+        try:
+            runner(store if needs_store else NOTES, druglist_file, path, n_jobs)
+        except ImportError as e:
+            print("skipping engine %s: %s" % (name, e))
+            continue
+        seconds = time.perf_counter() - start
+
+        comparison = compare(expected, read_output(path), sample=sample)
+        comparisons[name] = comparison
+        cells = int(comparison.disagreements.disagreements.sum())
+        rows.append({'engine': name, 'seconds': seconds, 'notes_per_sec': len(NOTES) / seconds,
+                     'notes': comparison.rows, 'missing_notes': comparison.only_reference,
+                     'extra_notes': comparison.only_candidate,
+                     'columns_disagreeing': int((comparison.disagreements.disagreements > 0).sum()),
+                     'cells_disagreeing': cells,
+                     'matches_reference': cells == 0 and comparison.only_reference == 0
+                                          and comparison.only_candidate == 0})
+    return pd.DataFrame(rows), comparisons
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--reference', default=REFERENCES['finddrugs_refactor'], help="reference summary file")
+    parser.add_argument('--candidate', default=REFERENCES['finddrugs'],
+                        help="summary file to compare with the reference (without --notes)")
+    parser.add_argument('--notes', default=None, help="run the engines on these notes instead (csv, parquet or store)")
+    parser.add_argument('-e', '--engines', nargs='+', choices=sorted(ENGINES), default=None)
+    parser.add_argument('-d', '--druglist', default=DRUGLIST_FILE)
+    parser.add_argument('-j', '--jobs', type=int, default=4, help="worker processes of the parallel engine")
+    parser.add_argument('--out-dir', default='.')
+    parser.add_argument('--sample', type=int, default=5, help="row_ids listed per disagreeing column")
+    args = parser.parse_args(argv)
+
+    if args.notes is None:
+        start = time.perf_counter()
+        comparison = compare(read_output(args.reference), read_output(args.candidate), sample=args.sample)
+        print_comparison('%s vs %s' % (args.candidate, args.reference), comparison)
+        print("\ncompared in %.2f seconds" % (time.perf_counter() - start))
+        return comparison
+
+    summary, comparisons = regress(args.notes, args.reference, args.engines, args.druglist, args.out_dir,
+                                   args.jobs, args.sample)
+    for name, comparison in comparisons.items():
+        print_comparison(name, comparison)
+    print()
+    print(summary.to_string(index=False))
+    return summary
+
+
+if __name__ == '__main__':
+    main()
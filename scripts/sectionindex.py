@@ -0,0 +1,92 @@
+"""
+Per-note section index written next to a scanner run, so audit tools can jump straight to
+the admission/discharge/history sections and drug mentions of a note instead of
+re-fetching and re-reading it.
+
+The sidecar is one .npz of flat columns. Notes sharing a text share one block of spans:
+    row_id, subject_id, hadm_id    int64, one per note
+    block                          int32, the note's block of spans
+    section_ptr                    int32, sections of block b are section_ptr[b]:section_ptr[b + 1]
+    section_kind                   int8, code into SECTION_KINDS
+    section_start, section_end     int32, UTF-8 byte offsets in the note text
+    match_ptr                      int32, drug mentions of block b are match_ptr[b]:match_ptr[b + 1]
+    match_drug                     int16, index into generics
+    match_start, match_end         int32, UTF-8 byte offsets in the note text
+    generics                       drug names, in summary file column order
+Byte offsets line up with notestore.NoteStore.raw(), so a span is a zero-copy slice of the store.
+"""
+from collections import namedtuple
+
+import numpy as np
+
+SECTION_KINDS = ('other', 'hist', 'admit', 'discharge')
+
+Section = namedtuple('Section', ['kind', 'start', 'end'])
+Match = namedtuple('Match', ['generic', 'start', 'end'])
+
+
+def __csr(blocks, dtypes):
+    ptr = np.zeros(len(blocks) + 1, dtype=np.int32)
+    ptr[1:] = np.cumsum([len(spans) for spans in blocks])
+    flat = [span for spans in blocks for span in spans]
+    columns = [np.array([span[i] for span in flat], dtype=dtype) for i, dtype in enumerate(dtypes)]
+    return ptr, columns
+
+
+def write(path, row_ids, subject_ids, hadm_ids, blocks, generics, sections, matches):
+    """
+    save a sidecar. blocks holds each note's block number; sections and matches hold, per block,
+    the (kind code, start, end) and (drug index, start, end) spans recorded by parseNote
+    """
+    section_ptr, (section_kind, section_start, section_end) = __csr(sections, (np.int8, np.int32, np.int32))
+    match_ptr, (match_drug, match_start, match_end) = __csr(matches, (np.int16, np.int32, np.int32))
+    np.savez(path, row_id=np.asarray(row_ids, dtype=np.int64),
+             subject_id=np.asarray(subject_ids, dtype=np.int64),
+             hadm_id=np.asarray(hadm_ids, dtype=np.int64),
+             block=np.asarray(blocks, dtype=np.int32),
+             section_ptr=section_ptr, section_kind=section_kind,
+             section_start=section_start, section_end=section_end,
+             match_ptr=match_ptr, match_drug=match_drug,
+             match_start=match_start, match_end=match_end,
+             generics=np.array(generics))
+
+
+class SectionIndex(object):
+    def __init__(self, path):
+        with np.load(path) as npz:
+            self.columns = dict((name, npz[name]) for name in npz.files)
+        self.generics = [str(generic) for generic in self.columns['generics']]
+        self.row_ids = self.columns['row_id']
+
+    def __len__(self):
+        return len(self.row_ids)
+
+    def __block(self, row_id):
+        positions = np.flatnonzero(self.row_ids == row_id)
+        if not len(positions):
+            raise KeyError("row_id %d is not in the section index" % row_id)
+        return self.columns['block'][positions[0]]
+
+    def sections(self, row_id, kind=None):
+        """Section spans of a note, optionally only one kind ('hist', 'admit' or 'discharge')"""
+        block = self.__block(row_id)
+        start, stop = self.columns['section_ptr'][block:block + 2]
+        spans = [Section(SECTION_KINDS[code], int(begin), int(end)) for code, begin, end in
+                 zip(self.columns['section_kind'][start:stop], self.columns['section_start'][start:stop],
+                     self.columns['section_end'][start:stop])]
+        return [span for span in spans if kind is None or span.kind == kind]
+
+    def matches(self, row_id):
+        """Drug mention spans of a note"""
+        block = self.__block(row_id)
+        start, stop = self.columns['match_ptr'][block:block + 2]
+        return [Match(self.generics[drug], int(begin), int(end)) for drug, begin, end in
+                zip(self.columns['match_drug'][start:stop], self.columns['match_start'][start:stop],
+                    self.columns['match_end'][start:stop])]
+
+    def read(self, store, row_id, span):
+        """text of a Section/Match span of a note, sliced out of a notestore.NoteStore"""
+        positions = store.lookup(row_id=row_id)
+        if not len(positions):
+            raise KeyError("row_id %d is not in the note store" % row_id)
+        return str(store.raw(positions[0])[span.start:span.end], 'utf-8')
@@ -0,0 +1,152 @@
+"""
+Time-to-event view of post-discharge mortality: Kaplan-Meier curves and log-rank tests per group
+of an analysis_helper.Data, instead of the 30day/1year mortality binaries.
+
+Time is days from hospital discharge to death (death_days_since_hospital as derived by
+notebook_helper.derive_outcomes, or dod - hospital_outtime). Patients with no date of death, or
+who die after follow_up days, are censored at follow_up; dod is a date, so deaths on the
+discharge day come out slightly negative and are clipped to 0.
+
+Everything works on sorted arrays: at-risk counts are binary searches, survival is a cumulative
+product, and the log-rank sums run over all groups (and strata) at once.
+
+matplotlib and scipy (through analysis_stats) are imported by the functions that plot or test,
+so batch jobs that only need the curves don't load them.
+"""
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+DAY = np.timedelta64(1, 'D')
+
+LogRank = namedtuple('logrank', ['statistic', 'dof', 'pval', 'observed', 'expected'])
+
+
+def survival_times(df, follow_up=365, days_col='death_days_since_hospital'):
+    """(time in days, died) arrays of df, censored at follow_up days after discharge"""
+    if days_col in df:
+        days = df[days_col].values.astype(float)
+    else:
+        days = (pd.to_datetime(df['dod']).values - pd.to_datetime(df['hospital_outtime']).values) / DAY
+    died = ~np.isnan(days) & (days <= follow_up)
+    time = np.where(died, np.clip(days, 0, None), follow_up)
+    return time, died
+
+
+def __event_table(time, died, grid):
+    """at risk and deaths at each time of a sorted grid"""
+    ordered = np.sort(time)
+    at_risk = len(time) - np.searchsorted(ordered, grid, 'left')
+    deaths = np.bincount(np.searchsorted(grid, time[died]), minlength=len(grid))
+    return at_risk, deaths
+
+
+def kaplan_meier(time, died, z=1.96):
+    """
+    Kaplan-Meier estimate at every distinct time, with greenwood standard error and a log(-log)
+    confidence band (which stays inside [0, 1])
+    """
+    grid = np.unique(time)
+    at_risk, deaths = __event_table(time, died, grid)
+    censored = np.bincount(np.searchsorted(grid, time[~died]), minlength=len(grid))
+    survival = np.cumprod(1.0 - deaths / at_risk.astype(float))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        greenwood = np.cumsum(deaths / (at_risk * (at_risk - deaths).astype(float)))
+        std_err = survival * np.sqrt(greenwood)
+        log_log_se = np.sqrt(greenwood) / np.abs(np.log(survival))
+        lower = survival ** np.exp(z * log_log_se)
+        upper = survival ** np.exp(-z * log_log_se)
+    return pd.DataFrame({'time': grid, 'at_risk': at_risk, 'deaths': deaths, 'censored': censored,
+                         'survival': survival, 'std_err': std_err,
+                         'ci_lower': np.where(np.isfinite(lower), lower, survival),
+                         'ci_upper': np.where(np.isfinite(upper), upper, survival)})
+
+
+def group_curves(data, follow_up=365, z=1.96):
+    """kaplan_meier of every group of data, keyed by group name"""
+    return dict((group.name, kaplan_meier(*survival_times(group.data, follow_up), z=z)) for group in data.groups)
+
+
+def logrank(time, died, groups, strata=None):
+    """
+    K-group log-rank test of time/died between the integer group codes. with strata, observed - expected
+    and its covariance are summed over strata (stratified log-rank). rows with a negative code are skipped
+    """
+    from scipy import stats
+
+    groups = np.asarray(groups)
+    strata = np.zeros(len(time), dtype=int) if strata is None else pd.factorize(np.asarray(strata))[0]
+    keep = groups >= 0
+    time, died, groups, strata = time[keep], died[keep], groups[keep], strata[keep]
+    n_groups = groups.max() + 1
+
+    observed = np.zeros(n_groups)
+    expected = np.zeros(n_groups)
+    covariance = np.zeros((n_groups, n_groups))
+    for stratum in np.unique(strata):
+        in_stratum = strata == stratum
+        grid = np.unique(time[in_stratum & died])
+        if not len(grid):
+            continue
+        # (event times x groups) at risk and deaths
+        at_risk = np.empty((len(grid), n_groups))
+        deaths = np.empty((len(grid), n_groups))
+        for k in range(n_groups):
+            in_group = in_stratum & (groups == k)
+            at_risk[:, k], deaths[:, k] = __event_table(time[in_group], died[in_group], grid)
+        total_at_risk = at_risk.sum(axis=1)
+        total_deaths = deaths.sum(axis=1)
+        share = at_risk / total_at_risk[:, None]
+        observed += deaths.sum(axis=0)
+        expected += (total_deaths[:, None] * share).sum(axis=0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            scale = np.where(total_at_risk > 1,
+                             total_deaths * (total_at_risk - total_deaths) / (total_at_risk - 1), 0.0)
+        covariance += np.einsum('t,tk,kl->kl', scale, share, np.eye(n_groups)) \
+            - np.einsum('t,tk,tl->kl', scale, share, share)
+
+    # one group is redundant: test the first K-1 observed - expected
+    diff = (observed - expected)[:-1]
+    statistic = float(diff @ np.linalg.pinv(covariance[:-1, :-1]) @ diff)
+    dof = n_groups - 1
+    return LogRank(statistic=statistic, dof=dof, pval=stats.chi2.sf(statistic, dof),
+                   observed=observed, expected=expected)
+
+
+def do_logrank(data, follow_up=365, strata=None, alpha=0.05):
+    """log-rank test over all groups of data, optionally stratified by a column of data.raw_df"""
+    import analysis_stats
+
+    time, died = survival_times(data.raw_df, follow_up)
+    stratum_values = None if strata is None else data.raw_df[strata].values
+    result = logrank(time, died, data.group_codes, stratum_values)
+    print("\n\t\t\t{Log-rank Test of %d-day Survival between %s}"
+          % (follow_up, '/'.join(group.name for group in data.groups)))
+    for group in data.groups:
+        print('%s: observed=%d, expected=%.1f' % (group.name, result.observed[group.axis], result.expected[group.axis]))
+    print('Statistics=%s, dof=%d, p=%.3f' % (result.statistic, result.dof, result.pval))
+    analysis_stats.check_p_val(result.pval, alpha)
+    return result
+
+
+def draw_survival(data, ax, follow_up=365, confidence=True):
+    for name, curve in group_curves(data, follow_up).items():
+        line, = ax.step(np.r_[0, curve.time], np.r_[1.0, curve.survival], where='post', label=name)
+        if confidence:
+            ax.fill_between(np.r_[0, curve.time], np.r_[1.0, curve.ci_lower], np.r_[1.0, curve.ci_upper],
+                            step='post', alpha=0.2, color=line.get_color())
+    ax.set_xlabel("Days since Hospital Discharge")
+    ax.set_ylabel("Survival Probability")
+    ax.set_title("%d-day Survival Relative to Opiates on Admission" % follow_up)
+    ax.legend()
+
+
+def plot_survival(data, follow_up=365, confidence=True):
+    import matplotlib.pyplot as plt
+
+    fig, axes = plt.subplots(nrows=1, ncols=1)
+    fig.set_size_inches(6, 6)
+    draw_survival(data, axes, follow_up, confidence)
+    print("\t\t\t\t\t{KAPLAN-MEIER CURVES}")
+    plt.show()
@@ -0,0 +1,44 @@
+import os
+import random
+import shutil
+import sys
+
+import matplotlib
+import pandas as pd
+import pytest
+
+# the scripts are flat modules imported by name, as the notebooks do
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts'))
+matplotlib.use('Agg')
+
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data')
+
+
+@pytest.fixture
+def druglist_file(tmp_path):
+    """data/opiates.txt copied to tmp_path, so its parsed cache is written there"""
+    path = tmp_path / 'opiates.txt'
+    shutil.copy(os.path.join(DATA_DIR, 'opiates.txt'), str(path))
+    return str(path)
+
+
+NOTE_TEMPLATES = [
+    "Admission Date: [**2150-1-1**]\nHistory of Present Illness:\n{age} yo with chronic pain, prior opiates.\n"
+    "Medications on Admission:\n1. {drug} 5 mg po q6h prn pain\n2. Tylenol\n"
+    "Discharge Medications:\n1. {drug2} 10 mg po bid\n",
+    "Past Medical History:\nHTN\nMedications on Admission:\nNone.\nDischarge Medications:\n1. aspirin 81 mg daily\n",
+    "Medications on Admission:\n{drug} (allergy)\n{drug2} 15 mg q4h\nAllergies: {drug}\n",
+    "Brief Hospital Course:\nno {drug} given. \xe9tat stable.\nMedications on Admission:\n{drug2} patch 25 mcg/hr\n",
+]
+DRUG_NAMES = ['Oxycodone', 'morphine', 'Percocet', 'fentanyl', 'Dilaudid', 'methadone', 'hydromorphone', 'tylenol']
+
+
+@pytest.fixture
+def notes():
+    """small noteevents-like frame; some texts repeat across rows, as one discharge summary does across stays"""
+    rng = random.Random(0)
+    texts = [rng.choice(NOTE_TEMPLATES).format(age=rng.randint(20, 90), drug=rng.choice(DRUG_NAMES),
+                                               drug2=rng.choice(DRUG_NAMES)) for _ in range(30)]
+    rows = [(i + 1, 1000 + i // 3, 5000 + i // 2, rng.choice(texts)) for i in range(120)]
+    return pd.DataFrame(rows, columns=['row_id', 'subject_id', 'hadm_id', 'text'])
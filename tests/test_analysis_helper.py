@@ -0,0 +1,24 @@
+"""summarize on empty and all-NaN series."""
+import warnings
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import analysis_helper
+
+
+@pytest.mark.parametrize('series', [pd.Series([], dtype=float), pd.Series([np.nan, np.nan])])
+def test_summarize_empty(series):
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        summary = analysis_helper.summarize(series)
+    assert summary.n == 0
+    assert all(np.isnan(value) for value in (summary.mean, summary.median, summary.std_dev, summary.var))
+    assert summary.hist_counts.sum() == 0 and len(summary.hist_edges) == 11
+
+
+def test_summarize_values():
+    summary = analysis_helper.summarize(pd.Series([3.0, 1.0, np.nan, 2.0]))
+    assert summary.n == 3 and summary.mean == 2.0 and summary.median == 2.0
+    assert list(summary.sorted_values) == [1.0, 2.0, 3.0]
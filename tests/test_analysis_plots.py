@@ -0,0 +1,41 @@
+"""Smoke test: every plot runs on a small Data, through analysis_helper's lazy names and the report."""
+import numpy as np
+import pandas as pd
+import matplotlib.pyplot as plt
+
+import analysis_helper
+import analysis_plots
+import report
+
+
+def make_data(n=60, seed=0):
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({'opiates': np.arange(n) % 2,
+                       'icu_los_days': rng.exponential(3, n),
+                       '30day_mortality': rng.integers(0, 2, n)})
+    return analysis_helper.Data(df=df)
+
+
+def test_draw_functions():
+    data = make_data()
+    fig, axes = plt.subplots(nrows=1, ncols=len(data.groups), squeeze=False)
+    analysis_plots.draw_hist(data, 'icu_los_days', axes[0], verbose=True)
+    analysis_plots.draw_qq(data, 'icu_los_days', axes[0])
+    analysis_plots.draw_pie_chart(data, '30day_mortality', axes[0])
+    analysis_plots.draw_percents(data, 'icu_los_days', axes[0][0])
+    plt.close(fig)
+
+
+def test_plot_names_through_analysis_helper():
+    data = make_data()
+    analysis_helper.plot_hist(data, 'icu_los_days')
+    analysis_helper.plot_percents(data, 'icu_los_days')
+    analysis_helper.plot_qq(data, 'icu_los_days')
+    analysis_helper.pie_chart(data, '30day_mortality')
+    plt.close('all')
+
+
+def test_build_report(tmp_path):
+    report.build_report(make_data(), ['icu_los_days', '30day_mortality'], str(tmp_path))
+    assert list(tmp_path.glob('*.html'))
+    assert len(list(tmp_path.glob('*.png'))) == 4
@@ -0,0 +1,70 @@
+"""compare_outcomes and its vectorized pieces against scipy on a small three-arm Data."""
+import numpy as np
+import pandas as pd
+import pytest
+from scipy import stats
+
+import analysis_helper
+import analysis_stats
+
+BINARY = ['30day_mortality', '1year_mortality']
+CONTINUOUS = ['icu_los_days', 'hospital_los_days']
+
+
+def make_data(n=150, seed=0):
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({'arm': np.arange(n) % 3,
+                       '30day_mortality': rng.integers(0, 2, n),
+                       '1year_mortality': (rng.random(n) < 0.3).astype(int),
+                       # rounded so the rank tests see ties
+                       'icu_los_days': np.round(rng.exponential(3, n), 1),
+                       'hospital_los_days': rng.integers(1, 20, n).astype(float)})
+    df.loc[df.arm == 2, 'icu_los_days'] += 1
+    return analysis_helper.Data(df=df, by='arm')
+
+
+def test_layout():
+    data = make_data()
+    result = analysis_stats.compare_outcomes(data, CONTINUOUS[:1] + BINARY + CONTINUOUS[1:])
+    assert list(result.outcome) == ['icu_los_days'] * 2 + ['30day_mortality'] * 2 + ['1year_mortality'] * 2 \
+        + ['hospital_los_days'] * 2
+    assert list(result.group[:2]) == ['arm=1', 'arm=2']
+    assert (result.test[result.outcome.isin(BINARY)] == 'chisquare').all()
+    assert (result.reject_h0 == (result.pval <= 0.05)).all()
+
+
+def test_binary_outcomes_match_scipy():
+    data = make_data()
+    result = analysis_stats.compare_outcomes(data, BINARY)
+    for row in result.itertuples():
+        group = next(group for group in data.exposed if group.name == row.group)
+        exposed, control = group.data[row.outcome], data.reference.data[row.outcome]
+        table = [[(exposed == 1).sum(), (exposed == 0).sum()], [(control == 1).sum(), (control == 0).sum()]]
+        assert [[row.exposed_true, row.exposed_false], [row.control_true, row.control_false]] == table
+        stat, pval, dof, expected = stats.chi2_contingency(table)
+        assert row.statistic == pytest.approx(stat) and row.pval == pytest.approx(pval)
+        (et, ef), (ct, cf) = table
+        assert row.odds_ratio == pytest.approx((et * cf) / float(ef * ct))
+        assert row.ci_lower < row.odds_ratio < row.ci_upper
+
+
+@pytest.mark.parametrize('test', ['greater', 'less', 'two-sided'])
+def test_continuous_outcomes_match_scipy(test):
+    data = make_data()
+    result = analysis_stats.compare_outcomes(data, CONTINUOUS, test=test)
+    for row in result.itertuples():
+        group = next(group for group in data.exposed if group.name == row.group)
+        exposed, control = group.data[row.outcome], data.reference.data[row.outcome]
+        expected = stats.mannwhitneyu(exposed, control, alternative=test)
+        assert row.pval == pytest.approx(expected.pvalue)
+        if test != 'less':
+            assert row.statistic == pytest.approx(expected.statistic)
+        assert row.exposed_median == np.median(exposed) and row.control_median == np.median(control)
+
+
+def test_odds_ratio_empty_cell_gets_haldane_correction():
+    odds_ratio, lower, upper = analysis_helper.odds_ratio_ci(np.array([0, 10]), np.array([10, 10]),
+                                                             np.array([5, 5]), np.array([5, 20]))
+    assert odds_ratio[0] == pytest.approx((0.5 / 5.5) / (10.5 / 5.5))
+    assert odds_ratio[1] == pytest.approx((10 / 5.0) / (10 / 20.0))
+    assert np.all(lower < odds_ratio) and np.all(odds_ratio < upper)
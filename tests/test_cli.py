@@ -0,0 +1,98 @@
+"""finddrugs_refactor command line: jobs, batches and resumed runs write the same summary file as search()."""
+import os
+
+import pytest
+
+import finddrugs_refactor as finder
+import notestore
+
+
+@pytest.fixture
+def notes_csv(tmp_path, notes):
+    path = str(tmp_path / 'notes.csv')
+    notes.to_csv(path, index=False)
+    return path
+
+
+@pytest.fixture
+def expected(tmp_path, notes, druglist_file):
+    """summary bytes of one search() over the whole dataframe"""
+    def summary(match_mode='substring'):
+        path = str(tmp_path / ('expected_%s.csv' % match_mode))
+        finder.search(notes, druglist_file, SUMMARY_FILE=path, MATCH_MODE=match_mode)
+        with open(path, 'rb') as f:
+            return f.read()
+    return summary
+
+
+def run(notes_path, druglist_file, output, *args):
+    finder.main([notes_path, '-d', druglist_file, '-o', output, '-q'] + list(args))
+    with open(output, 'rb') as f:
+        return f.read()
+
+
+@pytest.mark.parametrize('args', [[], ['-j', '2'], ['-b', '7'], ['-b', '25', '-j', '2'], ['-b', '1000']])
+def test_jobs_and_batches_write_the_search_output(tmp_path, notes_csv, druglist_file, expected, args):
+    output = str(tmp_path / 'flags.csv')
+    assert run(notes_csv, druglist_file, output, *args) == expected()
+    assert not os.path.exists(output + '.parts')
+
+
+def test_token_mode(tmp_path, notes_csv, druglist_file, expected):
+    output = str(tmp_path / 'flags.csv')
+    assert run(notes_csv, druglist_file, output, '--match-mode', 'token', '-b', '30', '-j', '2') == expected('token')
+
+
+def test_note_store_input(tmp_path, notes, druglist_file, expected):
+    store = notestore.build(notes, str(tmp_path / 'store'))
+    store.close()
+    output = str(tmp_path / 'flags.csv')
+    assert run(str(tmp_path / 'store'), druglist_file, output, '-b', '50', '-j', '2') == expected()
+
+
+class Killed(Exception):
+    pass
+
+
+def test_resume_after_an_interrupted_run(tmp_path, notes_csv, druglist_file, expected, monkeypatch):
+    output = str(tmp_path / 'flags.csv')
+    summary = expected()
+    search = finder.search
+    calls = []
+
+    def killed_at(batch):
+        def scan(*args, **kwargs):
+            calls.append(kwargs['SUMMARY_FILE'])
+            if batch is not None and len(calls) == batch + 1:
+                raise Killed
+            return search(*args, **kwargs)
+        return scan
+    monkeypatch.setattr(finder, 'search', killed_at(2))
+    with pytest.raises(Killed):
+        run(notes_csv, druglist_file, output, '-b', '25')
+    parts = sorted(os.listdir(output + '.parts'))
+    assert parts == [finder.MANIFEST_FILE, finder.PART_PATTERN.format(0), finder.PART_PATTERN.format(1)]
+    assert not os.path.exists(output)
+
+    # without --resume, or with other options, the parts aren't reused
+    with pytest.raises(ValueError, match='--resume'):
+        run(notes_csv, druglist_file, output, '-b', '25')
+    with pytest.raises(ValueError, match='other options'):
+        run(notes_csv, druglist_file, output, '-b', '20', '--resume')
+
+    calls.clear()
+    monkeypatch.setattr(finder, 'search', killed_at(None))
+    assert run(notes_csv, druglist_file, output, '-b', '25', '--resume', '-j', '2') == summary
+    # only batches 2, 3 and 4 were scanned again
+    assert [os.path.basename(path) for path in calls] == [finder.PART_PATTERN.format(i) + '.tmp' for i in (2, 3, 4)]
+    assert not os.path.exists(output + '.parts')
+
+
+def test_existing_output_is_kept(tmp_path, notes_csv, druglist_file):
+    output = str(tmp_path / 'flags.csv')
+    with open(output, 'w') as f:
+        f.write('keep')
+    with pytest.raises(ValueError, match='already exists'):
+        run(notes_csv, druglist_file, output)
+    with open(output) as f:
+        assert f.read() == 'keep'
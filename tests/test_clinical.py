@@ -0,0 +1,67 @@
+"""Valid range filter and server-side cursor names of clinical, without a database server."""
+import sqlite3
+
+import pytest
+
+import clinical
+import itemids
+
+
+@pytest.mark.parametrize('source', sorted(clinical.SOURCES))
+def test_every_variable_has_a_range(source):
+    spec = clinical.SOURCES[source]
+    assert set(spec['ranges']) == set(spec['variables'])
+    assert clinical.range_case(spec['ranges']) in clinical.window_events(source)
+
+
+@pytest.mark.parametrize('variable, valuenum, kept', [
+    ('heart_rate', 80, True), ('heart_rate', 0, False), ('heart_rate', 999, False),
+    ('temp_c', 37.2, True), ('temp_c', 98.6, False), ('temp_c', 5, False),
+    ('spo2', 100, True), ('spo2', 101, False),
+    ('glucose', 2500, True), ('glucose', -1, False),
+])
+def test_range_case(variable, valuenum, kept):
+    con = sqlite3.connect(':memory:')
+    con.execute('CREATE TABLE windowed (variable TEXT, valuenum REAL)')
+    con.execute('INSERT INTO windowed VALUES (?, ?)', (variable, valuenum))
+    rows = con.execute('SELECT * FROM windowed WHERE %s' % clinical.range_case(itemids.vital_ranges)).fetchall()
+    assert bool(rows) == kept
+
+
+class Cursor(object):
+    description = [('icustay_id',), ('variable',), ('valuenum',)]
+
+    def __init__(self, names, name):
+        names.append(name)
+        self.rows = [(1, 'heart_rate', 80.0)] if name else []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+    def execute(self, query):
+        pass
+
+    def fetchmany(self, size):
+        rows, self.rows = self.rows, []
+        return rows
+
+
+class Connection(object):
+    def __init__(self):
+        self.names = []
+
+    def cursor(self, name=None):
+        return Cursor(self.names, name)
+
+
+def test_stream_cursors_have_unique_names():
+    con = Connection()
+    first = clinical.stream_query('SELECT 1', con)
+    second = clinical.stream_query('SELECT 1', con)
+    # both streams open at once on one connection
+    assert len(next(first)) == 1 and len(next(second)) == 1
+    named = [name for name in con.names if name]
+    assert len(named) == 2 and len(set(named)) == 2
@@ -0,0 +1,67 @@
+"""Cohort attrition: the FILTER counts match filter_exclusion_criteria, and the flow diagram table built from them."""
+import re
+
+import numpy as np
+import pandas as pd
+
+import notebook_helper
+import queries
+
+
+def normalized(sql):
+    return ' '.join(sql.split())
+
+
+def flags_cte(sql):
+    return normalized(sql[sql.index('), flags AS ('):sql.index('FROM icd_codes')])
+
+
+def test_flags_match_filter_exclusion_criteria():
+    assert flags_cte(queries.cohort_attrition()) == flags_cte(queries.filter_exclusion_criteria())
+
+
+def test_last_step_is_the_cohort_filter():
+    where = normalized(queries.filter_exclusion_criteria().split('FROM flags')[1].split('ORDER BY')[0])
+    cohort = set(re.sub(r'\s*=\s*', ' = ', cond).strip() for cond in where.replace('WHERE', '').split(' AND '))
+    assert set(cond for _, cond in queries.ATTRITION_STEPS) == cohort
+
+
+def test_filter_counts():
+    sql = normalized(queries.cohort_attrition())
+    steps = [step for step, _ in queries.ATTRITION_STEPS]
+    found = re.findall(r'COUNT\(\*\) FILTER \(WHERE (.*?)\) AS (\w+)', sql)
+    assert [name for _, name in found] == steps + [step + '_failed' for step in steps]
+    cumulative = [cond for cond, _ in found[:len(steps)]]
+    for i, (_, condition) in enumerate(queries.ATTRITION_STEPS):
+        # every cumulative filter adds one criterion to the one before it
+        assert cumulative[i] == (condition if i == 0 else cumulative[i - 1] + ' AND ' + condition)
+        assert found[len(steps) + i][0] == 'NOT (%s)' % condition
+    assert '{' not in sql and '}' not in sql
+
+
+def evaluate(condition, df):
+    """a cumulative ATTRITION_STEPS filter over a frame of flags"""
+    return df.eval(condition.replace(' = ', ' == ').replace(' AND ', ' and ')).sum()
+
+
+def test_get_cohort_attrition(monkeypatch):
+    rng = np.random.default_rng(0)
+    n = 200
+    flags = pd.DataFrame({'valid_age': rng.random(n) < 0.9, 'valid_death': rng.random(n) < 0.95,
+                          'valid_icu_admit': rng.random(n) < 0.8, 'has_anoxic_brain': rng.random(n) < 0.05,
+                          'has_cancer': rng.random(n) < 0.15, 'opiate_abuse': rng.random(n) < 0.05}).astype(int)
+    row = {'icu_stays': n + 7, 'with_diagnoses': n}
+    for i, (step, condition) in enumerate(queries.ATTRITION_STEPS):
+        row[step] = evaluate(' AND '.join(cond for _, cond in queries.ATTRITION_STEPS[:i + 1]), flags)
+        row[step + '_failed'] = n - evaluate(condition, flags)
+    monkeypatch.setattr(notebook_helper, 'run_query', lambda query, db_connection, check_events=True: pd.DataFrame([row]))
+
+    table = notebook_helper.get_cohort_attrition(None)
+    assert list(table.step) == ['icu_stays', 'with_diagnoses'] + [step for step, _ in queries.ATTRITION_STEPS]
+    assert table.remaining.iloc[0] == n + 7 and table.excluded.iloc[1] == 7
+    # each step excludes what the step before it left and it doesn't
+    assert (table.remaining.iloc[:-1].values - table.remaining.iloc[1:].values == table.excluded.iloc[1:].values).all()
+    assert (table.excluded >= 0).all() and (table.excluded.iloc[2:] <= table.failed_criterion.iloc[2:]).all()
+    assert table.remaining.iloc[-1] == ((flags.valid_age == 1) & (flags.valid_death == 1) & (flags.valid_icu_admit == 1)
+                                        & (flags[['has_anoxic_brain', 'has_cancer', 'opiate_abuse']] == 0).all(axis=1)).sum()
+    assert table.failed_criterion.iloc[-1] == flags.opiate_abuse.sum()
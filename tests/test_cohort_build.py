@@ -0,0 +1,95 @@
+"""Sharded cohort build: the shard filter sql, and the concatenated shards equal a single-shard build."""
+import re
+import sys
+import types
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import cohort_build
+import notebook_helper
+import queries
+
+SHARD_PATTERN = re.compile(r"mod\([\w.]+, (\d+)\) = (\d+)")
+
+
+def test_shard_filter():
+    assert queries.shard_filter('subject_id') == ''
+    assert queries.shard_filter('icu.subject_id', (1, 4)) == 'WHERE mod(icu.subject_id, 4) = 1'
+    assert queries.shard_filter('subject_id', (0, 2), keyword='AND') == 'AND mod(subject_id, 2) = 0'
+    for shard in [(4, 4), (-1, 4)]:
+        with pytest.raises(ValueError):
+            queries.shard_filter('subject_id', shard)
+
+
+@pytest.mark.parametrize('extract', [queries.discharge_events, queries.hospital_outcomes, queries.death_outcome])
+def test_extracts_filter_only_when_sharded(extract):
+    assert 'mod(' not in extract()
+    sharded = extract((2, 8))
+    assert SHARD_PATTERN.findall(sharded) == [('8', '2')]
+    # only the filter clause differs from the unsharded query
+    assert re.sub(r'(WHERE|AND) mod\([\w.]+, 8\) = 2', '', sharded).split() == extract().split()
+
+
+def make_extracts(notes, seed=0):
+    """discharge_events, hospital_outcomes and death_outcome frames over the notes fixture"""
+    rng = np.random.default_rng(seed)
+    n = len(notes)
+    # both notes of an admission share its text, so the admission isn't dropped as ambiguous
+    events = notes.assign(subject_id=1000 + np.arange(n) // 4, hadm_id=5000 + np.arange(n) // 2,
+                          text=notes.text.values[np.arange(n) // 2 * 2])
+    hos_in = pd.Timestamp('2150-01-01') + pd.to_timedelta(np.arange(n) // 2 * 40, unit='D')
+    events = events.assign(intime=hos_in + pd.Timedelta('6h'), outtime=hos_in + pd.to_timedelta(rng.integers(1, 9, n), unit='D'),
+                           diff_last_outtime=np.where(np.arange(n) % 4 >= 2, 30.0, np.nan),
+                           icd9_codes=[['4019', '25000']] * n, short_titles=['HTN'] * n,
+                           long_titles=[['Hypertension', 'Diabetes']] * n,
+                           category='Discharge summary', description='Report')
+    admissions = events.groupby(['subject_id', 'hadm_id'], as_index=False).intime.min()
+    admissions = admissions.assign(hospital_intime=admissions.intime - pd.Timedelta('6h'),
+                                   hospital_outtime=admissions.intime + pd.Timedelta('12D')).drop(columns='intime')
+    subjects = np.unique(events.subject_id)
+    dod = pd.Series(pd.NaT, index=subjects)
+    dod[subjects % 3 == 0] = pd.Timestamp('2151-01-01')
+    patients = pd.DataFrame({'subject_id': subjects, 'dod': dod.values})
+    return events, admissions, patients
+
+
+def stub_database(monkeypatch, events, admissions, patients):
+    """run_query answers the three extracts, applying their shard filter to subject_id like the database"""
+    def run_query(query, db_connection, check_events=True):
+        found = SHARD_PATTERN.search(query)
+        shard = None if found is None else (int(found.group(2)), int(found.group(1)))
+        for extract, df in [(queries.discharge_events, events), (queries.hospital_outcomes, admissions),
+                            (queries.death_outcome, patients)]:
+            if query == extract(shard):
+                return df if shard is None else df[df.subject_id % shard[1] == shard[0]].copy()
+        raise AssertionError('unexpected query')
+
+    connection = types.SimpleNamespace(close=lambda: None)
+    monkeypatch.setitem(sys.modules, 'psycopg2', types.SimpleNamespace(connect=lambda **kwargs: connection))
+    monkeypatch.setattr(notebook_helper, 'run_query', run_query)
+    monkeypatch.setattr(notebook_helper, 'provision_discharge_view', lambda con: None)
+
+
+@pytest.mark.parametrize('n_shards, n_jobs', [(3, 1), (4, 2)])
+def test_shards_equal_single_pass(tmp_path, monkeypatch, notes, druglist_file, n_shards, n_jobs):
+    stub_database(monkeypatch, *make_extracts(notes))
+    for name in ['single', 'sharded', 'count']:
+        (tmp_path / name).mkdir()
+    single = cohort_build.build_cohort({}, druglist_file, n_shards=1, n_jobs=1, expected_count=None,
+                                       work_dir=str(tmp_path / 'single'))
+    sharded = cohort_build.build_cohort({}, druglist_file, n_shards=n_shards, n_jobs=n_jobs, expected_count=None,
+                                        work_dir=str(tmp_path / 'sharded'))
+    assert 0 < len(single) < len(notes)
+    pd.testing.assert_frame_equal(sharded, single)
+    with pytest.raises(AssertionError):
+        cohort_build.build_cohort({}, druglist_file, n_shards=2, n_jobs=1, expected_count=len(single) + 1,
+                                  work_dir=str(tmp_path / 'count'))
+
+
+def test_concat_shards_order():
+    shards = [pd.DataFrame({'subject_id': [2, 1], 'hadm_id': [20, 10], 'row_id': [4, 1]}),
+              pd.DataFrame({'subject_id': [1, 2], 'hadm_id': [11, 20], 'row_id': [2, 3]})]
+    df = cohort_build.concat_shards(shards)
+    assert list(df.row_id) == [1, 2, 3, 4] and list(df.index) == [0, 1, 2, 3]
@@ -0,0 +1,119 @@
+"""Elixhauser/Charlson flags and scores against a per-code prefix check of the Quan 2005 lists."""
+import random
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import comorbidity
+
+
+def categories_of(code, codes):
+    """categories whose items (prefixes or 'low-high' prefix ranges) match code, one code at a time"""
+    found = set()
+    for category, items in codes.items():
+        for item in items:
+            if '-' in item:
+                low, high = item.split('-')
+                prefix = code[:len(low)]
+                if len(prefix) == len(low) and prefix[:1].isdigit() == low[:1].isdigit() and low <= prefix <= high:
+                    found.add(category)
+            elif code.startswith(item):
+                found.add(category)
+    return found
+
+
+def flagged(df, index):
+    prefix = index + '_'
+    return set(col[len(prefix):] for col in df if col != prefix + 'score' and df[col].iloc[0] == 1)
+
+
+@pytest.mark.parametrize('code, elixhauser, charlson', [
+    ('4280', {'chf'}, {'chf'}),
+    ('428.0', {'chf'}, {'chf'}),
+    ('4019', {'hypertension_uncomplicated'}, set()),
+    ('25040', {'diabetes_complicated'}, {'diabetes_complicated'}),
+    ('2508', {'diabetes_complicated'}, {'diabetes_uncomplicated'}),
+    ('1970', {'metastatic_cancer'}, {'metastatic_cancer'}),
+    ('V420', {'renal_failure'}, {'renal'}),
+    ('V4511', {'renal_failure'}, {'renal'}),
+    ('4255', {'chf', 'alcohol_abuse'}, {'chf'}),
+    ('40403', {'chf', 'renal_failure', 'hypertension_complicated'}, {'chf', 'renal'}),
+    # other skin cancers (173) are in neither list
+    ('1733', set(), set()),
+    ('1729', {'solid_tumor'}, {'cancer'}),
+    ('1740', {'solid_tumor'}, {'cancer'}),
+    ('1959', {'solid_tumor'}, set()),
+    ('173', set(), set()),
+    ('E8502', set(), set()),
+    ('', set(), set()),
+])
+def test_known_codes(code, elixhauser, charlson):
+    df = pd.DataFrame({'icd9_codes': [[code]]})
+    assert flagged(comorbidity.score_admissions(df, 'elixhauser'), 'elixhauser') == elixhauser
+    assert flagged(comorbidity.score_admissions(df, 'charlson'), 'charlson') == charlson
+
+
+@pytest.mark.parametrize('code, inside', [('4253', False), ('4254', True), ('4259', True), ('42599', True),
+                                          ('7462', False), ('7465', True), ('7467', False),
+                                          ('041', False), ('042', True), ('0431', True), ('045', False)])
+def test_ranges(code, inside):
+    expected = categories_of(code, comorbidity.ELIXHAUSER)
+    flags = comorbidity.flag_categories([[code]])[0]
+    assert set(np.array(comorbidity.INDEXES['elixhauser'].categories)[flags == 1]) == expected
+    assert bool(expected - {'alcohol_abuse'}) == inside
+
+
+def test_flags_match_the_code_by_code_check():
+    rng = random.Random(0)
+    pool = sorted(set(prefix + tail for index in comorbidity.INDEXES.values() for prefix in index.table
+                      for tail in ('', '0', '9', '19')))
+    pool += ['0389', '5849', '99591', 'V1582', 'E8497', '7994', '2765']
+    code_lists = [rng.sample(pool, rng.randint(0, 12)) for _ in range(300)]
+    for name, codes in [('elixhauser', comorbidity.ELIXHAUSER), ('charlson', comorbidity.CHARLSON)]:
+        index = comorbidity.INDEXES[name]
+        flags = comorbidity.flag_categories(code_lists, name)
+        assert flags.shape == (len(code_lists), len(index.categories)) and flags.dtype == np.int8
+        for row, code_list in zip(flags, code_lists):
+            expected = set().union(*[categories_of(code, codes) for code in code_list])
+            assert set(np.array(index.categories)[row == 1]) == expected, code_list
+
+
+@pytest.mark.parametrize('codes, charlson_score, elixhauser_score', [
+    (['25000', '25040'], 2, 0),
+    (['5715', '5722'], 3, 11),
+    (['1500', '1970'], 6, 12),
+    (['1500'], 2, 4),
+    (['4011', '4030'], 0, 0),
+    (['4280', '4100', '1970', '5722'], 1 + 1 + 6 + 3, 7 + 12 + 11),
+])
+def test_hierarchy_scores(codes, charlson_score, elixhauser_score):
+    df = comorbidity.add_comorbidities(pd.DataFrame({'icd9_codes': [codes]}))
+    assert df.charlson_score.iloc[0] == charlson_score
+    assert df.elixhauser_score.iloc[0] == elixhauser_score
+
+
+def test_hierarchy_leaves_the_flags():
+    df = comorbidity.score_admissions(pd.DataFrame({'icd9_codes': [['1500', '1970']]}), 'charlson')
+    assert df.charlson_cancer.iloc[0] == 1 and df.charlson_metastatic_cancer.iloc[0] == 1
+
+
+def test_empty_and_missing_code_lists():
+    codes = [['4280'], [], None, np.nan, np.array(['1970', None]), ('25040',), []]
+    df = pd.DataFrame({'icd9_codes': codes}, index=[10, 11, 12, 13, 14, 15, 16])
+    scored = comorbidity.add_comorbidities(df)
+    assert list(scored.index) == list(df.index)
+    assert list(scored.charlson_score) == [1, 0, 0, 0, 6, 2, 0]
+    assert list(scored.elixhauser_chf) == [1, 0, 0, 0, 0, 0, 0]
+    assert scored.filter(like='elixhauser_').loc[[11, 12, 13, 16]].eq(0).all().all()
+
+    assert comorbidity.flag_categories([]).shape == (0, len(comorbidity.ELIXHAUSER))
+    assert not comorbidity.flag_categories([[], None]).any()
+
+
+def test_add_comorbidities_keeps_the_frame():
+    df = pd.DataFrame({'hadm_id': [1, 2], 'icd9_codes': [['4280'], ['25000']]})
+    scored = comorbidity.add_comorbidities(df, indexes=('charlson',))
+    assert list(scored.columns[:2]) == ['hadm_id', 'icd9_codes']
+    assert list(scored.columns[2:]) == ['charlson_%s' % c for c in comorbidity.CHARLSON] + ['charlson_score']
+    assert list(df.columns) == ['hadm_id', 'icd9_codes']
@@ -0,0 +1,101 @@
+"""Drug co-occurrence on a small summary file whose admission counts are worked out by hand below."""
+import numpy as np
+import pandas as pd
+import pytest
+
+import analysis_helper
+import cooccurrence
+
+# notes -> admissions (drugs a, b, c):
+#   10: a | b        -> a b    opiate (one note is)
+#   11: a b          -> a b    non_opiate
+#   12: c | a c      -> a c    opiate
+#   13: none         -> -      non_opiate
+#   14: a b c        -> a b c  opiate
+NOTES = [(1, 1, 10, 1, 1, 0, 0), (2, 1, 10, 0, 0, 1, 0), (3, 2, 11, 0, 1, 1, 0), (4, 3, 12, 1, 0, 0, 1),
+         (5, 3, 12, 1, 1, 0, 1), (6, 4, 13, 0, 0, 0, 0), (7, 5, 14, 1, 1, 1, 1)]
+
+
+@pytest.fixture
+def summary_file(tmp_path):
+    df = pd.DataFrame(NOTES, columns=['row_id', 'subject_id', 'hadm_id', 'opiates', 'a', 'b', 'c'])
+    for col in ['hist_found', 'opiate_history', 'admit_found', 'dis_found', 'group']:
+        df[col] = 1
+    df['a_confidence'] = np.where(df.a == 1, 0.9, np.nan)
+    columns = ['row_id', 'subject_id', 'hadm_id'] + cooccurrence.SUMMARY_COLUMNS + ['a', 'b', 'c', 'a_confidence']
+    path = str(tmp_path / 'summary.csv')
+    df[columns].to_csv(path, index=False)
+    return path
+
+
+@pytest.fixture
+def admissions(summary_file):
+    return cooccurrence.by_admission(cooccurrence.load_flags(summary_file))
+
+
+@pytest.mark.parametrize('chunksize', [2, 3, 100])
+def test_load_flags(summary_file, chunksize):
+    matrix = cooccurrence.load_flags(summary_file, chunksize=chunksize)
+    assert matrix.generics == ['a', 'b', 'c']
+    assert (matrix.flags.toarray() == np.array([note[4:] for note in NOTES])).all()
+    assert list(matrix.ids.columns) == cooccurrence.ID_COLUMNS + [cooccurrence.ARM_COL]
+
+
+def test_by_admission(admissions):
+    assert list(admissions.ids.hadm_id) == [10, 11, 12, 13, 14]
+    assert list(admissions.ids.subject_id) == [1, 2, 3, 4, 5]
+    assert list(admissions.ids.opiates) == [1, 0, 1, 0, 1]
+    assert (admissions.flags.toarray() == [[1, 1, 0], [1, 1, 0], [1, 0, 1], [0, 0, 0], [1, 1, 1]]).all()
+    assert list(cooccurrence.polypharmacy(admissions.flags)) == [2, 2, 2, 0, 3]
+
+
+def test_cooccurrence_and_lift(admissions):
+    counts = cooccurrence.cooccurrence(admissions.flags)
+    assert (counts.toarray() == [[4, 3, 2], [3, 3, 1], [2, 1, 2]]).all()
+    lift = cooccurrence.lift(counts, 5).toarray()
+    assert lift[0, 1] == pytest.approx(3 * 5 / 12.0) and lift[1, 2] == pytest.approx(5 / 6.0)
+    assert lift[0, 0] == pytest.approx(5 / 4.0)
+
+    pairs = cooccurrence.pair_table(counts, admissions.generics, 5)
+    assert list(zip(pairs.drug_a, pairs.drug_b, pairs['count'])) == [('a', 'b', 3), ('a', 'c', 2), ('b', 'c', 1)]
+    assert list(pairs.support) == pytest.approx([0.6, 0.4, 0.2])
+    assert list(pairs.lift) == pytest.approx([1.25, 1.25, 5 / 6.0])
+
+
+def test_arm_summary(admissions):
+    pairs, distribution = cooccurrence.arm_summary(admissions)
+    opiate = pairs[pairs.arm == 'opiate']
+    assert list(zip(opiate.drug_a, opiate.drug_b, opiate['count'])) == [('a', 'b', 2), ('a', 'c', 2), ('b', 'c', 1)]
+    assert list(opiate.lift) == pytest.approx([1.0, 1.0, 0.75])
+    assert set(opiate.admissions) == {3}
+    non_opiate = pairs[pairs.arm == 'non_opiate']
+    assert list(zip(non_opiate.drug_a, non_opiate.drug_b, non_opiate['count'], non_opiate.lift)) == [('a', 'b', 1, 2.0)]
+    assert set(non_opiate.admissions) == {2}
+
+    assert list(distribution.index) == ['opiate', 'non_opiate']
+    assert distribution.loc['opiate'].tolist() == [0, 0, 2, 1]
+    assert distribution.loc['non_opiate'].tolist() == [1, 0, 1, 0]
+
+
+def test_arms_from_data(admissions):
+    df = pd.DataFrame({'hadm_id': [10, 11, 12, 14, 14], 'arm': ['x', 'y', 'x', 'y', 'y']})
+    data = analysis_helper.Data(df=df, by='arm')
+    arms = cooccurrence.arm_labels(admissions, data)
+    assert list(arms[[0, 1, 2, 4]]) == ['arm=x', 'arm=y', 'arm=x', 'arm=y'] and pd.isnull(arms[3])
+
+    pairs, distribution = cooccurrence.arm_summary(admissions, arms)
+    # admission 13 isn't in data, so it is left out
+    assert distribution.values.sum() == 4
+    assert distribution.loc['arm=x'].tolist() == [0, 0, 2, 0]
+    assert distribution.loc['arm=y'].tolist() == [0, 0, 1, 1]
+    x = pairs[pairs.arm == 'arm=x']
+    assert list(zip(x.drug_a, x.drug_b, x['count'])) == [('a', 'b', 1), ('a', 'c', 1)]
+
+
+def test_empty_summary(tmp_path):
+    path = str(tmp_path / 'empty.csv')
+    pd.DataFrame(columns=['row_id', 'subject_id', 'hadm_id'] + cooccurrence.SUMMARY_COLUMNS + ['a']).to_csv(path, index=False)
+    admissions = cooccurrence.by_admission(cooccurrence.load_flags(path))
+    assert admissions.flags.shape == (0, 1)
+    pairs, distribution = cooccurrence.arm_summary(admissions)
+    assert pairs.empty and distribution.shape == (0, 2)
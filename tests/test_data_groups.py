@@ -0,0 +1,55 @@
+"""Data grouping: the opiates default, multi-arm and stratified splits, reference choice and Series keys."""
+import numpy as np
+import pandas as pd
+
+import analysis_helper
+import matching
+import report
+
+
+def make_frame(n=120, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({'opiates': np.arange(n) % 2,
+                         'admission_type': np.where(np.arange(n) % 3, 'EMERGENCY', 'ELECTIVE'),
+                         'age': rng.uniform(20, 89, n),
+                         'icu_los_days': rng.exponential(3, n),
+                         '30day_mortality': rng.integers(0, 2, n)},
+                        index=np.arange(1000, 1000 + n))
+
+
+def test_default_opiate_split():
+    df = make_frame()
+    data = analysis_helper.Data(df=df)
+    assert [group.name for group in data.groups] == ['non_opiate', 'opiate']
+    assert data.reference is data.non_opiates and data.exposed == [data.opiate]
+    assert len(data.opiate.data) == (df.opiates == 1).sum()
+
+
+def test_stratified_split_and_reference():
+    data = analysis_helper.Data(df=make_frame()).stratify(['opiates', 'admission_type'],
+                                                        reference=(0, 'EMERGENCY'))
+    assert len(data.groups) == 4
+    assert data.reference.name == 'opiates=0|admission_type=EMERGENCY'
+    assert len(data.exposed) == 3
+    assert sorted(set(data.group_codes)) == [0, 1, 2, 3]
+
+
+def test_series_key_becomes_a_column():
+    df = make_frame()
+    band = pd.cut(df.age, [18, 45, 65, 90])
+    data = analysis_helper.Data(df=df, by=['opiates', band])
+    assert data.by == ['opiates', 'age_group']
+    assert 'age_group' not in df
+    assert (data.raw_df['age_group'] == band).all()
+    assert data.groups[0].name == 'opiates=0|age_group=(18, 45]'
+    named = analysis_helper.Data(df=df, by=(df.icu_los_days > 3).rename('long_stay'))
+    assert named.by == 'long_stay' and len(named.groups) == 2
+
+
+def test_series_key_survives_trim_and_resampling(tmp_path):
+    df = make_frame()
+    data = analysis_helper.Data(df=df, by=(df.admission_type == 'EMERGENCY').astype(int).rename('emergency'))
+    report.build_report(data, ['icu_los_days', '30day_mortality'], str(tmp_path))
+    assert list(tmp_path.glob('*.html'))
+    interval = matching.bootstrap_matched_effect(data, ['age'], 'icu_los_days', n_resamples=5, seed=0, caliper=None)
+    assert interval.ci_lower <= interval.ci_upper
@@ -0,0 +1,40 @@
+"""Dose extraction and daily MME conversion of dosage."""
+import math
+
+import pytest
+
+import dosage
+
+
+@pytest.mark.parametrize('text, amount, unit, route, per_day', [
+    (' 20 mg po q12h', 20.0, 'mg', 'oral', 2.0),
+    (' 5-325 mg 1-2 tabs q4-6h prn', 5.0, 'mg', 'unknown', 6.0),
+    (' 25 mcg/h patch', 25.0, 'mcg/hr', 'transdermal', None),
+    (' 1 g iv b.i.d.', 1000.0, 'mg', 'parenteral', 2.0),
+    (' 10 mg po', 10.0, 'mg', 'oral', None),
+])
+def test_extract(text, amount, unit, route, per_day):
+    dose = dosage.extract(text)
+    assert (dose.amount, dose.unit, dose.route) == (amount, unit, route)
+    assert math.isnan(dose.per_day) if per_day is None else dose.per_day == per_day
+
+
+def test_methadone_without_frequency_is_nan():
+    assert math.isnan(dosage.daily_mme('methadone', dosage.extract(' 10 mg po')))
+
+
+@pytest.mark.parametrize('text, mme', [
+    (' 20 mg daily', 20 * 4.0),
+    (' 21 mg daily', 21 * 8.0),
+    (' 20 mg bid', 40 * 8.0),
+    (' 30 mg bid', 60 * 10.0),
+    (' 31 mg bid', 62 * 12.0),
+])
+def test_methadone_tier_boundaries(text, mme):
+    assert dosage.daily_mme('methadone', dosage.extract(text)) == pytest.approx(mme)
+
+
+def test_unconvertible_doses_are_nan():
+    assert math.isnan(dosage.daily_mme('morphine', dosage.extract(' 4 mg iv q4h')))
+    assert math.isnan(dosage.daily_mme('fentanyl', dosage.extract(' 50 mcg iv')))
+    assert dosage.daily_mme('fentanyl', dosage.extract(' 25 mcg/hr patch')) == pytest.approx(60.0)
@@ -0,0 +1,80 @@
+"""Drug list parsing, validation errors and the pickled cache next to the list."""
+import os
+import pickle
+import re
+
+import pytest
+
+import druglist
+
+
+def test_parse():
+    drug_list = druglist.parse('Morphine|Duramorph\n\n  Tramadol \nC++|A.B\n')
+    assert list(drug_list.patterns) == ['morphine', 'tramadol', 'c++']
+    assert drug_list.names['morphine'] == ('morphine', 'duramorph')
+    assert drug_list.names['tramadol'] == ('tramadol',)
+    # names are escaped, so they match literally
+    assert re.fullmatch(drug_list.patterns['c++'], 'a.b')
+    assert not re.fullmatch(drug_list.patterns['c++'], 'axb')
+
+
+@pytest.mark.parametrize('text, message', [
+    ('Morphine|Duramorph\nFentanyl||Subsys\n', 'line 2: empty drug name'),
+    ('Morphine|\n', 'line 1: empty drug name'),
+    (' |Vicodin\n', 'line 1: empty drug name'),
+    ('Morphine\nFentanyl\nmorphine|Arymo\n', "line 3: generic 'morphine' is listed twice"),
+])
+def test_parse_errors(text, message):
+    with pytest.raises(ValueError, match=re.escape('opiates.txt ' + message)):
+        druglist.parse(text, source='opiates.txt')
+
+
+def test_load_errors_name_the_file(tmp_path):
+    path = str(tmp_path / 'bad.txt')
+    with open(path, 'w') as f:
+        f.write('Morphine\nMorphine\n')
+    with pytest.raises(ValueError, match=re.escape(path)):
+        druglist.load(path)
+    assert not os.path.exists(path + druglist.CACHE_SUFFIX)
+
+
+def test_cache_is_reused_while_the_list_is_unchanged(druglist_file, monkeypatch):
+    drug_list = druglist.load(druglist_file)
+    assert os.path.isfile(druglist_file + druglist.CACHE_SUFFIX)
+    assert drug_list == druglist.load(druglist_file, cache=False)
+
+    def fail(*args, **kwargs):
+        raise AssertionError('parsed again')
+    monkeypatch.setattr(druglist, 'parse', fail)
+    assert druglist.load(druglist_file) == drug_list
+
+
+def test_cache_is_invalidated_by_an_edit(druglist_file):
+    druglist.load(druglist_file)
+    # same size and a later mtime, then a new line
+    with open(druglist_file) as f:
+        text = f.read()
+    with open(druglist_file, 'w') as f:
+        f.write(text.replace('Exalgo', 'Exalgx'))
+    stat = os.stat(druglist_file)
+    os.utime(druglist_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    assert druglist.load(druglist_file).names['hydromorphone'] == ('hydromorphone', 'exalgx')
+
+    with open(druglist_file, 'a') as f:
+        f.write('Codeine|Tylenol #3\n')
+    assert 'codeine' in druglist.load(druglist_file).patterns
+
+
+def test_unreadable_or_stale_cache_is_replaced(druglist_file):
+    cache_path = druglist_file + druglist.CACHE_SUFFIX
+    with open(cache_path, 'wb') as f:
+        f.write(b'not a pickle')
+    expected = druglist.load(druglist_file, cache=False)
+    assert druglist.load(druglist_file) == expected
+
+    # a cache written by an older version of the format
+    with open(cache_path, 'rb') as f:
+        key, drug_list = pickle.load(f)
+    with open(cache_path, 'wb') as f:
+        pickle.dump(((druglist.CACHE_VERSION - 1,) + key[1:], drug_list._replace(names={})), f)
+    assert druglist.load(druglist_file) == expected
@@ -0,0 +1,92 @@
+"""finddrugs_refactor: token mode negation and dose windows on single medication lines, and search() outputs."""
+import math
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import finddrugs_refactor
+
+DRUGS = {'morphine': ('morphine', 'ms contin'), 'oxycodone': ('oxycodone', 'percocet'), 'fentanyl': ('fentanyl',)}
+INDEX = dict((generic, i) for i, generic in enumerate(DRUGS))
+TOKEN_TABLE = finddrugs_refactor.buildTokenTable(DRUGS)
+
+
+def flagged(line):
+    flags = [0] * len(INDEX)
+    mentions = [[0] * len(INDEX), [0] * len(INDEX)]
+    finddrugs_refactor.addToDrugsFoundTokens(line, flags, mentions, TOKEN_TABLE, INDEX)
+    return set(generic for generic, i in INDEX.items() if flags[i]), mentions
+
+
+@pytest.mark.parametrize('line', [
+    'Allergies: morphine',
+    'Allergies: Morphine, Percocet, fentanyl',
+    'morphine (allergy)',
+    'morphine (allergic)',
+])
+def test_allergy_phrasings_negated(line):
+    found, mentions = flagged(line)
+    assert not found
+    assert mentions[0] == mentions[1] and sum(mentions[0]) > 0
+
+
+@pytest.mark.parametrize('line, expected', [
+    ('oxycodone 5 mg po q4h', {'oxycodone'}),
+    ('no nausea, oxycodone 5mg', {'oxycodone'}),
+    ('oxycodone (percocet) 5 mg', {'oxycodone'}),
+    ('morphine: stopped', {'morphine'}),
+    ('fentanyl patch held, morphine 15 mg', {'morphine'}),
+    ('morphine 15 mg q4h. Allergies: fentanyl', {'morphine'}),
+])
+def test_scope_of_other_cues(line, expected):
+    assert flagged(line)[0] == expected
+
+
+def doses(line):
+    flags = [0] * len(INDEX)
+    finddrugs_refactor.addToDrugsFoundTokens(line, flags, [[0] * len(INDEX), [0] * len(INDEX)], TOKEN_TABLE, INDEX)
+    patterns = dict((generic, '|'.join(names)) for generic, names in DRUGS.items())
+    spans = finddrugs_refactor.findDrugSpans(line, flags, patterns, INDEX, wholeTokens=True)
+    found = finddrugs_refactor.addDosesFound(line, spans, [None] * len(INDEX))
+    return dict((generic, found[i]) for generic, i in INDEX.items() if found[i] is not None)
+
+
+def test_dose_window_ends_at_next_drug():
+    found = doses('oxycodone prn, morphine 15 mg q4h')
+    assert math.isnan(found['oxycodone'][0].amount)
+    assert math.isnan(found['oxycodone'][1])
+    assert found['morphine'][0].amount == 15.0
+    assert found['morphine'][1] == 90.0
+
+
+def test_dose_window_of_last_drug_runs_to_end_of_line():
+    found = doses('morphine 15 mg q4h, oxycodone 5 mg po q6h')
+    assert found['morphine'][0].amount == 15.0 and found['morphine'][0].per_day == 6.0
+    assert found['oxycodone'][0].amount == 5.0 and found['oxycodone'][1] == 30.0
+
+
+def test_search_dose_file_with_methadone_missing_frequency(tmp_path, druglist_file):
+    notes = pd.DataFrame([(1, 10, 100, "Medications on Admission:\n1. Methadone 10 mg po\n2. Oxycodone 5 mg po q6h\n")],
+                         columns=finddrugs_refactor.NOTE_COLUMNS)
+    dose_file = str(tmp_path / 'doses.npz')
+    finddrugs_refactor.search(notes, druglist_file, SUMMARY_FILE=str(tmp_path / 'out.csv'), DOSE_FILE=dose_file)
+    doses = np.load(dose_file)
+    generics = list(doses['generics'])
+    assert doses['amount'][0, generics.index('methadone')] == 10
+    assert np.isnan(doses['mme'][0, generics.index('methadone')])
+    assert doses['mme'][0, generics.index('oxycodone')] == 30
+
+
+def test_token_mode_confidence(tmp_path, druglist_file):
+    notes = pd.DataFrame([(1, 10, 100, "Medications on Admission:\n1. Oxycodone 5 mg po q6h\n2. No morphine\n"),
+                          (2, 20, 200, "Medications on Admission:\n1. morphine (allergy)\n")],
+                         columns=finddrugs_refactor.NOTE_COLUMNS)
+    summary = str(tmp_path / 'out.csv')
+    finddrugs_refactor.search(notes, druglist_file, SUMMARY_FILE=summary, MATCH_MODE='token')
+    df = pd.read_csv(summary).set_index('row_id')
+    assert df.loc[1, 'oxycodone'] == 1 and df.loc[1, 'oxycodone_confidence'] == 1.0
+    assert df.loc[1, 'morphine'] == 0 and df.loc[1, 'morphine_confidence'] == 0.0
+    assert df.loc[2, 'morphine_confidence'] == 0.0
+    # never mentioned: no confidence rather than 0
+    assert np.isnan(df.loc[2, 'oxycodone_confidence']) and np.isnan(df.loc[1, 'fentanyl_confidence'])
@@ -0,0 +1,38 @@
+"""bootstrap_matched_effect on a three-group Data, matching a group other than the first exposed one."""
+import numpy as np
+import pandas as pd
+
+import analysis_helper
+import matching
+
+
+def make_data(n=90, seed=0):
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({'arm': np.repeat(['a', 'b', 'c'], n // 3),
+                       'age': rng.normal(60, 10, n),
+                       'icu_los_days': rng.exponential(3, n)})
+    df.loc[df.arm == 'c', 'icu_los_days'] += 10
+    return analysis_helper.Data(df=df, by='arm')
+
+
+def test_bootstrap_rematches_named_group_of_each_resample(monkeypatch):
+    data = make_data()
+    target = data.groups[2]
+    matched_groups = []
+
+    def recording_match(resampled, covariates, group=None, **kwargs):
+        matched_groups.append((resampled, group))
+        return original_match(resampled, covariates, group=group, **kwargs)
+
+    original_match = matching.match
+    monkeypatch.setattr(matching, 'match', recording_match)
+    interval = matching.bootstrap_matched_effect(data, ['age'], 'icu_los_days', n_resamples=5, seed=1,
+                                                 group=target, caliper=None)
+
+    assert len(matched_groups) == 6
+    for resampled, group in matched_groups:
+        assert group.name == target.name
+        # the group handed to match belongs to the Data it matches, not to the original one
+        assert any(group is candidate for candidate in resampled.groups)
+    # group c is shifted by 10 days; the first exposed group (b) is not
+    assert interval.estimate > 5 and interval.ci_lower > 5
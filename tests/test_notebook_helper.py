@@ -0,0 +1,119 @@
+"""notebook_helper outside the database: the discharge view provisioning and the outcome derivation."""
+import numpy as np
+import pandas as pd
+import pytest
+
+import notebook_helper
+import queries
+
+
+@pytest.fixture
+def statements(monkeypatch):
+    """run_query answers the view lookup with the found flag; run_statement records what it would run"""
+    ran = []
+
+    def provision(found, refresh=False):
+        monkeypatch.setattr(notebook_helper, 'run_query',
+                            lambda query, con, check_events=True: pd.DataFrame({'found': [found]}))
+        monkeypatch.setattr(notebook_helper, 'run_statement', lambda statement, con: ran.append(statement))
+        notebook_helper.provision_discharge_view(None, refresh=refresh)
+        return ran
+    return provision
+
+
+def test_missing_view_is_created_and_analyzed(statements):
+    ran = statements(0)
+    assert ran == [queries.create_discharge_view()]
+    assert 'ANALYZE %s' % queries.DISCHARGE_VIEW in ran[0]
+
+
+def test_existing_view_is_left_alone(statements):
+    assert statements(1) == []
+
+
+def test_existing_view_refreshed_on_request(statements):
+    ran = statements(1, refresh=True)
+    assert ran == [queries.refresh_discharge_view()]
+    assert 'ANALYZE %s' % queries.DISCHARGE_VIEW in ran[0]
+
+
+def test_view_lookup_query():
+    query = queries.discharge_view_exists()
+    assert 'pg_matviews' in query and "'%s'" % queries.DISCHARGE_VIEW in query
+
+
+def test_view_holds_only_discharge_reports():
+    ddl = ' '.join(queries.create_discharge_view().split())
+    assert 'FROM noteevents WHERE %s;' % queries.DISCHARGE_NOTE_FILTER in ddl
+    assert 'ON %s (subject_id, hadm_id)' % queries.DISCHARGE_VIEW in ddl
+
+
+def test_discharge_events_reads_the_view_or_filters_noteevents():
+    from_view = ' '.join(queries.discharge_events().split())
+    assert 'FROM %s events' % queries.DISCHARGE_VIEW in from_view
+    assert queries.DISCHARGE_NOTE_FILTER not in from_view
+
+    from_table = ' '.join(queries.discharge_events(notes='noteevents').split())
+    assert 'FROM noteevents events' in from_table
+    assert 'events.hadm_id WHERE %s )' % queries.DISCHARGE_NOTE_FILTER in from_table
+    # the two differ only in the notes source and its filter
+    assert from_table.replace(' WHERE ' + queries.DISCHARGE_NOTE_FILTER, '').replace('noteevents events', '%s events'
+                                                                                    % queries.DISCHARGE_VIEW) == from_view
+
+
+def make_extracts(n=40, seed=0):
+    """admits (icu stays), the hospital_outcomes and death_outcome extracts, with NaT dods and late deaths"""
+    rng = np.random.default_rng(seed)
+    subjects = np.arange(n) // 2 + 1
+    hadms = np.arange(n) + 100
+    hos_in = pd.Timestamp('2120-01-01') + pd.to_timedelta(rng.integers(0, 1000, n), unit='D')
+    icu_in = hos_in + pd.to_timedelta(rng.integers(1, 48, n), unit='h')
+    icu_out = icu_in + pd.to_timedelta(rng.integers(12, 240, n), unit='h')
+    hos_out = icu_out + pd.to_timedelta(rng.integers(0, 200, n), unit='h')
+    admits = pd.DataFrame({'subject_id': subjects, 'hadm_id': hadms, 'intime': icu_in, 'outtime': icu_out,
+                           'diff_last_outtime': np.where(rng.random(n) < 0.2, 5.0, np.nan)})
+    admissions = pd.DataFrame({'subject_id': subjects, 'hadm_id': hadms, 'hospital_intime': hos_in,
+                               'hospital_outtime': hos_out})
+    # dod per subject: alive, in icu, in hospital after icu, within 30 days, within a year, later
+    last_out = admissions.groupby('subject_id').hospital_outtime.max()
+    offsets = pd.to_timedelta(rng.choice([-100, -1, 3, 20, 200, 900], len(last_out)), unit='D')
+    dod = pd.Series(last_out.dt.floor('D').values + offsets.values, index=last_out.index)
+    dod[rng.random(len(dod)) < 0.3] = pd.NaT
+    patients = pd.DataFrame({'subject_id': last_out.index, 'dod': dod.values})
+    return admits, admissions, patients
+
+
+def stub_extracts(monkeypatch, admissions, patients):
+    extracts = {queries.hospital_outcomes(): admissions, queries.death_outcome(): patients}
+    monkeypatch.setattr(notebook_helper, 'run_query',
+                        lambda query, db_connection, check_events=True: extracts[query].copy())
+
+
+def test_derive_outcomes_matches_the_step_by_step_pipeline(monkeypatch):
+    admits, admissions, patients = make_extracts()
+    stub_extracts(monkeypatch, admissions, patients)
+    old = notebook_helper.get_mortality_outcome(notebook_helper.get_los_outcome(admits.copy(), None), None)
+    new = notebook_helper.get_outcomes(admits.copy(), None)
+
+    keys = ['subject_id', 'hadm_id']
+    old = old.sort_values(keys).reset_index(drop=True)
+    new = new.sort_values(keys).reset_index(drop=True)
+    columns = ['icu_los_hours', 'hospital_los_hours', 'death_days_since_hospital', '30day_mortality',
+               '1year_mortality']
+    pd.testing.assert_frame_equal(new[keys + columns], old[keys + columns])
+    assert new['30day_mortality'].sum() > 0 and new.death_days_since_hospital.isnull().sum() > 0
+
+    # remove_skew_data adds the days and death flags to the old frame, and reuses them from the new one
+    old_clean = notebook_helper.remove_skew_data(old, expected_count=None)
+    new_clean = notebook_helper.remove_skew_data(new, expected_count=None)
+    columns += ['icu_los_days', 'hospital_los_days', 'icu_death', 'hos_death']
+    pd.testing.assert_frame_equal(new_clean[keys + columns], old_clean[keys + columns])
+    assert 0 < len(new_clean) < len(new)
+
+
+def test_get_time_diff_leaves_its_input_alone():
+    admits = make_extracts()[0]
+    before = admits.copy()
+    df = notebook_helper.get_time_diff(admits, 'outtime', 'intime', 'icu_los_days', days=True)
+    pd.testing.assert_frame_equal(admits, before)
+    assert np.allclose(df.icu_los_days, (admits.outtime - admits.intime) / pd.Timedelta('1D'))
@@ -0,0 +1,131 @@
+"""run_query_async / run_queries_async against a stub asyncpg module and pool (no database needed)."""
+import asyncio
+import sys
+import types
+
+import pytest
+
+import notebook_helper
+
+
+class Attribute(object):
+    def __init__(self, name):
+        self.name = name
+
+
+class Statement(object):
+    def __init__(self, columns, rows, delay):
+        self.columns, self.rows, self.delay = columns, rows, delay
+
+    def get_attributes(self):
+        return [Attribute(name) for name in self.columns]
+
+    async def fetch(self):
+        await asyncio.sleep(self.delay)
+        return self.rows
+
+
+class Connection(object):
+    def __init__(self, pool):
+        self.pool = pool
+
+    async def prepare(self, query):
+        if query not in self.pool.results:
+            raise RuntimeError('relation does not exist: %s' % query)
+        return Statement(*self.pool.results[query])
+
+
+class Acquire(object):
+    def __init__(self, pool):
+        self.pool = pool
+
+    async def __aenter__(self):
+        self.pool.in_use += 1
+        return Connection(self.pool)
+
+    async def __aexit__(self, *exc):
+        self.pool.in_use -= 1
+
+
+class StubPool(object):
+    """query text -> (columns, rows, seconds before the rows arrive)"""
+
+    def __init__(self, results):
+        self.results = results
+        self.in_use = 0
+        self.closed = False
+
+    def acquire(self):
+        return Acquire(self)
+
+    async def close(self):
+        self.closed = True
+
+
+RESULTS = {
+    'slow': (['subject_id', 'hadm_id', 'value'], [(1, 10, 1.5), (2, 20, 2.5)], 0.05),
+    'fast': (['subject_id', 'hadm_id'], [(3, 30)], 0.0),
+    'repeated': (['subject_id', 'hadm_id'], [(1, 10), (1, 10)], 0.0),
+    'empty': (['subject_id', 'hadm_id'], [], 0.0),
+}
+
+
+@pytest.fixture
+def stub_asyncpg(monkeypatch):
+    """stub asyncpg whose create_pool hands out (and remembers) StubPools"""
+    pools = []
+
+    async def create_pool(dsn, **kwargs):
+        pools.append(StubPool(RESULTS))
+        return pools[-1]
+
+    monkeypatch.setitem(sys.modules, 'asyncpg', types.SimpleNamespace(create_pool=create_pool))
+    return pools
+
+
+def test_run_query_async_frame():
+    df = asyncio.run(notebook_helper.run_query_async('slow', StubPool(RESULTS)))
+    assert list(df.columns) == ['subject_id', 'hadm_id', 'value']
+    assert df.value.tolist() == [1.5, 2.5]
+
+
+def test_run_query_async_keeps_columns_of_empty_result():
+    df = asyncio.run(notebook_helper.run_query_async('empty', StubPool(RESULTS)))
+    assert df.empty and list(df.columns) == ['subject_id', 'hadm_id']
+
+
+def test_run_queries_async_keeps_name_order():
+    # the slow query finishes last but is still matched to its own name
+    results = asyncio.run(notebook_helper.run_queries_async({'slow': 'slow', 'fast': 'fast'}, StubPool(RESULTS)))
+    assert list(results) == ['slow', 'fast']
+    assert results['slow'].subject_id.tolist() == [1, 2]
+    assert results['fast'].subject_id.tolist() == [3]
+
+
+def test_check_distinct_events_gate(capsys):
+    pool = StubPool(RESULTS)
+    asyncio.run(notebook_helper.run_queries_async({'checked': 'repeated', 'unchecked': ('repeated', False)}, pool))
+    assert capsys.readouterr().out.count('WARNING') == 1
+    asyncio.run(notebook_helper.run_query_async('repeated', pool, check_events=False))
+    assert 'WARNING' not in capsys.readouterr().out
+
+
+def test_query_pool_closed_on_error(stub_asyncpg):
+    async def run():
+        async with notebook_helper.query_pool('postgresql://stub') as pool:
+            await notebook_helper.run_queries_async({'fast': 'fast', 'missing': 'missing'}, pool)
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(run())
+    assert len(stub_asyncpg) == 1
+    assert stub_asyncpg[0].closed
+    assert stub_asyncpg[0].in_use == 0
+
+
+def test_query_pool_closed_after_success(stub_asyncpg):
+    async def run():
+        async with notebook_helper.query_pool('postgresql://stub') as pool:
+            return await notebook_helper.run_query_async('fast', pool)
+
+    assert len(asyncio.run(run())) == 1
+    assert stub_asyncpg[0].closed
@@ -0,0 +1,50 @@
+"""notestore round trip, lookups and windows, and search() over a store serially and in parallel."""
+import numpy as np
+
+import finddrugs_refactor
+import notestore
+
+
+def test_round_trip(tmp_path, notes):
+    store = notestore.build(notes, str(tmp_path / 'notes'))
+    assert len(store) == len(notes)
+    for note, stored in zip(notes.itertuples(), store.itertuples()):
+        assert (stored.Index, stored.row_id, stored.subject_id, stored.hadm_id, stored.text) \
+            == (note.Index, note.row_id, note.subject_id, note.hadm_id, note.text)
+        assert stored.digest == finddrugs_refactor.noteDigest(note.text)
+    # reopened from disk, and the non-ascii note keeps its characters
+    reopened = notestore.NoteStore(str(tmp_path / 'notes'))
+    assert [note.text for note in reopened.itertuples()] == list(notes.text)
+    assert any('\xe9' in note.text for note in reopened.itertuples())
+    store.close()
+    reopened.close()
+
+
+def test_distinct_lookup_and_window(tmp_path, notes):
+    store = notestore.build(notes, str(tmp_path / 'notes'))
+    first = store.distinct()
+    assert list(first) == list(np.flatnonzero(~notes.text.duplicated().values))
+    assert list(store.lookup(subject_id=1001)) == list(np.flatnonzero(notes.subject_id.values == 1001))
+    assert list(store.lookup(subject_id=1001, hadm_id=5003)) == list(
+        np.flatnonzero((notes.subject_id.values == 1001) & (notes.hadm_id.values == 5003)))
+
+    window = store.window(10, 20)
+    assert (window.start, window.stop, len(window)) == (10, 20, 10)
+    assert [note.row_id for note in window.itertuples()] == list(notes.row_id[10:20])
+    assert window.window(5).start == 15 and len(store.window(110, 500)) == 10
+
+
+def test_empty_store(tmp_path, notes):
+    store = notestore.build(notes.iloc[:0], str(tmp_path / 'empty'))
+    assert len(store) == 0 and list(store.itertuples()) == []
+
+
+def test_search_over_store_matches_frame(tmp_path, notes, druglist_file):
+    store = notestore.build(notes, str(tmp_path / 'notes'))
+    outputs = []
+    for name, source, jobs in [('frame', notes, 1), ('store', store, 1), ('parallel', store, 2)]:
+        path = str(tmp_path / ('%s.csv' % name))
+        finddrugs_refactor.search(source, druglist_file, SUMMARY_FILE=path, N_JOBS=jobs, MATCH_MODE='token')
+        with open(path, 'rb') as f_in:
+            outputs.append(f_in.read())
+    assert outputs[0] == outputs[1] == outputs[2]
@@ -0,0 +1,42 @@
+"""build_report: the files it writes, serially and with worker processes."""
+import os
+
+import numpy as np
+import pandas as pd
+
+import analysis_helper
+import analysis_stats
+import report
+
+COLS = ['icu_los_days', '30day_mortality']
+
+
+def make_data(n=60, seed=0):
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({'opiates': np.arange(n) % 2,
+                       'age': rng.uniform(20, 90, n),
+                       'icu_los_days': rng.exponential(3, n),
+                       '30day_mortality': rng.integers(0, 2, n)})
+    return analysis_helper.Data(df=df)
+
+
+def test_report_files(tmp_path):
+    data = make_data()
+    df_stats = report.build_report(data, COLS, str(tmp_path), title='Test report')
+    pngs = sorted(path.name for path in tmp_path.glob('*.png'))
+    assert pngs == ['30day_mortality_pie.png', 'icu_los_days_hist.png', 'icu_los_days_percents.png',
+                    'icu_los_days_qq.png']
+    html = (tmp_path / 'report.html').read_text()
+    assert '<title>Test report</title>' in html
+    assert html.count('<img src="data:image/png;base64,') == len(pngs)
+    pd.testing.assert_frame_equal(df_stats, analysis_stats.compare_outcomes(data, COLS))
+    assert len(pd.read_csv(str(tmp_path / 'stats.csv'))) == len(df_stats)
+
+
+def test_workers_write_the_same_report(tmp_path):
+    data = make_data()
+    serial = report.build_report(data, COLS, str(tmp_path / 'serial'))
+    parallel = report.build_report(data, COLS, str(tmp_path / 'parallel'), n_jobs=2)
+    pd.testing.assert_frame_equal(serial, parallel)
+    assert sorted(os.listdir(str(tmp_path / 'serial'))) == sorted(os.listdir(str(tmp_path / 'parallel')))
+
@@ -0,0 +1,92 @@
+"""resampling intervals and permutation tests on a small two-arm Data."""
+import numpy as np
+import pandas as pd
+import pytest
+
+import analysis_helper
+import resampling
+
+
+def make_data(n=80, seed=0, arms=2):
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({'opiates': np.arange(n) % arms,
+                       'icu_los_days': rng.exponential(3, n),
+                       '30day_mortality': rng.integers(0, 2, n)})
+    df.loc[df.opiates == 1, 'icu_los_days'] += 2
+    return analysis_helper.Data(df=df)
+
+
+def test_positional_arguments_keep_their_meaning():
+    data = make_data()
+    assert resampling.bootstrap_median_diff(data, 'icu_los_days', 200, 0.1, 64, 1, 0).n_resamples == 200
+    assert resampling.permutation_median_diff(data, 'icu_los_days', 200, 'greater', 64, 1, 0).n_resamples == 200
+    assert resampling.bootstrap_odds_ratio(data, '30day_mortality', 200, 0.1, 0).n_resamples == 200
+    assert resampling.permutation_odds_ratio(data, '30day_mortality', 200, 'less', 0).n_resamples == 200
+
+
+def test_group_keyword():
+    data = make_data(arms=3)
+    first = resampling.bootstrap_median_diff(data, 'icu_los_days', 200, seed=0)
+    second = resampling.bootstrap_median_diff(data, 'icu_los_days', 200, seed=0, group=data.groups[2])
+    expected = np.median(data.groups[2].data.icu_los_days) - np.median(data.reference.data.icu_los_days)
+    assert first.estimate != second.estimate and np.isclose(second.estimate, expected)
+
+
+def test_bootstrap_median_diff_is_seeded_and_independent_of_jobs():
+    data = make_data()
+    first = resampling.bootstrap_median_diff(data, 'icu_los_days', 500, chunk_size=64, seed=42)
+    again = resampling.bootstrap_median_diff(data, 'icu_los_days', 500, chunk_size=64, seed=42)
+    parallel = resampling.bootstrap_median_diff(data, 'icu_los_days', 500, chunk_size=64, n_jobs=2, seed=42)
+    assert first == again == parallel
+    expected = np.median(data.opiate.data.icu_los_days) - np.median(data.non_opiates.data.icu_los_days)
+    assert first.estimate == expected
+    assert first.ci_lower < first.estimate < first.ci_upper
+    assert first.ci_lower > 0
+
+
+def test_permutation_median_chunk_matches_a_direct_shuffle(monkeypatch):
+    rng = np.random.default_rng(3)
+    exposed, control = np.round(rng.exponential(3, 9), 1), np.round(rng.exponential(3, 14), 1)
+    monkeypatch.setattr(resampling, '_exposed', exposed)
+    monkeypatch.setattr(resampling, '_control', control)
+    seed = np.random.SeedSequence(7)
+    diffs = resampling._permutation_median_chunk((seed, 20))
+
+    # same draws as the chunk: the exposed positions in the sorted pooled sample, the rest is control
+    pooled = np.sort(np.concatenate([exposed, control]))
+    draws = np.random.default_rng(seed)
+    for diff in diffs:
+        positions = draws.choice(len(pooled), len(exposed), replace=False)
+        rest = np.setdiff1d(np.arange(len(pooled)), positions)
+        assert diff == pytest.approx(np.median(pooled[positions]) - np.median(pooled[rest]))
+
+
+def test_permutation_median_diff():
+    data = make_data()
+    shifted = resampling.permutation_median_diff(data, 'icu_los_days', 2000, alternative='greater', seed=0)
+    assert shifted.pval < 0.01
+    null = resampling.permutation_median_diff(data, '30day_mortality', 500, seed=0)
+    assert null.pval > 0.05
+    assert resampling.permutation_median_diff(data, 'icu_los_days', 2000, 'greater', seed=0) == shifted
+    with pytest.raises(ValueError):
+        resampling.permutation_median_diff(data, 'icu_los_days', 10, alternative='bigger')
+
+
+def test_odds_ratio_intervals():
+    data = make_data()
+    exposed, control = data.opiate.data['30day_mortality'], data.non_opiates.data['30day_mortality']
+    et, ef, ct, cf = exposed.sum(), (exposed == 0).sum(), control.sum(), (control == 0).sum()
+    interval = resampling.bootstrap_odds_ratio(data, '30day_mortality', 2000, seed=1)
+    assert interval.estimate == pytest.approx(et * cf / float(ef * ct))
+    assert interval.ci_lower < interval.estimate < interval.ci_upper
+    assert interval == resampling.bootstrap_odds_ratio(data, '30day_mortality', 2000, seed=1)
+    test = resampling.permutation_odds_ratio(data, '30day_mortality', 2000, seed=1)
+    assert test.estimate == pytest.approx(interval.estimate)
+    assert 0 < test.pval <= 1
+
+
+def test_chunk_sizes_cover_every_resample():
+    data = make_data()
+    for n_resamples in (1, 63, 64, 65, 200):
+        interval = resampling.bootstrap_median_diff(data, 'icu_los_days', n_resamples, chunk_size=64, seed=0)
+        assert interval.n_resamples == n_resamples
@@ -0,0 +1,33 @@
+"""search() summary files are the same however the notes are fed: deduplicated or not, from a frame or a note store."""
+import itertools
+
+import pytest
+
+import finddrugs_refactor
+import notestore
+
+
+def run_search(notes, druglist_file, path, **options):
+    finddrugs_refactor.search(notes, druglist_file, SUMMARY_FILE=str(path), **options)
+    with open(str(path), 'rb') as f_in:
+        return f_in.read()
+
+
+@pytest.mark.parametrize('match_mode', finddrugs_refactor.MATCH_MODES)
+def test_dedup_leaves_output_unchanged(tmp_path, monkeypatch, notes, druglist_file, match_mode):
+    assert notes.text.duplicated().any()
+    deduplicated = run_search(notes, druglist_file, tmp_path / 'dedup.csv', MATCH_MODE=match_mode)
+    # a fresh digest per note parses every row again, as before deduplication
+    counter = itertools.count()
+    monkeypatch.setattr(finddrugs_refactor, 'noteDigest', lambda text: next(counter))
+    every_row = run_search(notes, druglist_file, tmp_path / 'every_row.csv', MATCH_MODE=match_mode)
+    assert next(counter) == len(notes)
+    assert deduplicated == every_row
+    assert deduplicated.count(b'\n') == len(notes) + 1
+
+
+def test_existing_summary_file_is_not_overwritten(tmp_path, notes, druglist_file):
+    path = tmp_path / 'out.csv'
+    path.write_text('keep me')
+    finddrugs_refactor.search(notes, druglist_file, SUMMARY_FILE=str(path))
+    assert path.read_text() == 'keep me'
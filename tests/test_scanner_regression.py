@@ -0,0 +1,87 @@
+"""Scanner regression check: reading both summary schemas, (row_id, occurrence) alignment and the engine runs."""
+import os
+
+import pytest
+
+import finddrugs_refactor as finder
+import scanner_regression
+
+OLD_HEADER = '"ROW_ID","SUBJECT_ID","HADM_ID","GEN_OPIATES_FOUND","OPIATES","MISC","morphine","fentanyl"\n'
+NEW_HEADER = '"row_id","subject_id","hadm_id","opiates","morphine","fentanyl"\n'
+
+
+def write(tmp_path, name, text):
+    path = str(tmp_path / name)
+    with open(path, 'w') as f:
+        f.write(text)
+    return path
+
+
+def test_phantom_misc_column_is_dropped(tmp_path):
+    # 8 names, 7 fields: the MISC list was empty
+    df = scanner_regression.read_output(write(tmp_path, 'old.csv', OLD_HEADER + '1,3,10,0,1,1,0\n2,3,11,0,0,0,1\n'))
+    assert list(df.columns) == ['subject_id', 'hadm_id', 'gen_opiates_found', 'opiates', 'morphine', 'fentanyl']
+    assert df.loc[(1, 0), 'morphine'] == 1 and df.loc[(2, 0), 'fentanyl'] == 1
+
+
+def test_misc_column_with_values_is_kept(tmp_path):
+    df = scanner_regression.read_output(write(tmp_path, 'old.csv', OLD_HEADER + '1,3,10,0,1,4,1,0\n'))
+    assert df.loc[(1, 0), 'misc'] == 4 and df.loc[(1, 0), 'morphine'] == 1
+
+
+def test_field_count_mismatch(tmp_path):
+    with pytest.raises(ValueError, match='header has 6 names but rows have 5 fields'):
+        scanner_regression.read_output(write(tmp_path, 'bad.csv', NEW_HEADER + '1,3,10,1,1\n'))
+
+
+def test_header_only(tmp_path):
+    df = scanner_regression.read_output(write(tmp_path, 'empty.csv', NEW_HEADER))
+    assert df.empty and list(df.columns) == ['subject_id', 'hadm_id', 'opiates', 'morphine', 'fentanyl']
+
+
+def test_repeated_row_ids_align_by_occurrence(tmp_path):
+    reference = scanner_regression.read_output(write(tmp_path, 'reference.csv', NEW_HEADER +
+                                                     '1,3,10,1,1,0\n1,3,10,0,0,0\n2,3,11,0,0,1\n4,5,12,0,0,0\n'))
+    candidate = scanner_regression.read_output(write(tmp_path, 'candidate.csv', OLD_HEADER +
+                                                     '1,3,10,0,1,1,0\n2,3,11,0,0,0,0\n1,3,10,0,0,1,0\n'
+                                                     '1,3,10,0,0,0,0\n'))
+    assert list(candidate.index) == [(1, 0), (2, 0), (1, 1), (1, 2)]
+
+    comparison = scanner_regression.compare(reference, candidate)
+    assert comparison.rows == 3
+    assert (comparison.only_reference, comparison.only_candidate) == (1, 1)
+    assert comparison.columns_only_reference == []
+    assert comparison.columns_only_candidate == ['gen_opiates_found']
+    counts = comparison.disagreements.set_index('column')
+    # (1, 1): morphine 0 vs 1, (2, 0): fentanyl 1 vs 0
+    assert counts.disagreements.to_dict() == {'subject_id': 0, 'hadm_id': 0, 'opiates': 0, 'morphine': 1, 'fentanyl': 1}
+    assert counts.loc['morphine', 'sample_row_ids'] == [1]
+    assert counts.loc['fentanyl', 'sample_row_ids'] == [2]
+    assert counts.loc['fentanyl', 'rate'] == pytest.approx(1 / 3.0)
+
+
+def test_reference_files():
+    old = scanner_regression.read_output(scanner_regression.REFERENCES['finddrugs'])
+    new = scanner_regression.read_output(scanner_regression.REFERENCES['finddrugs_refactor'])
+    assert len(old) == len(new) == 36888
+    assert 'misc' not in old and set(old.columns) - set(new.columns) == {'gen_opiates_found'}
+    assert (old.index.get_level_values(scanner_regression.OCCURRENCE) > 0).sum() == 1560
+    comparison = scanner_regression.compare(new, old)
+    assert comparison.rows == 36888 and comparison.only_reference == comparison.only_candidate == 0
+
+
+def test_regress(tmp_path, notes, druglist_file):
+    notes_path = str(tmp_path / 'notes.csv')
+    notes.to_csv(notes_path, index=False)
+    reference = str(tmp_path / 'reference.csv')
+    finder.search(notes, druglist_file, SUMMARY_FILE=reference)
+
+    summary, comparisons = scanner_regression.regress(notes_path, reference, ['substring', 'parallel', 'token'],
+                                                      druglist_file, str(tmp_path), n_jobs=2)
+    summary = summary.set_index('engine')
+    assert summary.loc['substring', 'matches_reference'] and summary.loc['parallel', 'matches_reference']
+    assert (summary.notes == len(notes)).all() and (summary.missing_notes == 0).all()
+    # token mode adds a confidence column per drug
+    confidence = comparisons['token'].columns_only_candidate
+    assert confidence and all(col.endswith('_confidence') for col in confidence)
+    assert os.path.isfile(str(tmp_path / 'regression_parallel.csv'))
@@ -0,0 +1,103 @@
+"""isSectionHeader agrees with the original HEADER_PATTERN (findHeaderMismatches) on representative and adversarial lines."""
+import itertools
+import random
+
+import pytest
+
+import finddrugs_refactor
+
+MAX_LINE_LENGTH = 200
+
+HEADERS = [
+    'Medications on Admission:',
+    'Discharge Medications:',
+    'Past Medical History:',
+    'History of Present Illness:',
+    'MEDICATIONS ON ADMISSION:',
+    'medications on admission:',
+    '1. Medications on Admission:',
+    'A) Allergies:',
+    '2) Past medical history: htn, dm',
+    '   Discharge Medications:',
+    '\tDischarge Medications:',
+    '1.\tDischarge Medications:',
+    ' \t Discharge   Medications  :',
+    'Medications at home WERE aspirin',
+    'Her medications IS unknown',
+    'The medications ARE listed below',
+    'Home meds INCLUDED oxycodone',
+    'Home meds INCLUDING oxycodone',
+    'home meds were aspirin',
+    "Pt's meds (per family) [confirmed]:",
+    'B-12, D*3, 4.5:',
+    # INCLUDED/INCLUDING need no surrounding spaces
+    'Iswere arena included',
+]
+
+NOT_HEADERS = [
+    '',
+    ':',
+    ' ',
+    'Medications on Admission',
+    'medications on admission',
+    '1. Oxycodone 5 mg po q6h',
+    'Discharge Medications; see below',
+    'meds@home: none',
+    'meds\t: none',
+    'ISLAND WERE',
+    'WERE',
+    'x',
+    '1.',
+    'A)',
+]
+
+TERMINATORS = [':', ' WERE ', ' IS ', ' ARE ', 'INCLUDED', 'INCLUDING']
+
+
+def long_lines():
+    """lines over MAX_LINE_LENGTH: colon-less runs that backtrack in HEADER_PATTERN, and long headers"""
+    words = 'oxycodone 5 mg po q6h prn pain, ' * 20
+    return [words, words + ':', 'a' * 1000, 'a ' * 1000, '1. ' + 'a ' * 1000 + 'IS', '\t' * 300 + 'meds:',
+            ' ' * 500 + 'Discharge Medications:', '(' * 500, 'a' * 1000 + '@:', ('word ' * 300).upper() + 'WERE ']
+
+
+def fuzz_lines(n=3000, seed=0):
+    """random lines over the characters the pattern distinguishes"""
+    rng = random.Random(seed)
+    alphabet = ['a', 'Z', '1', '.', ')', '(', ' ', '\t', ':', ',', '-', '*', "'", '[', '@', ';', 'IS', 'WERE',
+                'ARE', 'INCLUDED', 'INCLUDING', 'were ']
+    return [''.join(rng.choice(alphabet) for _ in range(rng.randint(0, 12))) for _ in range(n)]
+
+
+def test_representative_headers():
+    assert finddrugs_refactor.findHeaderMismatches(HEADERS + NOT_HEADERS) == []
+    assert all(finddrugs_refactor.isSectionHeader(line) for line in HEADERS)
+    assert not any(finddrugs_refactor.isSectionHeader(line) for line in NOT_HEADERS)
+
+
+@pytest.mark.parametrize('numbering, space, terminator',
+                         list(itertools.product(['', '1.', 'A)', '9)', 'b.'], ['', ' ', '  ', '\t', ' \t '], TERMINATORS)))
+def test_numbering_space_and_terminators(numbering, space, terminator):
+    lines = [numbering + space + 'Discharge Medications' + terminator + ' morphine',
+             numbering + space + 'discharge medications' + terminator.lower(),
+             numbering + space + 'Discharge Medications' + terminator.strip()]
+    assert finddrugs_refactor.findHeaderMismatches(lines) == []
+
+
+def test_long_lines():
+    lines = long_lines()
+    assert all(len(line) > MAX_LINE_LENGTH for line in lines)
+    assert finddrugs_refactor.findHeaderMismatches(lines) == []
+
+
+def test_fuzz():
+    assert finddrugs_refactor.findHeaderMismatches(fuzz_lines()) == []
+
+
+def test_parse_note_counts_long_lines():
+    text = 'Medications on Admission:\n1. Oxycodone 5 mg\n' + '\n'.join(long_lines()) + '\n'
+    parsed = finddrugs_refactor.parseNote(text, {'oxycodone': 'oxycodone'}, {'oxycodone': 0},
+                                          MAX_LINE_LENGTH=MAX_LINE_LENGTH)
+    assert parsed.longLines == len(long_lines())
+    unlimited = finddrugs_refactor.parseNote(text, {'oxycodone': 'oxycodone'}, {'oxycodone': 0})
+    assert unlimited.longLines == 0
@@ -0,0 +1,76 @@
+"""Section index sidecar: write/read round trip, and the spans search() records line up with the note text."""
+import os
+
+import pandas as pd
+import pytest
+
+import druglist
+import finddrugs_refactor as finder
+import notestore
+import sectionindex
+
+
+def test_round_trip(tmp_path):
+    path = str(tmp_path / 'index.npz')
+    # notes 10 and 12 share block 0, block 1 has no drug mentions
+    sections = [[(2, 0, 40), (3, 40, 90)], [(1, 5, 20)]]
+    matches = [[(1, 10, 17), (0, 50, 58)], []]
+    sectionindex.write(path, [10, 11, 12], [1, 1, 2], [100, 101, 102], [0, 1, 0], ['morphine', 'fentanyl'],
+                       sections, matches)
+    index = sectionindex.SectionIndex(path)
+    assert len(index) == 3 and index.generics == ['morphine', 'fentanyl']
+    assert index.sections(12) == index.sections(10) == [('admit', 0, 40), ('discharge', 40, 90)]
+    assert index.sections(10, kind='discharge') == [('discharge', 40, 90)]
+    assert index.sections(11) == [('hist', 5, 20)]
+    assert index.matches(10) == [('fentanyl', 10, 17), ('morphine', 50, 58)]
+    assert index.matches(11) == []
+    assert list(index.columns['subject_id']) == [1, 1, 2]
+    with pytest.raises(KeyError):
+        index.sections(13)
+
+
+def test_empty_round_trip(tmp_path):
+    path = str(tmp_path / 'index.npz')
+    sectionindex.write(path, [], [], [], [], ['morphine'], [], [])
+    assert len(sectionindex.SectionIndex(path)) == 0
+
+
+def test_search_spans_slice_the_note_text(tmp_path, notes, druglist_file):
+    store = notestore.build(notes, str(tmp_path / 'notes'))
+    index_file = str(tmp_path / 'index.npz')
+    summary_file = str(tmp_path / 'summary.csv')
+    finder.search(store, DRUGLIST_FILE=druglist_file, SUMMARY_FILE=summary_file, SECTION_INDEX_FILE=index_file)
+    index = sectionindex.SectionIndex(index_file)
+    summary = pd.read_csv(summary_file)
+    names = druglist.load(druglist_file).names
+
+    assert list(index.row_ids) == list(notes.row_id)
+    assert index.generics == list(names)
+    assert summary[list(names)].eq(1).any().any()
+    # notes with the same text share one block
+    digests = store.index['digest']
+    blocks = index.columns['block']
+    assert len(set(blocks)) == len(set(digests))
+    assert all((blocks == block).sum() == (digests == digests[i]).sum() for i, block in enumerate(blocks))
+
+    for note, row in zip(store.itertuples(), summary.itertuples()):
+        text = note.text
+        sections = index.sections(note.row_id)
+        assert all(0 <= span.start <= span.end <= len(store.raw(note.Index)) for span in sections)
+        assert [span.start for span in sections] == sorted(span.start for span in sections)
+        admits = index.sections(note.row_id, kind='admit')
+        assert bool(admits) == bool(row.admit_found)
+        for match in index.matches(note.row_id):
+            assert index.read(store, note.row_id, match).lower() in names[match.generic]
+        # every drug flagged on admission has a mention inside an admission section
+        for generic in names:
+            if getattr(row, generic) == 1:
+                assert any(section.start <= match.start and match.end <= section.end
+                           for match in index.matches(note.row_id) if match.generic == generic
+                           for section in admits), (text, generic)
+    store.close()
+
+
+def test_search_without_index_writes_no_sidecar(tmp_path, notes, druglist_file):
+    finder.search(notes, DRUGLIST_FILE=druglist_file, SUMMARY_FILE=str(tmp_path / 'summary.csv'))
+    assert not any(name.endswith('.npz') for name in os.listdir(str(tmp_path)))
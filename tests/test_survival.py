@@ -0,0 +1,32 @@
+"""survival imports without matplotlib/scipy, and its log-rank and plot still load them when called."""
+import os
+import subprocess
+import sys
+
+import numpy as np
+import pandas as pd
+
+import analysis_helper
+import survival
+
+SCRIPTS = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts')
+
+
+def test_import_defers_matplotlib_and_scipy():
+    code = "import sys, survival; print(','.join(sorted(set(['matplotlib', 'scipy']) & set(sys.modules))))"
+    loaded = subprocess.check_output([sys.executable, '-c', code], cwd=SCRIPTS).decode('utf-8').strip()
+    assert loaded == ''
+
+
+def test_logrank_and_plot(monkeypatch):
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({'opiates': np.repeat([0, 1], 50),
+                       'death_days_since_hospital': np.r_[rng.exponential(400, 50), rng.exponential(100, 50)]})
+    data = analysis_helper.Data(df=df)
+    result = survival.do_logrank(data)
+    assert result.dof == 1 and 0 <= result.pval < 0.05
+
+    import matplotlib.pyplot as plt
+    monkeypatch.setattr(plt, 'show', lambda: None)
+    survival.plot_survival(data)
+    plt.close('all')